@@ -1,19 +1,38 @@
-from flask import Flask, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, g, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, or_, and_
-from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required, JWTManager
+from sqlalchemy import func, or_, and_, select, insert, update, case, event, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from flask_jwt_extended import create_access_token, get_jwt_identity, get_jwt, jwt_required, JWTManager
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import io
+import base64
 import csv
+import codecs
 import json
 import re
+import zlib
 import logging
+import threading
+import queue
+import atexit
+import time
+import uuid
+import tempfile
+import functools
+import hashlib
+import sqlite3
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 import requests as http_requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
+from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta
-from decimal import Decimal, InvalidOperation
+from decimal import Decimal, InvalidOperation, ROUND_UP
 
 load_dotenv()
 
@@ -78,6 +97,7 @@ class Org(db.Model):
     org_email = db.Column(db.String(100))
     latCoord = db.Column(db.Numeric(10, 8))
     longCoord = db.Column(db.Numeric(11, 8))
+    geocode_token = db.Column(db.String(32))  # the pending background lookup, see apply_org_location
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -92,6 +112,9 @@ class Dish(db.Model):
     dishID = db.Column(db.Integer, primary_key=True)
     dishName = db.Column(db.String(100), nullable=False)
     orgID = db.Column(db.Integer, db.ForeignKey('orgs.orgID'))
+    __table_args__ = (
+        db.Index('ix_dishes_org_name', 'orgID', 'dishName'),
+    )
 
 class Ingredient(db.Model):
     __tablename__ = 'ing'
@@ -101,6 +124,41 @@ class Ingredient(db.Model):
     expiry = db.Column(db.Date)
     batchNum = db.Column(db.String(50))
     orgID = db.Column(db.Integer, db.ForeignKey('orgs.orgID'))
+    # Generated by MySQL so the master/batch split can be served from an index.
+    is_batch = db.Column(db.Boolean, db.Computed("expiry IS NOT NULL OR batchNum IS NOT NULL", persisted=False))
+    __table_args__ = (
+        db.Index('ix_ing_org_batch_expiry', 'orgID', 'is_batch', 'expiry'),
+        db.Index('ix_ing_org_name_category', 'orgID', 'ingName', 'category', 'is_batch'),
+    )
+
+# Master ingredient types only; legacy batch rows (see Ingredient.is_batch) are
+# moved to stock_batches by migration 0002.
+IS_MASTER = Ingredient.is_batch == False  # noqa: E712
+
+class StockBatch(db.Model):
+    """A received lot of one master ingredient, with its on-hand quantity."""
+    __tablename__ = 'stock_batches'
+    batchID = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    orgID = db.Column(db.Integer, db.ForeignKey('orgs.orgID'), nullable=False)
+    masterIngID = db.Column(db.Integer, db.ForeignKey('ing.ingID'), nullable=False)
+    qty = db.Column(db.Numeric(12, 3), nullable=False, default=0)
+    unit = db.Column(db.String(20), nullable=False)
+    expiry = db.Column(db.Date)
+    batchNum = db.Column(db.String(50))
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_stock_batches_org_expiry', 'orgID', 'expiry'),
+        db.Index('ix_stock_batches_org_master_expiry', 'orgID', 'masterIngID', 'expiry'),
+    )
+
+class StockOnHand(db.Model):
+    """Running total of stock_batches.qty per (master ingredient, unit)."""
+    __tablename__ = 'stock_on_hand'
+    orgID = db.Column(db.Integer, db.ForeignKey('orgs.orgID'), primary_key=True)
+    masterIngID = db.Column(db.Integer, db.ForeignKey('ing.ingID'), primary_key=True)
+    unit = db.Column(db.String(20), primary_key=True)
+    qty = db.Column(db.Numeric(14, 3), nullable=False, default=0)
+    batchCount = db.Column(db.Integer, nullable=False, default=0)
 
 class DishIngredient(db.Model):
     __tablename__ = 'dish_ing'
@@ -121,6 +179,46 @@ class AuditLog(db.Model):
     resource_id = db.Column(db.Integer, nullable=True)
     details = db.Column(db.Text, nullable=True)              # JSON string with extra context
     ip_address = db.Column(db.String(45), nullable=True)
+    __table_args__ = (
+        db.Index('ix_audit_logs_org_ts', 'orgID', 'timestamp'),
+        db.Index('ix_audit_logs_org_action_ts', 'orgID', 'action', 'timestamp'),
+    )
+
+
+class ConsumptionLedger(db.Model):
+    """One row per stock deduction written by /stock/consume."""
+    __tablename__ = 'consumption_ledger'
+    entryID = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    orgID = db.Column(db.Integer, db.ForeignKey('orgs.orgID'), nullable=False)
+    logID = db.Column(db.Integer, nullable=True)      # CONSUME audit row this came from
+    dishID = db.Column(db.Integer, nullable=True)
+    batchIngID = db.Column(db.Integer, nullable=True)  # stock_batches.batchID; NULL for rows rebuilt from audit history
+    ingName = db.Column(db.String(100), nullable=False)
+    category = db.Column(db.String(50), nullable=False, default='')
+    unit = db.Column(db.String(20), nullable=False, default='')
+    qty = db.Column(db.Numeric(12, 3), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_consumption_ledger_org_day', 'orgID', 'day'),
+        db.Index('ix_consumption_ledger_log', 'logID'),
+    )
+
+
+class ConsumptionDaily(db.Model):
+    """Per-org, per-ingredient, per-day rollup of ConsumptionLedger."""
+    __tablename__ = 'consumption_daily'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    orgID = db.Column(db.Integer, db.ForeignKey('orgs.orgID'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    ingName = db.Column(db.String(100), nullable=False)
+    category = db.Column(db.String(50), nullable=False, default='')
+    unit = db.Column(db.String(20), nullable=False, default='')
+    qty = db.Column(db.Numeric(14, 3), nullable=False, default=0)
+    __table_args__ = (
+        db.UniqueConstraint('orgID', 'day', 'ingName', 'category', 'unit',
+                            name='uq_consumption_daily_key'),
+    )
 
 
 class OrgSettings(db.Model):
@@ -130,6 +228,169 @@ class OrgSettings(db.Model):
     settings_json = db.Column(db.Text, nullable=False, default='{}')
 
 
+class GeocodeCache(db.Model):
+    """Address -> coordinates lookups, keyed by a hash of the normalized address."""
+    __tablename__ = 'geocode_cache'
+    addressKey = db.Column(db.String(64), primary_key=True)
+    address = db.Column(db.String(255), nullable=False)
+    latCoord = db.Column(db.Numeric(10, 8), nullable=True)   # NULL: geocoder found nothing
+    longCoord = db.Column(db.Numeric(11, 8), nullable=True)
+    provider = db.Column(db.String(20), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ImportJob(db.Model):
+    """Progress and outcome of a background CSV import (see /import/jobs)."""
+    __tablename__ = 'import_jobs'
+    jobID = db.Column(db.String(32), primary_key=True)
+    orgID = db.Column(db.Integer, db.ForeignKey('orgs.orgID'), nullable=False)
+    userID = db.Column(db.Integer, db.ForeignKey('users.userID'), nullable=True)
+    kind = db.Column(db.String(20), nullable=False)          # ingredients | dishes | stock
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text, nullable=True)               # JSON list of {line, error}
+    message = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)     # last sign of life from the worker
+    __table_args__ = (
+        db.Index('ix_import_jobs_org_created', 'orgID', 'created_at'),
+    )
+
+
+CACHE_REGISTRY = {}  # name -> TTLCache, reported by /metrics/cache
+
+
+class TTLCache:
+    """
+    Small thread-safe, size-bounded LRU cache with per-entry expiry.
+
+    Process-local: each gunicorn worker holds its own copy, so a TTL bounds
+    how long another worker can serve a value after it was invalidated.
+    Every instance registers itself in CACHE_REGISTRY for /metrics/cache.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl_seconds=60):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        CACHE_REGISTRY[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl_seconds=None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttlSeconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key: the first caller runs the
+    function, everyone else arriving before it finishes waits and gets the
+    same result (or exception) instead of repeating the work.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> [Event, result, exception]
+
+    def do(self, key, func):
+        """Return (result, shared) where ``shared`` is True for callers that waited."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1], True
+        try:
+            call[1] = func()
+            return call[1], False
+        except Exception as exc:
+            call[2] = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call[0].set()
+
+
+class RateLimiter:
+    """Token bucket: ``rate`` calls per second on average, bursts up to ``burst``."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=0):
+        """Take a token, waiting up to ``timeout`` seconds; False if none became available."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
 DEFAULT_SETTINGS = {
     "expiringSoonDays": 3,
     "overstockThreshold": 10,
@@ -140,11 +401,22 @@ DEFAULT_SETTINGS = {
     "currency": "USD",
     "timezone": "America/New_York",
     "supplierLeadTimeDays": 3,
+    "ingredientDensities": {},  # {ingName: g per ml}, see UnitRegistry
 }
 
 
+_org_settings_cache = TTLCache(
+    "org_settings",
+    maxsize=4096,
+    ttl_seconds=int(os.getenv("ORG_SETTINGS_CACHE_TTL_SECONDS", "60")),
+)
+
+
 def get_org_settings(org_id):
     """Return merged settings dict for an org (defaults + overrides)."""
+    cached = _org_settings_cache.get(org_id)
+    if cached is not None:
+        return dict(cached)
     row = OrgSettings.query.filter_by(orgID=org_id).first()
     merged = dict(DEFAULT_SETTINGS)
     if row and row.settings_json:
@@ -153,12 +425,227 @@ def get_org_settings(org_id):
             merged.update(overrides)
         except (json.JSONDecodeError, TypeError):
             pass
-    return merged
+    _org_settings_cache.set(org_id, merged)
+    return dict(merged)
+
+
+def invalidate_org_settings(org_id):
+    _org_settings_cache.pop(org_id)
+
+
+# --- Background Work ---
+
+background_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BACKGROUND_WORKERS", "4")),
+    thread_name_prefix="background",
+)
+
+
+def submit_background(func, *args, **kwargs):
+    """
+    Run ``func`` on the shared background pool inside a fresh app context.
+    Exceptions are logged; callers that need the outcome persist it
+    themselves (e.g. ImportJob rows).
+    """
+    def run():
+        with app.app_context():
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                app.logger.exception("Background task %s failed", getattr(func, "__name__", func))
+                db.session.rollback()
+            finally:
+                db.session.remove()
+    return background_executor.submit(run)
+
+
+# --- Table Versions ---
+#
+# Every committed INSERT/UPDATE/DELETE bumps an in-process version counter
+# for the table it wrote, whichever code path issued it (ORM flush, bulk
+# insert, raw SQL). Caches of query results remember the versions of the
+# tables they read and treat any change as a miss; writes from other
+# workers are only bounded by the caches' TTL.
+
+_DML_TABLE_RE = re.compile(
+    r"^\s*(?:INSERT(?:\s+IGNORE)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+IGNORE)?|DELETE(?:\s+\w+)?\s+FROM)\s+`?(\w+)`?",
+    re.IGNORECASE,
+)
+_table_versions = {}
+_table_versions_lock = threading.Lock()
+
+
+def table_versions(tables):
+    with _table_versions_lock:
+        return tuple(_table_versions.get(table, 0) for table in sorted(tables))
+
+
+def bump_table_versions(tables):
+    with _table_versions_lock:
+        for table in tables:
+            _table_versions[table] = _table_versions.get(table, 0) + 1
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _track_written_tables(conn, cursor, statement, parameters, context, executemany):
+    match = _DML_TABLE_RE.match(statement)
+    if match:
+        conn.info.setdefault("written_tables", set()).add(match.group(1).lower())
+
+
+@event.listens_for(Engine, "commit")
+def _bump_written_tables(conn):
+    written = conn.info.pop("written_tables", None)
+    if written:
+        bump_table_versions(written)
+
+
+@event.listens_for(Engine, "rollback")
+def _forget_written_tables(conn):
+    conn.info.pop("written_tables", None)
+
+
+class StaleWhileRevalidateCache(TTLCache):
+    """
+    TTLCache for slow, expensive lookups (LLM calls) that may serve stale
+    values while a background refresh runs.
+
+    An entry is fresh for ``fresh_seconds``; after that, until
+    ``stale_seconds``, it is still returned immediately and one refresh per
+    key is queued on the background pool. With ``sqlite_path`` set, values
+    also go to an on-disk SQLite tier that survives restarts and is shared
+    by every worker on the host.
+    """
+
+    def __init__(self, name, maxsize=512, fresh_seconds=3600, stale_seconds=86400, sqlite_path=None):
+        super().__init__(name, maxsize=maxsize, ttl_seconds=stale_seconds)
+        self.fresh_seconds = fresh_seconds
+        self.sqlite_path = sqlite_path
+        self._refreshing = set()
+        self.stale_hits = 0
+        self.disk_hits = 0
+        self.refreshes = 0
+        if sqlite_path:
+            with self._disk() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache "
+                    "(key TEXT PRIMARY KEY, stored_at REAL NOT NULL, value TEXT NOT NULL)"
+                )
+
+    @staticmethod
+    def make_key(*parts):
+        """Content address for ``parts`` (anything JSON-serialisable)."""
+        raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk(self):
+        return sqlite3.connect(self.sqlite_path, timeout=5)
+
+    def _lookup(self, key):
+        """Return (stored_at, value) from memory, then disk, or None."""
+        item = self.get(key)
+        if item is not None or not self.sqlite_path:
+            return item
+        try:
+            with self._disk() as conn:
+                row = conn.execute("SELECT stored_at, value FROM cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            app.logger.exception("%s: SQLite read failed", self.name)
+            return None
+        if not row or time.time() - row[0] >= self.ttl_seconds:
+            return None
+        self.disk_hits += 1
+        item = (row[0], json.loads(row[1]))
+        self.set(key, item, ttl_seconds=self.ttl_seconds - (time.time() - row[0]))
+        return item
+
+    def store(self, key, value):
+        item = (time.time(), value)
+        self.set(key, item)
+        if self.sqlite_path:
+            try:
+                with self._disk() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cache (key, stored_at, value) VALUES (?, ?, ?)",
+                        (key, item[0], json.dumps(value, default=str)),
+                    )
+                    conn.execute("DELETE FROM cache WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+            except sqlite3.Error:
+                app.logger.exception("%s: SQLite write failed", self.name)
+
+    def get_or_compute(self, key, compute):
+        """
+        Return (value, state) where state is "hit", "stale" or "miss".
+        ``compute()`` runs inline on a miss and in the background when stale.
+        """
+        item = self._lookup(key)
+        if item is None:
+            value = compute()
+            self.store(key, value)
+            return value, "miss"
+        stored_at, value = item
+        if time.time() - stored_at < self.fresh_seconds:
+            return value, "hit"
+        with self._lock:
+            self.stale_hits += 1
+            start_refresh = key not in self._refreshing
+            self._refreshing.add(key)
+        if start_refresh:
+            submit_background(self._refresh, key, compute)
+        return value, "stale"
+
+    def _refresh(self, key, compute):
+        try:
+            self.store(key, compute())
+            self.refreshes += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            "freshSeconds": self.fresh_seconds,
+            "staleHits": self.stale_hits,
+            "diskHits": self.disk_hits,
+            "refreshes": self.refreshes,
+            "sqlite": bool(self.sqlite_path),
+        })
+        return stats
+
+
+# Days of audit history kept in MySQL; older months are moved to compressed
+# files by archive_audit_logs.py. 0 keeps everything online.
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "0"))
+
+
+def audit_retention_cutoff():
+    """Oldest timestamp still held in audit_logs, or None when retention is off."""
+    if AUDIT_RETENTION_DAYS <= 0:
+        return None
+    return datetime.utcnow() - timedelta(days=AUDIT_RETENTION_DAYS)
+
+
+def audit_window(query, start=None, end=None):
+    """
+    Bound an AuditLog query to [start, end), never reaching past the
+    retention horizon. Always bounding the timestamp lets MySQL prune the
+    monthly partitions of audit_logs instead of scanning all of them.
+    """
+    cutoff = audit_retention_cutoff()
+    if cutoff and (start is None or start < cutoff):
+        start = cutoff
+    if start is not None:
+        query = query.filter(AuditLog.timestamp >= start)
+    if end is not None:
+        query = query.filter(AuditLog.timestamp < end)
+    return query
 
 
 def record_audit(action, resource_type, resource_id=None, details=None,
                  user_id=None, org_id=None):
-    """Write a row to the audit_logs table."""
+    """Write a row to the audit_logs table and return it (None on failure)."""
     try:
         entry = AuditLog(
             timestamp=datetime.utcnow(),
@@ -174,18 +661,279 @@ def record_audit(action, resource_type, resource_id=None, details=None,
         # Don't commit here — let the caller's commit include this row.
         # If the caller rolls back, the audit entry is also rolled back (correct).
         db.session.flush()
+        return entry
     except Exception:
         app.logger.exception("Failed to write audit log")
+        return None
+
+
+# "transactional" writes every audit row inside the request's transaction.
+# "buffered" lets record_audit_detached() hand rows to AuditWriter instead.
+AUDIT_WRITE_MODE = os.getenv("AUDIT_WRITE_MODE", "transactional").strip().lower()
+
+
+class AuditWriter:
+    """
+    Background writer that bulk-inserts audit rows in batches.
+
+    submit() appends the row to a per-process spool file before queueing
+    it, so rows still in memory when a worker dies are replayed by the next
+    process to start (see recover_orphaned_spools). The spool is truncated
+    once every submitted row has been written. A replay only inserts as
+    many copies of each row as the table is still missing, keeping delivery
+    effectively once.
+    """
+
+    def __init__(self, spool_dir, batch_size=200, flush_interval=1.0):
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._pid = None
+        self._thread = None
+
+    @property
+    def spool_path(self):
+        return os.path.join(self.spool_dir, f"audit-spool-{os.getpid()}.ndjson")
+
+    def submit(self, row):
+        self._ensure_started()
+        line = json.dumps(row, default=str)
+        with self._lock:
+            with open(self.spool_path, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+            self._pending += 1
+            self._queue.put(row)
+
+    def flush(self):
+        """Synchronously write everything still queued (used at exit)."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so gunicorn workers start their own.
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            os.makedirs(self.spool_dir, exist_ok=True)
+            # Nothing of ours is queued yet, so a spool under our pid was left
+            # by an earlier process that had the same pid (e.g. a restarted
+            # container). Set it aside for replay before we append to it.
+            if os.path.exists(self.spool_path) and os.path.getsize(self.spool_path):
+                os.rename(self.spool_path, f"{self.spool_path}.replay-{os.getpid()}")
+            self._queue = queue.Queue()
+            self._pending = 0
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+        self.recover_orphaned_spools()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if not self._write(batch):
+                time.sleep(self.flush_interval)
+                for row in batch:
+                    self._queue.put(row)
+
+    def _write(self, batch, dedupe=False):
+        with app.app_context():
+            try:
+                rows = [self._coerce(row) for row in batch]
+                if dedupe:
+                    rows = self._missing(rows)
+                if rows:
+                    db.session.bulk_insert_mappings(AuditLog, rows)
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Buffered audit write failed (%d rows)", len(batch))
+                return False
+        if dedupe:
+            return True
+        with self._lock:
+            self._pending -= len(batch)
+            if self._pending <= 0:
+                self._pending = 0
+                open(self.spool_path, "w").close()
+        return True
+
+    @staticmethod
+    def _coerce(row):
+        row = dict(row)
+        if isinstance(row.get("timestamp"), str):
+            row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+        if isinstance(row.get("timestamp"), datetime):
+            # audit_logs.timestamp holds whole seconds; drop the fraction here so
+            # the insert and a replay's comparison see the same value.
+            row["timestamp"] = row["timestamp"].replace(microsecond=0)
+        return row
+
+    _REPLAY_COLUMNS = ("timestamp", "orgID", "userID", "action", "resource_type",
+                       "resource_id", "details", "ip_address")
+
+    @classmethod
+    def _missing(cls, rows):
+        """
+        The rows of a replayed spool the table doesn't have yet. Identical
+        events in the same second are legitimate, so each distinct row is
+        written as many times as the spool has it minus the table's copies.
+        """
+        counts = OrderedDict()
+        for row in rows:
+            key = tuple(row.get(column) for column in cls._REPLAY_COLUMNS)
+            counts.setdefault(key, []).append(row)
+        missing = []
+        for key, group in counts.items():
+            stored = db.session.query(func.count(AuditLog.logID)).filter(*[
+                getattr(AuditLog, column) == value for column, value in zip(cls._REPLAY_COLUMNS, key)
+            ]).scalar()
+            missing.extend(group[stored:])
+        return missing
+
+    def recover_orphaned_spools(self):
+        """Replay spool files left behind by processes that are no longer running."""
+        try:
+            names = os.listdir(self.spool_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            # audit-spool-<pid>.ndjson, or one a replaying process claimed as
+            # audit-spool-<pid>.ndjson.replay-<claimer>
+            match = re.fullmatch(r"(audit-spool-\d+\.ndjson)(?:\.replay-(\d+))?", name)
+            if not match:
+                continue
+            source, claimer = match.group(1), match.group(2)
+            if claimer is None:
+                owner = int(re.search(r"\d+", source).group())
+                if owner == os.getpid() or _pid_alive(owner):
+                    continue
+            elif int(claimer) != os.getpid() and _pid_alive(int(claimer)):
+                continue
+            # A claim under our own pid is either ours from _ensure_started or
+            # left by an earlier process with the same pid; replay it either way.
+            claimed = os.path.join(self.spool_dir, f"{source}.replay-{os.getpid()}")
+            if claimed != os.path.join(self.spool_dir, name):
+                try:
+                    os.rename(os.path.join(self.spool_dir, name), claimed)  # only one process wins
+                except OSError:
+                    continue
+            with open(claimed, encoding="utf-8") as fh:
+                rows = [json.loads(line) for line in fh if line.strip()]
+            if not rows or self._write(rows, dedupe=True):
+                os.remove(claimed)
+                app.logger.info("Replayed %d spooled audit rows from %s", len(rows), name)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+audit_writer = AuditWriter(
+    spool_dir=os.getenv("AUDIT_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool")),
+    batch_size=int(os.getenv("AUDIT_BATCH_SIZE", "200")),
+    flush_interval=float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "1.0")),
+)
+atexit.register(audit_writer.flush)
+
+
+def record_audit_detached(action, resource_type, resource_id=None, details=None,
+                          user_id=None, org_id=None):
+    """
+    Record an audit row that need not be atomic with the request's own
+    writes (logins, exports, chat). In buffered mode the row goes to the
+    background AuditWriter and no transaction is opened; otherwise it is
+    written and committed inline like before.
+    """
+    if AUDIT_WRITE_MODE != "buffered":
+        if record_audit(action, resource_type, resource_id=resource_id, details=details,
+                        user_id=user_id, org_id=org_id):
+            db.session.commit()
+        return
+    try:
+        audit_writer.submit({
+            "timestamp": datetime.utcnow().replace(microsecond=0),
+            "userID": user_id,
+            "orgID": org_id,
+            "action": action,
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "details": json.dumps(details, default=str) if details else None,
+            "ip_address": request.remote_addr if request else None,
+        })
+    except Exception:
+        app.logger.exception("Failed to queue audit log")
+
+
+Identity = namedtuple("Identity", ["userID", "orgID"])
+
+
+def identity_claims(user):
+    """JWT claims embedded at login so org-scoped routes can skip the User lookup."""
+    return {"orgID": user.orgID}
+
+
+def current_identity():
+    """
+    Return the (userID, orgID) of the request's token from its claims, for
+    routes that only scope by org. Roles can change while a token is live,
+    so admin checks (and anything needing the email) use get_current_user().
+    Tokens issued before the claims existed fall back to get_current_user().
+    """
+    if "identity" in g:
+        return g.identity
+    claims = get_jwt()
+    identity = None
+    if "orgID" in claims:
+        try:
+            identity = Identity(int(get_jwt_identity()), claims["orgID"])
+        except (TypeError, ValueError):
+            identity = None
+    if identity is None:
+        user = get_current_user()
+        identity = Identity(user.userID, user.orgID) if user else None
+    g.identity = identity
+    return identity
 
 
 def get_current_user():
+    """Resolve the token's User once per request; later calls reuse flask.g."""
+    if "current_user" in g:
+        return g.current_user
+    user = None
     user_id = get_jwt_identity()
-    if not user_id:
-        return None
-    try:
-        return User.query.get(int(user_id))
-    except (TypeError, ValueError):
-        return None
+    if user_id:
+        try:
+            user = db.session.get(User, int(user_id))
+        except (TypeError, ValueError):
+            user = None
+    g.current_user = user
+    return user
 
 
 def parse_date(value, field_name):
@@ -211,20 +959,811 @@ def parse_quantity(value, field_name):
         raise ValueError(f"{field_name} must be numeric") from exc
 
 
-STOCK_DISH_NAME = "__STOCK__"
+# --- Units of Measure ---
+
+# Canonical units: dimension and how many of the dimension's base unit
+# (g, ml, each) one of them is.
+UNITS = {
+    "mg": ("mass", "0.001"),
+    "g": ("mass", "1"),
+    "kg": ("mass", "1000"),
+    "oz": ("mass", "28.349523125"),
+    "lb": ("mass", "453.59237"),
+    "ml": ("volume", "1"),
+    "L": ("volume", "1000"),
+    "tsp": ("volume", "4.92892159375"),
+    "tbsp": ("volume", "14.78676478125"),
+    "fl oz": ("volume", "29.5735295625"),
+    "cup": ("volume", "236.5882365"),
+    "pt": ("volume", "473.176473"),
+    "qt": ("volume", "946.352946"),
+    "gal": ("volume", "3785.411784"),
+    "each": ("count", "1"),
+    "dozen": ("count", "12"),
+}
 
+UNIT_ALIASES = {
+    "milligram": "mg", "milligrams": "mg",
+    "gram": "g", "grams": "g", "gr": "g", "gm": "g",
+    "kgs": "kg", "kilo": "kg", "kilos": "kg", "kilogram": "kg", "kilograms": "kg",
+    "ozs": "oz", "ounce": "oz", "ounces": "oz",
+    "lbs": "lb", "pound": "lb", "pounds": "lb", "#": "lb",
+    "mls": "ml", "milliliter": "ml", "milliliters": "ml", "millilitre": "ml", "millilitres": "ml", "cc": "ml",
+    "l": "L", "ltr": "L", "liter": "L", "liters": "L", "litre": "L", "litres": "L",
+    "tsps": "tsp", "teaspoon": "tsp", "teaspoons": "tsp",
+    "tbs": "tbsp", "tbsps": "tbsp", "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "floz": "fl oz", "fl. oz": "fl oz", "fluid ounce": "fl oz", "fluid ounces": "fl oz",
+    "cups": "cup", "pint": "pt", "pints": "pt", "quart": "qt", "quarts": "qt",
+    "gals": "gal", "gallon": "gal", "gallons": "gal",
+    "ea": "each", "pc": "each", "pcs": "each", "piece": "each", "pieces": "each",
+    "unit": "each", "units": "each", "ct": "each", "count": "each",
+    "doz": "dozen", "dz": "dozen",
+}
+
+# g per ml, used to convert between weight and volume for one ingredient.
+# Orgs override or extend these with the ingredientDensities setting.
+DEFAULT_DENSITIES = {
+    "Water": 1.0,
+    "Milk": 1.03,
+    "Heavy Cream": 0.99,
+    "Butter": 0.91,
+    "Olive Oil": 0.91,
+    "Vegetable Oil": 0.92,
+    "Honey": 1.42,
+    "All-Purpose Flour": 0.53,
+    "Sugar": 0.85,
+    "Salt": 1.2,
+    "White Rice": 0.85,
+}
+
+
+class UnitRegistry:
+    """
+    Canonical units of measure and the conversions between them.
+
+    Spellings are normalised through UNIT_ALIASES ("lbs", "pounds" -> "lb").
+    Units of the same dimension convert through its base unit; weight and
+    volume convert into each other only for ingredients with a density.
+    A unit the registry doesn't know is its own dimension, so it still
+    matches itself exactly.
+    """
+
+    def __init__(self, units, aliases, densities=None):
+        self._config = (units, aliases)
+        self._units = {name: (dim, Decimal(factor)) for name, (dim, factor) in units.items()}
+        self._lookup = {name.lower(): name for name in units}
+        self._lookup.update({alias.lower(): name for alias, name in aliases.items()})
+        self._densities = {name.casefold(): Decimal(str(d)) for name, d in (densities or {}).items()}
+
+    def with_densities(self, overrides):
+        """A copy of the registry with per-ingredient densities added or replaced."""
+        registry = UnitRegistry(*self._config)
+        registry._densities = dict(self._densities)
+        registry._densities.update({name.casefold(): Decimal(str(d)) for name, d in overrides.items()})
+        return registry
+
+    def canonical(self, unit):
+        """Canonical spelling of ``unit``; unknown units come back stripped."""
+        unit = str(unit or "").strip()
+        return self._lookup.get(unit.lower(), unit)
+
+    def base(self, unit, ing_name=None):
+        """
+        (dimension, factor) taking a quantity in ``unit`` to its base unit.
+        Volumes of an ingredient with a known density report as mass.
+        """
+        name = self.canonical(unit)
+        dim, factor = self._units.get(name, (f"unit:{name}", Decimal(1)))
+        if dim == "volume" and ing_name:
+            density = self._densities.get(ing_name.casefold())
+            if density:
+                return "mass", factor * density
+        return dim, factor
+
+    def factor(self, from_unit, to_unit, ing_name=None):
+        """Multiplier from ``from_unit`` to ``to_unit``, or None if they don't convert."""
+        from_dim, from_factor = self.base(from_unit, ing_name)
+        to_dim, to_factor = self.base(to_unit, ing_name)
+        if from_dim != to_dim:
+            return None
+        return from_factor / to_factor
+
+    def convert(self, qty, from_unit, to_unit, ing_name=None):
+        factor = self.factor(from_unit, to_unit, ing_name)
+        return None if factor is None or qty is None else Decimal(str(qty)) * factor
+
+    def normalize(self, rows):
+        """
+        Fold (source, ingName, category, unit, qty) rows into one total per
+        ingredient and dimension, in a single pass.
+
+        Each (ingName, category, dimension) group is reported in the
+        canonical unit its rows use most (ties alphabetical), so "lb" and
+        "lbs" stock, or grams of a recipe against pounds of stock, land on
+        one key. Returns {source: {(ingName, category, unit): float}}.
+        """
+        groups = {}  # (ingName, category, dimension) -> (unit counts, {source: base qty})
+        for source, ing_name, category, unit, qty in rows:
+            dim, factor = self.base(unit, ing_name)
+            counts, totals = groups.setdefault((ing_name, category, dim), ({}, {}))
+            name = self.canonical(unit)
+            counts[name] = counts.get(name, 0) + 1
+            totals[source] = totals.get(source, Decimal("0")) + Decimal(str(qty or 0)) * factor
+        result = {}
+        for (ing_name, category, _), (counts, totals) in groups.items():
+            unit = min(counts, key=lambda name: (-counts[name], name))
+            _, factor = self.base(unit, ing_name)
+            for source, total in totals.items():
+                result.setdefault(source, {})[(ing_name, category, unit)] = float(total / factor)
+        return result
+
+
+unit_registry = UnitRegistry(UNITS, UNIT_ALIASES, DEFAULT_DENSITIES)
+
+
+def org_units(org_id):
+    """The unit registry with the org's ingredientDensities setting applied."""
+    overrides = get_org_settings(org_id).get("ingredientDensities") or {}
+    return unit_registry.with_densities(overrides) if overrides else unit_registry
+
+
+# --- Stock Batches ---
+
+STOCK_QTY_QUANTUM = Decimal("0.001")  # stock_batches.qty precision
+
+# FIFO order: soonest expiry first, undated batches last, oldest row breaks ties.
+STOCK_FIFO_ORDER = (StockBatch.expiry.is_(None), StockBatch.expiry.asc(), StockBatch.batchID.asc())
+
+
+def stock_batch_query(org_id):
+    """(StockBatch, ingName, category) rows for an org, joined to their master type."""
+    return (
+        db.session.query(StockBatch, Ingredient.ingName, Ingredient.category)
+        .join(Ingredient, and_(Ingredient.ingID == StockBatch.masterIngID, Ingredient.orgID == org_id))
+        .filter(StockBatch.orgID == org_id)
+    )
+
+
+def stock_delta(deltas, master_id, unit, qty, batches=0):
+    """Accumulate an on-hand change into ``deltas`` {(masterIngID, unit): (qty, batches)}."""
+    key = (master_id, unit)
+    old_qty, old_batches = deltas.get(key, (Decimal("0"), 0))
+    deltas[key] = (old_qty + Decimal(str(qty)), old_batches + batches)
+    return deltas
+
+
+def adjust_stock_on_hand(org_id, deltas):
+    """
+    Fold ``deltas`` (see stock_delta) into stock_on_hand with one upsert.
+
+    Every write to stock_batches calls this in the same transaction, so the
+    per-ingredient totals move with the batches they summarise. Rows are
+    written in key order to keep concurrent adjustments from deadlocking.
+    """
+    rows = [
+        {"orgID": org_id, "masterIngID": master_id, "unit": unit, "qty": qty, "batchCount": batches}
+        for (master_id, unit), (qty, batches) in sorted(deltas.items())
+        if qty or batches
+    ]
+    if not rows:
+        return
+    table = StockOnHand.__table__
+    stmt = mysql_insert(table).values(rows)
+    stmt = stmt.on_duplicate_key_update(
+        qty=table.c.qty + stmt.inserted.qty,
+        batchCount=table.c.batchCount + stmt.inserted.batchCount,
+    )
+    db.session.execute(stmt)
+
+
+def _stock_on_hand_from_batches(org_id):
+    return (
+        select(StockBatch.orgID, StockBatch.masterIngID, StockBatch.unit,
+               func.sum(StockBatch.qty), func.count())
+        .where(StockBatch.orgID == org_id)
+        .group_by(StockBatch.orgID, StockBatch.masterIngID, StockBatch.unit)
+    )
+
+
+def stock_on_hand_drift(org_id):
+    """
+    Compare the org's stock_on_hand rows with totals recomputed from
+    stock_batches. Returns one dict per (masterIngID, unit) that differs.
+    """
+    expected = {
+        (master_id, unit): (qty or Decimal("0"), count)
+        for _, master_id, unit, qty, count in db.session.execute(_stock_on_hand_from_batches(org_id)).all()
+    }
+    actual = {
+        (row.masterIngID, row.unit): (row.qty, row.batchCount)
+        for row in StockOnHand.query.filter(StockOnHand.orgID == org_id).all()
+    }
+    drift = []
+    for key in sorted(set(expected) | set(actual)):
+        want = expected.get(key, (Decimal("0"), 0))
+        have = actual.get(key, (Decimal("0"), 0))
+        if want != have:
+            drift.append({
+                "masterIngID": key[0],
+                "unit": key[1],
+                "expectedQty": float(want[0]),
+                "actualQty": float(have[0]),
+                "expectedBatches": want[1],
+                "actualBatches": have[1],
+            })
+    return drift
+
+
+def rebuild_stock_on_hand(org_id):
+    """Recompute the org's stock_on_hand rows from stock_batches. The caller commits."""
+    StockOnHand.query.filter(StockOnHand.orgID == org_id).delete(synchronize_session=False)
+    db.session.execute(
+        insert(StockOnHand.__table__).from_select(
+            ["orgID", "masterIngID", "unit", "qty", "batchCount"],
+            _stock_on_hand_from_batches(org_id),
+        )
+    )
+
+
+def serialize_batch(batch, ing_name, category):
+    return {
+        # The front-end has always keyed batches by "ingID"; it now carries batchID.
+        "ingID": batch.batchID,
+        "batchID": batch.batchID,
+        "masterIngID": batch.masterIngID,
+        "ingName": ing_name,
+        "category": category,
+        "expiry": batch.expiry.isoformat() if batch.expiry else None,
+        "batchNum": batch.batchNum,
+        "qty": float(batch.qty) if batch.qty is not None else None,
+        "unit": batch.unit,
+        "receivedAt": batch.received_at.isoformat() if batch.received_at else None,
+    }
+
+
+# --- Recipe Graph ---
+
+RecipeLink = namedtuple("RecipeLink", ["ingID", "ingName", "category", "qty", "unit"])
+
+
+def load_recipe_graph(org_id, dish_ids=None):
+    """
+    Return {dishID: [RecipeLink, ...]} for every recipe in the org, or only
+    for ``dish_ids`` when given.
+
+    Fetches all dish -> master ingredient links with one joined query, so
+    callers that walk every dish issue a constant number of statements
+    regardless of menu size. Dishes without ingredients are absent.
+    """
+    query = (
+        db.session.query(
+            DishIngredient.dishID,
+            Ingredient.ingID,
+            Ingredient.ingName,
+            Ingredient.category,
+            DishIngredient.qty,
+            DishIngredient.unit,
+        )
+        .join(Ingredient, Ingredient.ingID == DishIngredient.ingID)
+        .join(Dish, Dish.dishID == DishIngredient.dishID)
+        .filter(
+            Dish.orgID == org_id,
+            IS_MASTER,
+        )
+    )
+    if dish_ids is not None:
+        query = query.filter(DishIngredient.dishID.in_(list(dish_ids)))
+    rows = query.order_by(DishIngredient.dishID.asc(), Ingredient.ingName.asc()).all()
+    graph = {}
+    for dish_id, ing_id, ing_name, category, qty, unit in rows:
+        graph.setdefault(dish_id, []).append(RecipeLink(ing_id, ing_name, category, qty, unit))
+    return graph
+
+
+# --- Consumption Ledger ---
+
+def record_consumption(org_id, entries, dish_id=None, log_id=None, when=None):
+    """
+    Append ledger rows for one consume and fold them into consumption_daily.
+
+    ``entries`` is a list of dicts with ingName, category, unit, qty and
+    optional batchIngID / dishID (defaults to ``dish_id``). Runs inside the
+    caller's transaction.
+    """
+    if not entries:
+        return
+    when = when or datetime.utcnow()
+    day = when.date()
+    totals = {}
+    mappings = []
+    for entry in entries:
+        qty = Decimal(str(entry["qty"]))
+        key = (entry["ingName"], entry.get("category") or "", entry.get("unit") or "")
+        mappings.append({
+            "orgID": org_id,
+            "logID": log_id,
+            "dishID": entry.get("dishID", dish_id),
+            "batchIngID": entry.get("batchIngID"),
+            "ingName": key[0],
+            "category": key[1],
+            "unit": key[2],
+            "qty": qty,
+            "day": day,
+            "timestamp": when,
+        })
+        totals[key] = totals.get(key, Decimal("0")) + qty
+    db.session.bulk_insert_mappings(ConsumptionLedger, mappings)
+
+    # Upsert the rollup in a single statement so concurrent consumes on the
+    # same day add to the row instead of racing to create it.
+    stmt = mysql_insert(ConsumptionDaily.__table__).values([
+        {"orgID": org_id, "day": day, "ingName": name, "category": category,
+         "unit": unit, "qty": qty}
+        for (name, category, unit), qty in totals.items()
+    ])
+    stmt = stmt.on_duplicate_key_update(
+        qty=ConsumptionDaily.__table__.c.qty + stmt.inserted.qty,
+    )
+    db.session.execute(stmt)
+
+
+def backfill_consumption_ledger(org_id, chunk_size=1000):
+    """
+    Reconstruct ledger rows for CONSUME audit entries that have none, then
+    rebuild consumption_daily for the org from the full ledger.
+
+    Audit entries only carry the dish name and cooked quantity, so their
+    ingredient usage is re-derived from the org's current recipes.
+    Returns (logs_replayed, ledger_rows_written). The caller commits.
+    """
+    dishes = Dish.query.filter(Dish.orgID == org_id).all()
+    dish_name_to_id = {d.dishName: d.dishID for d in dishes}
+
+    dish_recipes = load_recipe_graph(org_id)
+
+    ledgered = (
+        db.session.query(ConsumptionLedger.logID)
+        .filter(ConsumptionLedger.orgID == org_id, ConsumptionLedger.logID.isnot(None))
+    )
+
+    replayed = 0
+    written = 0
+    last_id = 0
+    while True:
+        logs = (
+            db.session.query(AuditLog.logID, AuditLog.timestamp, AuditLog.details)
+            .filter(
+                AuditLog.orgID == org_id,
+                AuditLog.action == "CONSUME",
+                AuditLog.resource_type == "stock",
+                AuditLog.logID > last_id,
+                ~AuditLog.logID.in_(ledgered),
+            )
+            .order_by(AuditLog.logID.asc())
+            .limit(chunk_size)
+            .all()
+        )
+        if not logs:
+            break
+        last_id = logs[-1].logID
+
+        mappings = []
+        for log in logs:
+            try:
+                details = json.loads(log.details) if log.details else {}
+            except (json.JSONDecodeError, TypeError):
+                continue
+            # /stock/consume/batch entries list every cooked line under "lines"
+            for line in details.get("lines") or [details]:
+                dish_id = dish_name_to_id.get(line.get("dishName", ""))
+                if not dish_id or dish_id not in dish_recipes:
+                    continue
+                cooked_qty = Decimal(str(line.get("quantity", 0)))
+                for link in dish_recipes[dish_id]:
+                    if link.qty is None:
+                        continue
+                    mappings.append({
+                        "orgID": org_id,
+                        "logID": log.logID,
+                        "dishID": dish_id,
+                        "batchIngID": None,
+                        "ingName": link.ingName,
+                        "category": link.category or "",
+                        "unit": link.unit or "",
+                        "qty": cooked_qty * link.qty,
+                        "day": log.timestamp.date(),
+                        "timestamp": log.timestamp,
+                    })
+            replayed += 1
+        if mappings:
+            db.session.bulk_insert_mappings(ConsumptionLedger, mappings)
+            written += len(mappings)
+
+    # Recompute the rollup from the ledger with one grouped INSERT ... SELECT
+    ConsumptionDaily.query.filter(ConsumptionDaily.orgID == org_id).delete(
+        synchronize_session=False
+    )
+    ledger = ConsumptionLedger.__table__.c
+    grouped = (
+        select(ledger.orgID, ledger.day, ledger.ingName, ledger.category,
+               ledger.unit, func.sum(ledger.qty))
+        .where(ledger.orgID == org_id)
+        .group_by(ledger.orgID, ledger.day, ledger.ingName, ledger.category, ledger.unit)
+    )
+    db.session.execute(
+        insert(ConsumptionDaily.__table__).from_select(
+            ["orgID", "day", "ingName", "category", "unit", "qty"], grouped
+        )
+    )
+    return replayed, written
+
+# --- FIFO Consume Engine ---
+
+class InsufficientStock(Exception):
+    """Raised when locked stock cannot cover a recipe requirement."""
+
+    def __init__(self, ingredient, required, available, unit):
+        super().__init__(f"Insufficient stock for {ingredient}")
+        self.ingredient = ingredient
+        self.required = required
+        self.available = available
+        self.unit = unit
+
+    def payload(self):
+        return {
+            "error": "Insufficient stock",
+            "ingredient": self.ingredient,
+            "required": float(self.required),
+            "available": float(self.available),
+            "unit": self.unit,
+        }
+
+
+class StockPool:
+    """
+    Locked, in-memory view of the stock batches a consume may draw from.
+
+    load() reads every candidate batch in one SELECT ... FOR UPDATE on
+    stock_batches, consume() plans FIFO deductions against the in-memory
+    quantities, and apply() writes every touched batch back with a single
+    UPDATE (and the matching stock_on_hand totals with one upsert).
+    Concurrent consumes of the same ingredients serialise on the row locks,
+    so no batch can be drawn below zero. A batch can serve any recipe line
+    whose unit converts to its own (see UnitRegistry).
+    """
+
+    def __init__(self, org_id, rows, units=None):
+        self.org_id = org_id
+        self.units = units or unit_registry
+        self._batches = {}    # (ingName, category) -> [row, ...] in FIFO order
+        self._rows = {}       # batchID -> row
+        self._stored = {}     # batchID -> Decimal qty as last written
+        self._remaining = {}  # batchID -> Decimal qty left
+        self._touched = set()
+        for row in rows:
+            self._batches.setdefault((row.ingName, row.category), []).append(row)
+            self._rows[row.batchID] = row
+            self._stored[row.batchID] = row.qty
+            self._remaining[row.batchID] = row.qty
+
+    @classmethod
+    def load(cls, org_id, ingredients):
+        """Lock the batches for a set of (ingName, category) pairs."""
+        ingredients = set(ingredients)
+        units = org_units(org_id)
+        if not ingredients:
+            return cls(org_id, [], units)
+        rows = (
+            db.session.query(
+                StockBatch.batchID,
+                StockBatch.masterIngID,
+                Ingredient.ingName,
+                Ingredient.category,
+                StockBatch.expiry,
+                StockBatch.batchNum,
+                StockBatch.qty,
+                StockBatch.unit,
+            )
+            .join(Ingredient, and_(Ingredient.ingID == StockBatch.masterIngID, Ingredient.orgID == org_id))
+            .filter(
+                StockBatch.orgID == org_id,
+                or_(*[
+                    and_(Ingredient.ingName == name, Ingredient.category == category)
+                    for name, category in ingredients
+                ]),
+            )
+            .order_by(*STOCK_FIFO_ORDER)
+            .with_for_update(of=StockBatch)
+            .all()
+        )
+        return cls(org_id, rows, units)
+
+    def available(self, ing_name, category, unit):
+        """Stock left in ``unit``, over every batch whose unit converts to it."""
+        total = Decimal("0")
+        for row in self._batches.get((ing_name, category), []):
+            factor = self.units.factor(row.unit, unit, ing_name)
+            if factor is not None:
+                total += self._remaining[row.batchID] * factor
+        return total
+
+    def consume(self, recipe, cooked_qty):
+        """
+        Plan the deductions for cooking ``cooked_qty`` of a recipe (a list of
+        RecipeLink). Every requirement is checked before anything is taken,
+        so an InsufficientStock leaves the pool unchanged.
+        Returns (deductions, ledger_entries).
+        """
+        required = {}  # (ingName, category, dimension) -> [qty, unit of its first recipe line]
+        for link in recipe:
+            dim, _ = self.units.base(link.unit, link.ingName)
+            need = required.setdefault((link.ingName, link.category, dim), [Decimal("0"), link.unit])
+            need[0] += self.units.convert(link.qty * cooked_qty, link.unit, need[1], link.ingName)
+        for (ing_name, category, _), (qty, unit) in required.items():
+            available = self.available(ing_name, category, unit)
+            if available < qty:
+                raise InsufficientStock(ing_name, qty, available, unit)
+
+        deductions = []
+        ledger_entries = []
+        for link in recipe:
+            remaining = link.qty * cooked_qty  # in the recipe line's unit
+            for row in self._batches.get((link.ingName, link.category), []):
+                if remaining <= 0:
+                    break
+                factor = self.units.factor(row.unit, link.unit, link.ingName)
+                left = self._remaining[row.batchID]
+                if factor is None or left <= 0:
+                    continue
+                # take is in the batch's unit; partial takes round up to the stored precision
+                if left * factor <= remaining:
+                    take = left
+                    remaining -= left * factor
+                else:
+                    take = min((remaining / factor).quantize(STOCK_QTY_QUANTUM, rounding=ROUND_UP), left)
+                    remaining = Decimal("0")
+                self._remaining[row.batchID] -= take
+                self._touched.add(row.batchID)
+                deductions.append({
+                    "ingID": row.batchID,
+                    "batchID": row.batchID,
+                    "ingName": row.ingName,
+                    "batchNum": row.batchNum,
+                    "expiry": row.expiry.isoformat() if row.expiry else None,
+                    "qty": float(take),
+                    "unit": row.unit,
+                })
+                ledger_entries.append({
+                    "batchIngID": row.batchID,
+                    "ingName": row.ingName,
+                    "category": row.category,
+                    "unit": row.unit,
+                    "qty": take,
+                })
+        return deductions, ledger_entries
+
+    def apply(self):
+        """Write every touched batch quantity back with one UPDATE."""
+        if not self._touched:
+            return
+        new_qtys = {batch_id: self._remaining[batch_id] for batch_id in self._touched}
+        batch_table = StockBatch.__table__
+        db.session.execute(
+            update(batch_table)
+            .where(batch_table.c.batchID.in_(list(new_qtys)))
+            .values(qty=case(new_qtys, value=batch_table.c.batchID))
+        )
+        deltas = {}
+        for batch_id, qty in new_qtys.items():
+            row = self._rows[batch_id]
+            stock_delta(deltas, row.masterIngID, row.unit, qty - self._stored[batch_id])
+            self._stored[batch_id] = qty
+        adjust_stock_on_hand(self.org_id, deltas)
+        self._touched.clear()
+
+
+# --- Geocoding ---
+#
+# Signup and org updates never wait on the geocoder: cached addresses are
+# resolved inline from geocode_cache, anything else is looked up on the
+# background pool and written to the org when it returns.
+
+GEOCODE_NEGATIVE_TTL = timedelta(hours=int(os.getenv("GEOCODE_NEGATIVE_TTL_HOURS", "24")))
+
+
+class MapsCoGeocoder:
+    """geocode.maps.co search API over a pooled session."""
+
+    name = "maps.co"
+
+    def __init__(self, api_key, timeout=10):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = http_requests.Session()
+        self.session.mount("https://", HTTPAdapter(
+            pool_maxsize=4,
+            max_retries=Retry(total=2, backoff_factor=1, status_forcelist=[429, 502, 503, 504],
+                              allowed_methods=["GET"], raise_on_status=False),
+        ))
+
+    def geocode(self, query):
+        """Return (lat, lon) for the best match, or None."""
+        geo_resp = self.session.get(
+            "https://geocode.maps.co/search",
+            params={"q": query, "api_key": self.api_key},
+            timeout=self.timeout,
+        )
+        geo_data = geo_resp.json()
+        app.logger.debug("Geocode query='%s' results=%d", query, len(geo_data) if isinstance(geo_data, list) else 0)
+        if isinstance(geo_data, list) and len(geo_data) > 0:
+            return float(geo_data[0]["lat"]), float(geo_data[0]["lon"])
+        return None
+
+
+class StubGeocoder:
+    """
+    Offline geocoder selected with GEOCODER=stub: returns stable,
+    plausible coordinates derived from a hash of the query.
+    """
+
+    name = "stub"
+
+    def geocode(self, query):
+        digest = hashlib.sha256(normalize_address(query).encode("utf-8")).digest()
+        lat = 25 + digest[0] / 255 * 24      # roughly the continental US
+        lon = -124 + digest[1] / 255 * 57
+        return round(lat, 6), round(lon, 6)
+
+
+def make_geocoder():
+    if os.getenv("GEOCODER", "").lower() == "stub":
+        return StubGeocoder()
+    return MapsCoGeocoder(os.getenv("GEOCODING_API_KEY", ""))
+
+
+geocoder = make_geocoder()
+
+
+def normalize_address(address):
+    address = re.sub(r"[^\w\s,]", " ", address.casefold())
+    parts = (" ".join(part.split()) for part in address.split(","))
+    return ", ".join(part for part in parts if part)
+
+
+def geocode_queries(data):
+    """Full address first, then a city/state/zip fallback, from signup/org form fields."""
+    address_parts = [data.get("address1", ""), data.get("city", ""),
+                     data.get("state", ""), data.get("zipCode", ""),
+                     data.get("country", "")]
+    full_address = ", ".join(p for p in address_parts if p)
+    if not full_address:
+        return []
+    queries = [full_address]
+    fallback_parts = [data.get("city", ""), data.get("state", ""),
+                      data.get("zipCode", ""), data.get("country", "")]
+    fallback = ", ".join(p for p in fallback_parts if p)
+    if fallback and fallback != full_address:
+        queries.append(fallback)
+    return queries
+
+
+def cached_geocode(query):
+    """Return (known, coords) from geocode_cache; coords is None for a cached miss."""
+    normalized = normalize_address(query)
+    key = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    row = db.session.get(GeocodeCache, key)
+    if row is None:
+        return False, None
+    if row.latCoord is None:
+        if datetime.utcnow() - row.updated_at > GEOCODE_NEGATIVE_TTL:
+            return False, None
+        return True, None
+    return True, (float(row.latCoord), float(row.longCoord))
+
+
+def store_geocode(query, coords):
+    normalized = normalize_address(query)
+    values = {
+        "addressKey": hashlib.sha256(normalized.encode("utf-8")).hexdigest(),
+        "address": normalized[:255],
+        "latCoord": coords[0] if coords else None,
+        "longCoord": coords[1] if coords else None,
+        "provider": geocoder.name,
+        "updated_at": datetime.utcnow(),
+    }
+    stmt = mysql_insert(GeocodeCache).values(**values)
+    db.session.execute(stmt.on_duplicate_key_update(
+        latCoord=stmt.inserted.latCoord,
+        longCoord=stmt.inserted.longCoord,
+        provider=stmt.inserted.provider,
+        updated_at=stmt.inserted.updated_at,
+    ))
+
+
+def resolve_cached_location(queries):
+    """
+    Try ``queries`` against the cache only. Returns (coords, pending):
+    coords when a query is cached as found, pending when some query still
+    needs the geocoder.
+    """
+    for query in queries:
+        known, coords = cached_geocode(query)
+        if not known:
+            return None, True
+        if coords:
+            return coords, False
+    return None, False
+
+
+def geocode_org(org_id, queries, token, user_id=None):
+    """
+    Background task: geocode ``queries`` in order and store the first hit on
+    the org, unless the org's location changed after this lookup was queued
+    (its geocode_token no longer matches).
+    """
+    coords = None
+    for query in queries:
+        known, coords = cached_geocode(query)
+        if not known:
+            try:
+                coords = geocoder.geocode(query)
+            except Exception:
+                app.logger.warning("Geocoding failed for '%s'", query)
+                return
+            store_geocode(query, coords)
+            db.session.commit()
+        if coords:
+            app.logger.info("Geocoded '%s' -> %s", query, coords)
+            break
+    if not coords:
+        app.logger.warning("Geocoding returned no results for '%s'", queries[0])
+        return
+    org = db.session.query(Org).filter(Org.orgID == org_id).with_for_update().first()
+    if not org or org.geocode_token != token:
+        app.logger.info("Geocode for org %s superseded by a newer location; dropped", org_id)
+        db.session.rollback()
+        return
+    previous = f"{org.latCoord}, {org.longCoord}"
+    org.latCoord, org.longCoord = coords
+    org.geocode_token = None
+    record_audit("UPDATE", "org", resource_id=org_id,
+                  details={"location": {"from": previous, "to": f"{coords[0]}, {coords[1]}"},
+                           "source": "geocoder"},
+                  user_id=user_id, org_id=org_id)
+    db.session.commit()
+
+
+def apply_org_location(org, queries, user_id=None):
+    """
+    Set the org's coordinates from the cache when possible, otherwise queue a
+    background lookup to run after the caller commits. Returns "resolved",
+    "pending" or None (nothing to geocode / no match).
+
+    Each call replaces org.geocode_token, so a slower lookup queued for an
+    earlier address finds its token gone and leaves the newer location be.
+    """
+    if not queries:
+        return None
+    coords, pending = resolve_cached_location(queries)
+    org.geocode_token = None
+    if coords:
+        org.latCoord, org.longCoord = coords
+        return "resolved"
+    if pending:
+        org_id = org.orgID
+        org.geocode_token = token = uuid.uuid4().hex
+        g.setdefault("after_commit", []).append(
+            lambda: submit_background(geocode_org, org_id, queries, token, user_id)
+        )
+        return "pending"
+    return None
+
+
+def run_after_commit():
+    """Start work that was deferred until the request's transaction committed."""
+    for callback in g.pop("after_commit", []):
+        callback()
 
-def get_or_create_stock_dish(org_id):
-    stock_dish = Dish.query.filter(
-        Dish.orgID == org_id,
-        Dish.dishName == STOCK_DISH_NAME,
-    ).first()
-    if stock_dish:
-        return stock_dish
-    stock_dish = Dish(dishName=STOCK_DISH_NAME, orgID=org_id)
-    db.session.add(stock_dish)
-    db.session.flush()
-    return stock_dish
 
 # --- Auth Routes ---
 
@@ -242,41 +1781,7 @@ def signup():
         if missing_fields:
             return jsonify({"error": f"Missing fields: {', '.join(missing_fields)}"}), 400
 
-        # --- Geocode the address if provided ---
-        lat, lon = None, None
-        address_parts = [data.get("address1", ""), data.get("city", ""),
-                         data.get("state", ""), data.get("zipCode", ""),
-                         data.get("country", "")]
-        full_address = ", ".join(p for p in address_parts if p)
-        if full_address:
-            try:
-                geo_key = os.getenv("GEOCODING_API_KEY", "")
-                # Try full address first, then fall back to city/state/zip
-                queries = [full_address]
-                fallback_parts = [data.get("city", ""), data.get("state", ""),
-                                  data.get("zipCode", ""), data.get("country", "")]
-                fallback = ", ".join(p for p in fallback_parts if p)
-                if fallback and fallback != full_address:
-                    queries.append(fallback)
-
-                for q in queries:
-                    geo_resp = http_requests.get(
-                        "https://geocode.maps.co/search",
-                        params={"q": q, "api_key": geo_key},
-                        timeout=10,
-                    )
-                    geo_data = geo_resp.json()
-                    app.logger.debug("Geocode query='%s' results=%d", q, len(geo_data) if isinstance(geo_data, list) else 0)
-                    if isinstance(geo_data, list) and len(geo_data) > 0:
-                        lat = float(geo_data[0]["lat"])
-                        lon = float(geo_data[0]["lon"])
-                        app.logger.info("Geocoded '%s' -> (%s, %s)", q, lat, lon)
-                        break
-            except Exception:
-                app.logger.warning("Geocoding failed for '%s', continuing without coords", full_address)
-
-        new_org = Org(orgName=data.get("orgName"), org_email=data.get("email"),
-                      latCoord=lat, longCoord=lon)
+        new_org = Org(orgName=data.get("orgName"), org_email=data.get("email"))
         db.session.add(new_org)
         db.session.flush()
 
@@ -288,6 +1793,7 @@ def signup():
         )
         db.session.add(admin_user)
         db.session.flush()
+        geocoding = apply_org_location(new_org, geocode_queries(data), user_id=admin_user.userID)
         record_audit("CREATE", "org", resource_id=new_org.orgID,
                       details={"orgName": new_org.orgName},
                       user_id=admin_user.userID, org_id=new_org.orgID)
@@ -295,7 +1801,8 @@ def signup():
                       details={"email": admin_user.email, "role": "admin"},
                       user_id=admin_user.userID, org_id=new_org.orgID)
         db.session.commit()
-        return jsonify({"msg": "Org and Admin created"}), 201
+        run_after_commit()
+        return jsonify({"msg": "Org and Admin created", "geocoding": geocoding}), 201
     except Exception as e:
         db.session.rollback()
         app.logger.exception("/signup failed with error")
@@ -319,18 +1826,17 @@ def login():
 
         user = User.query.filter_by(email=email).first()
         if not user or not check_password_hash(user.hashed_pwd, password):
-            record_audit("LOGIN_FAILED", "auth",
-                          details={"email": email},
-                          user_id=user.userID if user else None,
-                          org_id=user.orgID if user else None)
-            db.session.commit()
+            record_audit_detached("LOGIN_FAILED", "auth",
+                                   details={"email": email},
+                                   user_id=user.userID if user else None,
+                                   org_id=user.orgID if user else None)
             return jsonify({"error": "Invalid credentials"}), 401
 
-        access_token = create_access_token(identity=str(user.userID))
-        record_audit("LOGIN", "auth", resource_id=user.userID,
-                      details={"email": user.email},
-                      user_id=user.userID, org_id=user.orgID)
-        db.session.commit()
+        access_token = create_access_token(identity=str(user.userID),
+                                           additional_claims=identity_claims(user))
+        record_audit_detached("LOGIN", "auth", resource_id=user.userID,
+                               details={"email": user.email},
+                               user_id=user.userID, org_id=user.orgID)
         return jsonify({"access_token": access_token, "userID": user.userID}), 200
     except Exception as e:
         app.logger.exception("/login failed with error")
@@ -529,54 +2035,22 @@ def manage_org():
             changes["org_email"] = {"from": org.org_email, "to": new_email}
             org.org_email = new_email
 
-        # If address fields provided, re-geocode
-        address_parts = [data.get("address1", ""), data.get("city", ""),
-                         data.get("state", ""), data.get("zipCode", ""),
-                         data.get("country", "")]
-        full_address = ", ".join(p for p in address_parts if p)
-        if full_address:
-            lat, lon = None, None
-            try:
-                geo_key = os.getenv("GEOCODING_API_KEY", "")
-                # Try full address first, then fall back to city/state/zip
-                queries = [full_address]
-                fallback_parts = [data.get("city", ""), data.get("state", ""),
-                                  data.get("zipCode", ""), data.get("country", "")]
-                fallback = ", ".join(p for p in fallback_parts if p)
-                if fallback and fallback != full_address:
-                    queries.append(fallback)
-
-                for q in queries:
-                    geo_resp = http_requests.get(
-                        "https://geocode.maps.co/search",
-                        params={"q": q, "api_key": geo_key},
-                        timeout=10,
-                    )
-                    geo_data = geo_resp.json()
-                    app.logger.debug("Geocode query='%s' results=%d", q, len(geo_data) if isinstance(geo_data, list) else 0)
-                    if isinstance(geo_data, list) and len(geo_data) > 0:
-                        lat = float(geo_data[0]["lat"])
-                        lon = float(geo_data[0]["lon"])
-                        app.logger.info("Geocoded '%s' -> (%s, %s)", q, lat, lon)
-                        break
-
-                if lat is not None and lon is not None:
-                    changes["location"] = {
-                        "from": f"{org.latCoord}, {org.longCoord}",
-                        "to": f"{lat}, {lon}",
-                    }
-                    org.latCoord = lat
-                    org.longCoord = lon
-                else:
-                    app.logger.warning("Geocoding returned no results for '%s'", full_address)
-            except Exception:
-                app.logger.warning("Geocoding failed during org update")
+        # If address fields provided, re-geocode (unless coordinates are given directly)
+        geocoding = None
+        if not ("latCoord" in data and "longCoord" in data):
+            previous = f"{org.latCoord}, {org.longCoord}"
+            geocoding = apply_org_location(org, geocode_queries(data), user_id=user.userID)
+            if geocoding == "resolved":
+                changes["location"] = {"from": previous, "to": f"{org.latCoord}, {org.longCoord}"}
+            elif geocoding == "pending":
+                changes["location"] = "geocoding"
 
         # Direct lat/long override
         if "latCoord" in data and "longCoord" in data:
             try:
                 org.latCoord = float(data["latCoord"]) if data["latCoord"] is not None else None
                 org.longCoord = float(data["longCoord"]) if data["longCoord"] is not None else None
+                org.geocode_token = None  # a pending lookup must not overwrite these
                 changes["coords"] = "updated directly"
             except (TypeError, ValueError):
                 pass
@@ -585,8 +2059,10 @@ def manage_org():
                       details=changes,
                       user_id=user.userID, org_id=org.orgID)
         db.session.commit()
+        run_after_commit()
         return jsonify({
             "msg": "Organization updated",
+            "geocoding": geocoding,
             "orgID": org.orgID,
             "orgName": org.orgName,
             "org_email": org.org_email,
@@ -635,6 +2111,14 @@ def manage_settings():
             row = OrgSettings(orgID=org_id, settings_json='{}')
             db.session.add(row)
 
+        densities = data.get("ingredientDensities")
+        if densities is not None and not (
+            isinstance(densities, dict)
+            and all(isinstance(d, (int, float)) and not isinstance(d, bool) and d > 0
+                    for d in densities.values())
+        ):
+            return jsonify({"error": "ingredientDensities must map ingredient names to g/ml > 0"}), 400
+
         # Only allow known keys
         allowed_keys = set(DEFAULT_SETTINGS.keys())
         changes = {}
@@ -650,6 +2134,8 @@ def manage_settings():
                       details=changes,
                       user_id=user.userID, org_id=org_id)
         db.session.commit()
+        invalidate_org_settings(org_id)
+        stock_analytics.invalidate(org_id)
 
         merged = get_org_settings(org_id)
         return jsonify({"msg": "Settings updated", "settings": merged}), 200
@@ -660,6 +2146,42 @@ def manage_settings():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/metrics/cache", methods=["GET"])
+@jwt_required()
+def cache_metrics():
+    """Hit-rate and size statistics for this worker's in-process caches (admin only)."""
+    try:
+        user = get_current_user()
+        if not user:
+            return jsonify({"error": "Unauthorized"}), 401
+        if user.uRole != 'admin':
+            return jsonify({"error": "Forbidden"}), 403
+        return jsonify({
+            "pid": os.getpid(),
+            "caches": {name: cache.stats() for name, cache in sorted(CACHE_REGISTRY.items())},
+        }), 200
+    except Exception as e:
+        app.logger.exception("/metrics/cache failed")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/metrics/models", methods=["GET"])
+@jwt_required()
+def model_metrics():
+    """Circuit-breaker state of every Gemini model the app routes between (admin only)."""
+    try:
+        user = get_current_user()
+        if not user:
+            return jsonify({"error": "Unauthorized"}), 401
+        if user.uRole != 'admin':
+            return jsonify({"error": "Forbidden"}), 403
+        models = list(dict.fromkeys(CHAT_MODELS + RECIPE_MODELS))
+        return jsonify({"models": model_router.status(models)}), 200
+    except Exception as e:
+        app.logger.exception("/metrics/models failed")
+        return jsonify({"error": str(e)}), 500
+
+
 # --- Dashboard Route ---
 
 @app.route("/dashboard", methods=["GET"])
@@ -667,7 +2189,7 @@ def manage_settings():
 def dashboard_summary():
     """Return a summary of the organization's inventory state for the dashboard."""
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -678,49 +2200,20 @@ def dashboard_summary():
         from datetime import timedelta
         soon = today + timedelta(days=settings.get("expiringSoonDays", 3))
 
-        # ---- Stock batches with qty via __STOCK__ dish ----
-        stock_dish = Dish.query.filter(
-            Dish.orgID == org_id,
-            Dish.dishName == STOCK_DISH_NAME,
-        ).first()
-        stock_dish_id = stock_dish.dishID if stock_dish else None
-
-        batch_rows = Ingredient.query.filter(
-            Ingredient.orgID == org_id,
-            or_(Ingredient.expiry.isnot(None), Ingredient.batchNum.isnot(None)),
-        ).order_by(
-            Ingredient.expiry.is_(None),
-            Ingredient.expiry.asc(),
+        # ---- Stock batches with their master type, one indexed query ----
+        batch_rows = stock_batch_query(org_id).order_by(
+            StockBatch.expiry.is_(None),
+            StockBatch.expiry.asc(),
             Ingredient.ingName.asc(),
         ).all()
 
-        qty_map = {}
-        if stock_dish_id and batch_rows:
-            ing_ids = [b.ingID for b in batch_rows]
-            qty_rows = DishIngredient.query.filter(
-                DishIngredient.dishID == stock_dish_id,
-                DishIngredient.ingID.in_(ing_ids),
-            ).all()
-            qty_map = {
-                row.ingID: {"qty": float(row.qty) if row.qty is not None else None, "unit": row.unit}
-                for row in qty_rows
-            }
-
         # Categorise batches
         expiring_batches = []  # expiry today..soon
         expired_batches = []   # expiry < today
         healthy_batches = 0
 
-        for b in batch_rows:
-            info = {
-                "ingID": b.ingID,
-                "ingName": b.ingName,
-                "category": b.category,
-                "expiry": b.expiry.isoformat() if b.expiry else None,
-                "batchNum": b.batchNum,
-                "qty": qty_map.get(b.ingID, {}).get("qty"),
-                "unit": qty_map.get(b.ingID, {}).get("unit"),
-            }
+        for b, ing_name, category in batch_rows:
+            info = serialize_batch(b, ing_name, category)
             if b.expiry:
                 if b.expiry < today:
                     expired_batches.append(info)
@@ -734,25 +2227,27 @@ def dashboard_summary():
         # ---- Counts ----
         total_ingredients = Ingredient.query.filter(
             Ingredient.orgID == org_id,
-            Ingredient.expiry.is_(None),
-            Ingredient.batchNum.is_(None),
+            IS_MASTER,
         ).count()
 
-        total_dishes = Dish.query.filter(
-            Dish.orgID == org_id,
-            Dish.dishName != STOCK_DISH_NAME,
-        ).count()
+        total_dishes = Dish.query.filter(Dish.orgID == org_id).count()
 
         total_users = User.query.filter(User.orgID == org_id).count()
         total_batches = len(batch_rows)
 
+        # Ingredient types with any stock, straight from the running totals
+        in_stock = (
+            db.session.query(func.count(func.distinct(StockOnHand.masterIngID)))
+            .filter(StockOnHand.orgID == org_id, StockOnHand.qty > 0)
+            .scalar()
+        ) or 0
+
         # ---- Categories breakdown ----
         categories = (
             db.session.query(Ingredient.category, func.count(Ingredient.ingID))
             .filter(
                 Ingredient.orgID == org_id,
-                Ingredient.expiry.is_(None),
-                Ingredient.batchNum.is_(None),
+                IS_MASTER,
             )
             .group_by(Ingredient.category)
             .all()
@@ -769,6 +2264,8 @@ def dashboard_summary():
                 "healthy": healthy_batches,
                 "expiring": len(expiring_batches),
                 "expired": len(expired_batches),
+                "inStock": in_stock,
+                "outOfStock": max(total_ingredients - in_stock, 0),
             },
             "expiringBatches": expiring_batches[:10],
             "expiredBatches": expired_batches[:10],
@@ -789,7 +2286,7 @@ def dashboard_summary():
 def list_master_ingredients():
     try:
         app.logger.debug("/inventory/ingredients Authorization=%s", request.headers.get("Authorization"))
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -810,8 +2307,7 @@ def list_master_ingredients():
             )
             .outerjoin(linked_subquery, linked_subquery.c.ingID == Ingredient.ingID)
             .filter(
-                Ingredient.expiry.is_(None),
-                Ingredient.batchNum.is_(None),
+                IS_MASTER,
                 Ingredient.orgID == user.orgID,
             )
         )
@@ -843,15 +2339,12 @@ def list_master_ingredients():
 @jwt_required()
 def list_dishes():
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
         search = request.args.get("search", "").strip()
-        query = Dish.query.filter(
-            Dish.orgID == user.orgID,
-            Dish.dishName != STOCK_DISH_NAME,
-        )
+        query = Dish.query.filter(Dish.orgID == user.orgID)
 
         if search:
             query = query.filter(Dish.dishName.ilike(f"%{search}%"))
@@ -876,7 +2369,7 @@ def list_dishes():
 def create_master_ingredient():
     try:
         app.logger.debug("/inventory/ingredient-types Authorization=%s", request.headers.get("Authorization"))
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -920,15 +2413,14 @@ def create_master_ingredient():
 @jwt_required()
 def update_or_delete_master_ingredient(ing_id):
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
         ingredient = Ingredient.query.filter(
             Ingredient.ingID == ing_id,
             Ingredient.orgID == user.orgID,
-            Ingredient.expiry.is_(None),
-            Ingredient.batchNum.is_(None),
+            IS_MASTER,
         ).first()
 
         if not ingredient:
@@ -941,6 +2433,13 @@ def update_or_delete_master_ingredient(ing_id):
                     "error": "Ingredient is used in dishes",
                     "linkedDishes": usage_count,
                 }), 409
+            batch_count = StockBatch.query.filter(StockBatch.masterIngID == ing_id).count()
+            if batch_count > 0:
+                return jsonify({
+                    "error": "Ingredient has stock batches",
+                    "batches": batch_count,
+                }), 409
+            StockOnHand.query.filter(StockOnHand.masterIngID == ing_id).delete(synchronize_session=False)
             record_audit("DELETE", "ingredient", resource_id=ingredient.ingID,
                           details={"ingName": ingredient.ingName},
                           user_id=user.userID, org_id=user.orgID)
@@ -989,7 +2488,7 @@ def update_or_delete_master_ingredient(ing_id):
 def create_dish():
     try:
         app.logger.debug("/inventory/dishes Authorization=%s", request.headers.get("Authorization"))
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -1000,8 +2499,6 @@ def create_dish():
         dish_name = data.get("dishName")
         if not dish_name:
             return jsonify({"error": "Missing dishName"}), 400
-        if dish_name == STOCK_DISH_NAME:
-            return jsonify({"error": "Dish name is reserved"}), 400
 
         ingredients = data.get("ingredients", [])
         if not isinstance(ingredients, list):
@@ -1018,8 +2515,7 @@ def create_dish():
 
             valid_ings = Ingredient.query.filter(
                 Ingredient.ingID.in_(ing_ids),
-                Ingredient.expiry.is_(None),
-                Ingredient.batchNum.is_(None),
+                IS_MASTER,
                 Ingredient.orgID == user.orgID,
             ).all()
             valid_ids = {ing.ingID for ing in valid_ings}
@@ -1032,7 +2528,7 @@ def create_dish():
                     dishID=new_dish.dishID,
                     ingID=item["ingID"],
                     qty=item.get("qty"),
-                    unit=item.get("unit"),
+                    unit=unit_registry.canonical(item.get("unit")) or None,
                 ))
 
         record_audit("CREATE", "dish", resource_id=new_dish.dishID,
@@ -1057,7 +2553,7 @@ def create_dish():
 @jwt_required()
 def get_dish_detail(dish_id):
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -1102,7 +2598,7 @@ def get_dish_detail(dish_id):
 @jwt_required()
 def update_or_delete_dish(dish_id):
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -1132,8 +2628,6 @@ def update_or_delete_dish(dish_id):
         if dish_name is not None:
             if not dish_name:
                 return jsonify({"error": "dishName cannot be empty"}), 400
-            if dish_name == STOCK_DISH_NAME:
-                return jsonify({"error": "Dish name is reserved"}), 400
             dish.dishName = dish_name
 
         if ingredients is not None:
@@ -1146,8 +2640,7 @@ def update_or_delete_dish(dish_id):
 
             valid_ings = Ingredient.query.filter(
                 Ingredient.ingID.in_(ing_ids),
-                Ingredient.expiry.is_(None),
-                Ingredient.batchNum.is_(None),
+                IS_MASTER,
                 Ingredient.orgID == user.orgID,
             ).all()
             valid_ids = {ing.ingID for ing in valid_ings}
@@ -1161,7 +2654,7 @@ def update_or_delete_dish(dish_id):
                     dishID=dish_id,
                     ingID=item["ingID"],
                     qty=item.get("qty"),
-                    unit=item.get("unit"),
+                    unit=unit_registry.canonical(item.get("unit")) or None,
                 ))
 
         record_audit("UPDATE", "dish", resource_id=dish.dishID,
@@ -1186,63 +2679,31 @@ def update_or_delete_dish(dish_id):
 @jwt_required()
 def list_stock_batches():
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
-        stock_dish = Dish.query.filter(
-            Dish.orgID == user.orgID,
-            Dish.dishName == STOCK_DISH_NAME,
-        ).first()
-        stock_dish_id = stock_dish.dishID if stock_dish else None
-
         search = request.args.get("search", "").strip()
-        query = Ingredient.query.filter(
-            Ingredient.orgID == user.orgID,
-            or_(Ingredient.expiry.isnot(None), Ingredient.batchNum.isnot(None)),
-        )
+        query = stock_batch_query(user.orgID)
 
         if search:
             query = query.filter(
                 or_(
                     Ingredient.ingName.ilike(f"%{search}%"),
-                    Ingredient.batchNum.ilike(f"%{search}%"),
+                    StockBatch.batchNum.ilike(f"%{search}%"),
                 )
             )
 
         batches = query.order_by(
-            Ingredient.expiry.is_(None),
-            Ingredient.expiry.asc(),
+            StockBatch.expiry.is_(None),
+            StockBatch.expiry.asc(),
             Ingredient.ingName.asc(),
-        ).all()
-
-        qty_map = {}
-        if stock_dish_id and batches:
-            ing_ids = [batch.ingID for batch in batches]
-            qty_rows = DishIngredient.query.filter(
-                DishIngredient.dishID == stock_dish_id,
-                DishIngredient.ingID.in_(ing_ids),
-            ).all()
-            qty_map = {
-                row.ingID: {
-                    "qty": float(row.qty) if row.qty is not None else None,
-                    "unit": row.unit,
-                }
-                for row in qty_rows
-            }
+        ).all()
 
         return jsonify({
             "batches": [
-                {
-                    "ingID": batch.ingID,
-                    "ingName": batch.ingName,
-                    "category": batch.category,
-                    "expiry": batch.expiry.isoformat() if batch.expiry else None,
-                    "batchNum": batch.batchNum,
-                    "qty": qty_map.get(batch.ingID, {}).get("qty"),
-                    "unit": qty_map.get(batch.ingID, {}).get("unit"),
-                }
-                for batch in batches
+                serialize_batch(batch, ing_name, category)
+                for batch, ing_name, category in batches
             ]
         }), 200
     except Exception as e:
@@ -1254,7 +2715,7 @@ def list_stock_batches():
 @jwt_required()
 def create_stock_batch():
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -1269,8 +2730,7 @@ def create_stock_batch():
         master = Ingredient.query.filter(
             Ingredient.ingID == ing_id,
             Ingredient.orgID == user.orgID,
-            Ingredient.expiry.is_(None),
-            Ingredient.batchNum.is_(None),
+            IS_MASTER,
         ).first()
 
         if not master:
@@ -1298,45 +2758,33 @@ def create_stock_batch():
             return jsonify({"error": str(exc)}), 400
         if not isinstance(unit_value, str) or not unit_value.strip():
             return jsonify({"error": "unit is required"}), 400
-        unit = unit_value.strip()
+        unit = unit_registry.canonical(unit_value)
 
-        new_batch = Ingredient(
-            ingName=master.ingName,
-            category=master.category,
+        new_batch = StockBatch(
+            orgID=user.orgID,
+            masterIngID=master.ingID,
+            qty=qty,
+            unit=unit,
             expiry=expiry,
             batchNum=batch_num,
-            orgID=user.orgID,
+            received_at=datetime.utcnow(),
         )
         db.session.add(new_batch)
         db.session.flush()
+        adjust_stock_on_hand(user.orgID, stock_delta({}, master.ingID, unit, qty, batches=1))
 
-        stock_dish = get_or_create_stock_dish(user.orgID)
-        db.session.add(DishIngredient(
-            dishID=stock_dish.dishID,
-            ingID=new_batch.ingID,
-            qty=qty,
-            unit=unit,
-        ))
-
-        record_audit("CREATE", "batch", resource_id=new_batch.ingID,
-                      details={"ingName": new_batch.ingName,
+        record_audit("CREATE", "batch", resource_id=new_batch.batchID,
+                      details={"ingName": master.ingName,
                                "batchNum": batch_num,
                                "expiry": str(expiry) if expiry else None,
                                "qty": str(qty), "unit": unit},
                       user_id=user.userID, org_id=user.orgID)
         db.session.commit()
+        stock_analytics.invalidate(user.orgID)
 
         return jsonify({
             "msg": "Batch created",
-            "batch": {
-                "ingID": new_batch.ingID,
-                "ingName": new_batch.ingName,
-                "category": new_batch.category,
-                "expiry": new_batch.expiry.isoformat() if new_batch.expiry else None,
-                "batchNum": new_batch.batchNum,
-                "qty": float(qty) if qty is not None else None,
-                "unit": unit,
-            },
+            "batch": serialize_batch(new_batch, master.ingName, master.category),
         }), 201
     except Exception as e:
         db.session.rollback()
@@ -1344,39 +2792,35 @@ def create_stock_batch():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/stock/batches/<int:ing_id>", methods=["PATCH", "DELETE"])
+@app.route("/stock/batches/<int:batch_id>", methods=["PATCH", "DELETE"])
 @jwt_required()
-def update_or_delete_stock_batch(ing_id):
+def update_or_delete_stock_batch(batch_id):
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
-        batch = Ingredient.query.filter(
-            Ingredient.ingID == ing_id,
-            Ingredient.orgID == user.orgID,
-            or_(Ingredient.expiry.isnot(None), Ingredient.batchNum.isnot(None)),
-        ).first()
-
-        if not batch:
+        # Lock the batch like StockPool does, so a concurrent consume can't
+        # change qty between reading it here and adjusting stock_on_hand.
+        row = (
+            stock_batch_query(user.orgID)
+            .filter(StockBatch.batchID == batch_id)
+            .with_for_update(of=StockBatch)
+            .first()
+        )
+        if not row:
             return jsonify({"error": "Batch not found"}), 404
-
-        stock_dish = Dish.query.filter(
-            Dish.orgID == user.orgID,
-            Dish.dishName == STOCK_DISH_NAME,
-        ).first()
+        batch, ing_name, category = row
+        old_qty, old_unit = batch.qty, batch.unit
 
         if request.method == "DELETE":
-            if stock_dish:
-                DishIngredient.query.filter(
-                    DishIngredient.dishID == stock_dish.dishID,
-                    DishIngredient.ingID == batch.ingID,
-                ).delete()
-            record_audit("DELETE", "batch", resource_id=batch.ingID,
-                          details={"ingName": batch.ingName, "batchNum": batch.batchNum},
+            adjust_stock_on_hand(user.orgID, stock_delta({}, batch.masterIngID, old_unit, -old_qty, batches=-1))
+            record_audit("DELETE", "batch", resource_id=batch.batchID,
+                          details={"ingName": ing_name, "batchNum": batch.batchNum},
                           user_id=user.userID, org_id=user.orgID)
             db.session.delete(batch)
             db.session.commit()
+            stock_analytics.invalidate(user.orgID)
             return jsonify({"msg": "Batch deleted"}), 200
 
         data = request.get_json(silent=True)
@@ -1395,60 +2839,37 @@ def update_or_delete_stock_batch(ing_id):
                 batch_num = batch_num.strip()
             batch.batchNum = batch_num or None
 
-        qty = None
-        unit = None
-        link = None
         if "qty" in data:
             try:
                 qty = parse_quantity(data.get("qty"), "qty")
             except ValueError as exc:
                 return jsonify({"error": str(exc)}), 400
+            if qty is not None:
+                batch.qty = qty
 
         if "unit" in data:
             unit_value = data.get("unit")
             if unit_value is not None and (not isinstance(unit_value, str) or not unit_value.strip()):
                 return jsonify({"error": "unit is required"}), 400
-            unit = unit_value.strip() if isinstance(unit_value, str) else None
+            if isinstance(unit_value, str):
+                batch.unit = unit_registry.canonical(unit_value)
 
         if not batch.expiry and not batch.batchNum:
             return jsonify({"error": "Batch requires expiry or batchNum"}), 400
 
-        if qty is not None or unit is not None:
-            stock_dish = stock_dish or get_or_create_stock_dish(user.orgID)
-            link = DishIngredient.query.filter(
-                DishIngredient.dishID == stock_dish.dishID,
-                DishIngredient.ingID == batch.ingID,
-            ).first()
-            if not link:
-                link = DishIngredient(dishID=stock_dish.dishID, ingID=batch.ingID)
-                db.session.add(link)
-            if qty is not None:
-                link.qty = qty
-            if unit is not None:
-                link.unit = unit
-        elif stock_dish:
-            link = DishIngredient.query.filter(
-                DishIngredient.dishID == stock_dish.dishID,
-                DishIngredient.ingID == batch.ingID,
-            ).first()
+        deltas = stock_delta({}, batch.masterIngID, old_unit, -old_qty, batches=-1)
+        adjust_stock_on_hand(user.orgID, stock_delta(deltas, batch.masterIngID, batch.unit, batch.qty, batches=1))
 
-        record_audit("UPDATE", "batch", resource_id=batch.ingID,
-                      details={"ingName": batch.ingName,
+        record_audit("UPDATE", "batch", resource_id=batch.batchID,
+                      details={"ingName": ing_name,
                                "batchNum": batch.batchNum,
                                "expiry": batch.expiry.isoformat() if batch.expiry else None},
                       user_id=user.userID, org_id=user.orgID)
         db.session.commit()
+        stock_analytics.invalidate(user.orgID)
         return jsonify({
             "msg": "Batch updated",
-            "batch": {
-                "ingID": batch.ingID,
-                "ingName": batch.ingName,
-                "category": batch.category,
-                "expiry": batch.expiry.isoformat() if batch.expiry else None,
-                "batchNum": batch.batchNum,
-                "qty": float(link.qty) if link and link.qty is not None else None,
-                "unit": link.unit if link else None,
-            },
+            "batch": serialize_batch(batch, ing_name, category),
         }), 200
     except Exception as e:
         db.session.rollback()
@@ -1460,7 +2881,7 @@ def update_or_delete_stock_batch(ing_id):
 @jwt_required()
 def consume_stock_for_dish():
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -1483,7 +2904,6 @@ def consume_stock_for_dish():
         dish = Dish.query.filter(
             Dish.dishID == dish_id,
             Dish.orgID == user.orgID,
-            Dish.dishName != STOCK_DISH_NAME,
         ).first()
         if not dish:
             return jsonify({"error": "Dish not found"}), 404
@@ -1498,123 +2918,298 @@ def consume_stock_for_dish():
         if not recipe_rows:
             return jsonify({"error": "Dish has no ingredients"}), 400
 
-        stock_dish = Dish.query.filter(
-            Dish.orgID == user.orgID,
-            Dish.dishName == STOCK_DISH_NAME,
-        ).first()
-
-        if not stock_dish:
-            return jsonify({"error": "No stock batches available"}), 409
-
-        deductions = []
-
+        recipe = []
         for recipe_link, recipe_ing in recipe_rows:
             if recipe_link.qty is None or not recipe_link.unit:
                 return jsonify({
                     "error": "Recipe is missing qty/unit",
                     "ingredient": recipe_ing.ingName,
                 }), 400
+            recipe.append(RecipeLink(recipe_ing.ingID, recipe_ing.ingName,
+                                     recipe_ing.category, recipe_link.qty, recipe_link.unit))
 
-            required_qty = recipe_link.qty * cooked_qty
+        pool = StockPool.load(user.orgID, {(link.ingName, link.category) for link in recipe})
+        try:
+            deductions, ledger_entries = pool.consume(recipe, cooked_qty)
+        except InsufficientStock as exc:
+            db.session.rollback()
+            return jsonify(exc.payload()), 409
+        pool.apply()
+
+        entry = record_audit("CONSUME", "stock", resource_id=dish.dishID,
+                              details={"dishName": dish.dishName,
+                                       "quantity": float(cooked_qty),
+                                       "deductions_count": len(deductions)},
+                              user_id=user.userID, org_id=user.orgID)
+        record_consumption(user.orgID, ledger_entries, dish_id=dish.dishID,
+                           log_id=entry.logID if entry else None)
+        db.session.commit()
+        stock_analytics.invalidate(user.orgID)
+        return jsonify({
+            "msg": "Stock updated",
+            "dishID": dish.dishID,
+            "quantity": float(cooked_qty),
+            "deductions": deductions,
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception("/stock/consume failed")
+        return jsonify({"error": str(e)}), 500
 
-            batches = Ingredient.query.filter(
-                Ingredient.orgID == user.orgID,
-                Ingredient.ingName == recipe_ing.ingName,
-                Ingredient.category == recipe_ing.category,
-                or_(Ingredient.expiry.isnot(None), Ingredient.batchNum.isnot(None)),
-            ).order_by(
-                Ingredient.expiry.is_(None),
-                Ingredient.expiry.asc(),
-                Ingredient.ingID.asc(),
-            ).all()
 
-            if not batches:
-                return jsonify({
-                    "error": "Insufficient stock",
-                    "ingredient": recipe_ing.ingName,
-                }), 409
+MAX_CONSUME_BATCH_LINES = 5000
 
-            links = {
-                link.ingID: link
-                for link in DishIngredient.query.filter(
-                    DishIngredient.dishID == stock_dish.dishID,
-                    DishIngredient.ingID.in_([batch.ingID for batch in batches]),
-                ).all()
-            }
 
-            total_available = sum(
-                link.qty for link in links.values()
-                if link.qty is not None and link.unit == recipe_link.unit
-            )
+def parse_consume_lines():
+    """
+    Return the raw line dicts of a /stock/consume/batch request.
 
-            if total_available < required_qty:
-                return jsonify({
-                    "error": "Insufficient stock",
-                    "ingredient": recipe_ing.ingName,
-                    "required": float(required_qty),
-                    "available": float(total_available),
-                    "unit": recipe_link.unit,
-                }), 409
+    Accepts a JSON array, a JSON object with a "lines" array, or an NDJSON
+    body (Content-Type application/x-ndjson) with one line per row.
+    Unparseable NDJSON rows come back as None so they can be reported.
+    """
+    if request.mimetype in ("application/x-ndjson", "application/ndjson"):
+        lines = []
+        for raw in request.stream:
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                lines.append(json.loads(raw))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                lines.append(None)
+            if len(lines) > MAX_CONSUME_BATCH_LINES:
+                break
+        return lines
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get("lines")
+    return data if isinstance(data, list) else None
+
+
+@app.route("/stock/consume/batch", methods=["POST"])
+@jwt_required()
+def consume_stock_batch():
+    """
+    Consume stock for many cooked dishes (e.g. POS tickets) in one request.
 
-            remaining = required_qty
-            for batch in batches:
-                if remaining <= 0:
-                    break
-                link = links.get(batch.ingID)
-                if not link or link.qty is None:
-                    continue
-                if link.unit != recipe_link.unit:
-                    continue
+    Every line is planned against one locked StockPool in order, so a line
+    that would overdraw stock is reported as insufficient without affecting
+    the others. Successful lines are applied with a single UPDATE, one audit
+    row and one commit.
 
-                take = min(link.qty, remaining)
-                link.qty = link.qty - take
-                remaining -= take
-                deductions.append({
-                    "ingID": batch.ingID,
-                    "ingName": batch.ingName,
-                    "batchNum": batch.batchNum,
-                    "expiry": batch.expiry.isoformat() if batch.expiry else None,
-                    "qty": float(take),
-                    "unit": link.unit,
-                })
+    Body: [{"dishID": 1, "quantity": 2, "ref": "ticket-123"}, ...]
+          (or {"lines": [...]}, or NDJSON)
+    """
+    try:
+        user = current_identity()
+        if not user:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        raw_lines = parse_consume_lines()
+        if not raw_lines:
+            return jsonify({"error": "No lines provided"}), 400
+        if len(raw_lines) > MAX_CONSUME_BATCH_LINES:
+            return jsonify({"error": f"At most {MAX_CONSUME_BATCH_LINES} lines per request"}), 413
+
+        results = []
+        parsed = []  # (result, dish_id, cooked_qty)
+        for idx, raw in enumerate(raw_lines):
+            result = {"line": idx + 1}
+            results.append(result)
+            if not isinstance(raw, dict):
+                result.update(status="invalid", error="Line must be a JSON object")
+                continue
+            if raw.get("ref") is not None:
+                result["ref"] = raw.get("ref")
+            try:
+                dish_id = int(raw.get("dishID"))
+            except (TypeError, ValueError):
+                result.update(status="invalid", error="Missing dishID")
+                continue
+            result["dishID"] = dish_id
+            try:
+                cooked_qty = parse_quantity(raw.get("quantity"), "quantity")
+            except ValueError as exc:
+                result.update(status="invalid", error=str(exc))
+                continue
+            if cooked_qty is None or cooked_qty <= 0:
+                result.update(status="invalid", error="quantity must be greater than 0")
+                continue
+            result["quantity"] = float(cooked_qty)
+            parsed.append((result, dish_id, cooked_qty))
+
+        dish_ids = {dish_id for _, dish_id, _ in parsed}
+        dishes = {}
+        if dish_ids:
+            dishes = {
+                d.dishID: d for d in Dish.query.filter(
+                    Dish.dishID.in_(list(dish_ids)),
+                    Dish.orgID == user.orgID,
+                ).all()
+            }
+        recipes = load_recipe_graph(user.orgID, dish_ids=list(dishes)) if dishes else {}
+
+        needed = {
+            (link.ingName, link.category)
+            for recipe in recipes.values() for link in recipe
+        }
+        pool = StockPool.load(user.orgID, needed)
+
+        ledger_entries = []
+        consumed_lines = []
+        totals = {}  # (ingName, unit) -> qty
+        for result, dish_id, cooked_qty in parsed:
+            dish = dishes.get(dish_id)
+            if not dish:
+                result.update(status="not_found", error="Dish not found")
+                continue
+            recipe = recipes.get(dish_id)
+            if not recipe:
+                result.update(status="invalid", error="Dish has no ingredients")
+                continue
+            incomplete = next((link for link in recipe if link.qty is None or not link.unit), None)
+            if incomplete:
+                result.update(status="invalid", error="Recipe is missing qty/unit",
+                              ingredient=incomplete.ingName)
+                continue
+            try:
+                deductions, entries = pool.consume(recipe, cooked_qty)
+            except InsufficientStock as exc:
+                result.update(status="insufficient", **exc.payload())
+                continue
+            for entry in entries:
+                entry["dishID"] = dish_id
+                key = (entry["ingName"], entry["unit"])
+                totals[key] = totals.get(key, Decimal("0")) + entry["qty"]
+            ledger_entries.extend(entries)
+            consumed_lines.append({"dishName": dish.dishName, "quantity": float(cooked_qty)})
+            result.update(status="ok", dishName=dish.dishName, deductions=deductions)
+
+        if consumed_lines:
+            pool.apply()
+            entry = record_audit("CONSUME", "stock",
+                                  details={"lines": consumed_lines,
+                                           "lines_count": len(consumed_lines),
+                                           "deductions_count": len(ledger_entries)},
+                                  user_id=user.userID, org_id=user.orgID)
+            record_consumption(user.orgID, ledger_entries,
+                               log_id=entry.logID if entry else None)
+            db.session.commit()
+            stock_analytics.invalidate(user.orgID)
+        else:
+            db.session.rollback()
 
-        record_audit("CONSUME", "stock", resource_id=dish.dishID,
-                      details={"dishName": dish.dishName,
-                               "quantity": float(cooked_qty),
-                               "deductions_count": len(deductions)},
-                      user_id=user.userID, org_id=user.orgID)
-        db.session.commit()
         return jsonify({
-            "msg": "Stock updated",
-            "dishID": dish.dishID,
-            "quantity": float(cooked_qty),
-            "deductions": deductions,
+            "msg": f"{len(consumed_lines)} of {len(results)} lines consumed",
+            "results": results,
+            "summary": {
+                "lines": len(results),
+                "succeeded": len(consumed_lines),
+                "failed": len(results) - len(consumed_lines),
+            },
+            "totals": [
+                {"ingName": name, "unit": unit, "qty": float(qty)}
+                for (name, unit), qty in sorted(totals.items())
+            ],
         }), 200
     except Exception as e:
         db.session.rollback()
-        app.logger.exception("/stock/consume failed")
+        app.logger.exception("/stock/consume/batch failed")
         return jsonify({"error": str(e)}), 500
 
 # --- Spreadsheet Export / Import Routes ---
 
 
-def make_csv_response(rows, headers, filename):
-    """Build a CSV Response from a list of dicts."""
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=headers, extrasaction="ignore")
-    writer.writeheader()
-    for row in rows:
-        writer.writerow(row)
-    content = output.getvalue()
-    return Response(
-        content,
-        mimetype="text/csv",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+EXPORT_YIELD_PER = 1000          # rows fetched per keyset page
+EXPORT_CHUNK_BYTES = 64 * 1024   # flush the CSV buffer to the client at this size
+
+
+def stream_rows(statement, *keys):
+    """
+    Iterate a SELECT in keyset pages of EXPORT_YIELD_PER rows.
+
+    mysql-connector buffers every result client-side (SQLAlchemy has no
+    server-side cursors for it), so a single SELECT would load the whole
+    export into memory. Instead each page is its own query ordered by
+    ``keys`` — expressions that are NOT NULL and unique together — and
+    resumes after the previous page's last key. The pages run in the same
+    transaction, so InnoDB serves them all from one snapshot.
+    """
+    paged = statement.add_columns(*keys).order_by(*keys).limit(EXPORT_YIELD_PER)
+    width = len(keys)
+    last = None
+    while True:
+        page = paged if last is None else paged.where(tuple_(*keys) > tuple_(*last))
+        rows = db.session.execute(page).all()
+        for row in rows:
+            yield tuple(row[:-width])
+        if len(rows) < EXPORT_YIELD_PER:
+            return
+        last = tuple(rows[-1][-width:])
+
+
+def stream_csv_response(rows, headers, filename, on_complete=None):
+    """
+    Stream ``rows`` (any iterable of dicts) as a chunked CSV download.
+
+    Rows are written into a small buffer that is flushed every
+    EXPORT_CHUNK_BYTES, so memory stays flat however large the export is.
+    The body is gzip-encoded when the client accepts it (``?gzip=0`` opts
+    out). ``on_complete(row_count)`` runs after the last row has been sent,
+    still inside the request context — exports use it to write their audit
+    row only once the download has actually finished.
+    """
+    use_gzip = (
+        "gzip" in (request.headers.get("Accept-Encoding") or "").lower()
+        and request.args.get("gzip", "1") != "0"
     )
 
+    def generate():
+        compressor = zlib.compressobj(wbits=31) if use_gzip else None
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=headers, extrasaction="ignore")
+        writer.writeheader()
+        count = 0
 
-def parse_csv_upload():
-    """Return list[dict] from an uploaded CSV file, or (None, error_response)."""
+        def drain():
+            data = buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            return compressor.compress(data) if compressor else data
+
+        try:
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+                if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                    chunk = drain()
+                    if chunk:
+                        yield chunk
+            chunk = drain()
+            if compressor:
+                chunk += compressor.flush()
+            if chunk:
+                yield chunk
+        except Exception:
+            # Headers are already sent, so re-raise: the server then drops
+            # the connection and the client sees a failed download instead
+            # of a clean 200 with rows missing.
+            app.logger.exception("Streaming %s failed after %d rows", filename, count)
+            raise
+        if on_complete:
+            on_complete(count)
+
+    response_headers = {"Content-Disposition": f'attachment; filename="{filename}"',
+                        "Vary": "Accept-Encoding"}
+    if use_gzip:
+        response_headers["Content-Encoding"] = "gzip"
+    return Response(stream_with_context(generate()), mimetype="text/csv",
+                    headers=response_headers)
+
+
+def get_csv_upload():
+    """Return (FileStorage, None) for the request's CSV upload, or (None, error_response)."""
     if "file" not in request.files:
         return None, (jsonify({"error": "No file uploaded"}), 400)
     file = request.files["file"]
@@ -1622,13 +3217,483 @@ def parse_csv_upload():
         return None, (jsonify({"error": "Empty filename"}), 400)
     if not file.filename.lower().endswith(".csv"):
         return None, (jsonify({"error": "Only .csv files are supported"}), 400)
+    return file, None
+
+
+def iter_csv(binary_stream):
+    """Decode and parse a CSV byte stream lazily, one dict per row."""
+    return csv.DictReader(codecs.getreader("utf-8-sig")(binary_stream))
+
+
+def parse_csv_upload():
+    """
+    Return (iterator of dicts, None) for an uploaded CSV file, or
+    (None, error_response). Rows are parsed as they are consumed, so
+    decoding errors surface as UnicodeDecodeError / csv.Error mid-import.
+    """
+    file, err = get_csv_upload()
+    if err:
+        return None, err
+    return iter_csv(file.stream), None
+
+
+def csv_parse_error(exc):
+    db.session.rollback()
+    return jsonify({"error": f"Unable to parse CSV: {exc}"}), 400
+
+
+# --- Bulk CSV Import ---
+#
+# The /import/* endpoints parse the file once and then work in chunks of
+# IMPORT_CHUNK_SIZE rows: each chunk resolves the names it references with
+# one IN query and writes with one multi-row INSERT, so the number of
+# statements grows with rows / chunk size instead of with rows.
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_REPORTED_ERRORS = 200
+
+
+class ImportReport:
+    """Counters, per-row errors and throughput for one CSV import."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.created = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message, skip=True):
+        """Record a problem with CSV ``line``; ``skip`` counts the row as not imported."""
+        if skip:
+            self.skipped += 1
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "rows": self.rows,
+            "created": self.created,
+            "skipped": self.skipped,
+            "errorCount": self.error_count,
+            "errors": self.errors,
+            "errorsTruncated": self.error_count > len(self.errors),
+            "elapsedMs": round(elapsed * 1000, 1),
+            "rowsPerSecond": round(self.rows / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+def numbered_rows(rows):
+    """Pair CSV dict rows with their line number in the file (header is line 1)."""
+    return ((index + 2, row) for index, row in enumerate(rows))
+
+
+def chunked(iterable, size=IMPORT_CHUNK_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def name_key(name):
+    """
+    Case- and whitespace-insensitive form of an ingredient or dish name, for
+    matching in Python what the column's case-insensitive collation matches
+    in SQL.
+    """
+    return " ".join(name.split()).casefold()
+
+
+def load_master_ingredients(org_id, names):
+    """Return {name_key(ingName): Ingredient row} for the org's masters among ``names``."""
+    found = {}
+    for names_chunk in chunked(sorted(set(names))):
+        rows = db.session.execute(
+            select(Ingredient.ingID, Ingredient.ingName, Ingredient.category).where(
+                Ingredient.orgID == org_id,
+                Ingredient.ingName.in_(names_chunk),
+                IS_MASTER,
+            ).order_by(Ingredient.ingID.asc())
+        ).all()
+        for row in rows:
+            found.setdefault(name_key(row.ingName), row)
+    return found
+
+
+def insert_with_ids(model, mappings, match):
+    """
+    Insert ``mappings`` with one multi-row INSERT and return their new
+    primary keys in order.
+
+    MySQL reports the first auto-increment id of a multi-row insert; the
+    ids that follow are read back and checked against the ``match``
+    columns, so an interleaved concurrent insert fails loudly instead of
+    mis-linking rows.
+    """
+    if not mappings:
+        return []
+    pk = model.__mapper__.primary_key[0]
+    result = db.session.execute(insert(model).values(mappings))
+    first_id = result.lastrowid
+    ids = list(range(first_id, first_id + len(mappings)))
+    columns = [getattr(model, name) for name in match]
+    stored = {
+        row[0]: tuple(row[1:])
+        for row in db.session.execute(select(pk, *columns).where(pk.in_(ids))).all()
+    }
+    for new_id, mapping in zip(ids, mappings):
+        if stored.get(new_id) != tuple(mapping[name] for name in match):
+            raise RuntimeError(f"{model.__tablename__}: inserted ids are not contiguous; retry the import")
+    return ids
+
+
+def import_ingredient_rows(org_id, rows, report=None):
+    """Create master ingredients for ``rows`` [(line, dict)] not already in the org."""
+    report = report or ImportReport()
+    seen = set()
+    for chunk in chunked(rows):
+        report.rows += len(chunk)
+        names = [(row.get("ingName") or row.get("name") or "").strip() for _, row in chunk]
+        existing = load_master_ingredients(org_id, [name for name in names if name])
+        mappings = []
+        for (line, row), ing_name in zip(chunk, names):
+            if not ing_name:
+                report.error(line, "ingName is required")
+                continue
+            key = name_key(ing_name)
+            if key in existing or key in seen:
+                report.skipped += 1
+                continue
+            seen.add(key)
+            mappings.append({
+                "ingName": ing_name,
+                "category": (row.get("category") or "").strip() or None,
+                "expiry": None,
+                "batchNum": None,
+                "orgID": org_id,
+            })
+        if mappings:
+            db.session.execute(insert(Ingredient), mappings)
+            report.created += len(mappings)
+    return report
+
+
+def import_stock_rows(org_id, rows, report=None):
+    """Create stock batches for ``rows`` [(line, dict)], one INSERT per chunk."""
+    report = report or ImportReport()
+    received_at = datetime.utcnow()
+    for chunk in chunked(rows):
+        report.rows += len(chunk)
+        names = [(row.get("ingName") or row.get("name") or "").strip() for _, row in chunk]
+        masters = load_master_ingredients(org_id, [name for name in names if name])
+        batches = []
+        for (line, row), ing_name in zip(chunk, names):
+            if not ing_name:
+                report.error(line, "ingName is required")
+                continue
+            master = masters.get(name_key(ing_name))
+            if not master:
+                report.error(line, f"Unknown ingredient '{ing_name}'")
+                continue
+            expiry_str = (row.get("expiry") or "").strip()
+            batch_num = (row.get("batchNum") or "").strip() or None
+            expiry = None
+            if expiry_str:
+                try:
+                    expiry = datetime.strptime(expiry_str, "%Y-%m-%d").date()
+                except ValueError:
+                    report.error(line, f"Invalid expiry '{expiry_str}' (expected YYYY-MM-DD)")
+                    continue
+            if not expiry and not batch_num:
+                report.error(line, "expiry or batchNum is required")
+                continue
+            qty_str = (row.get("qty") or "").strip()
+            unit_str = unit_registry.canonical(row.get("unit"))
+            if not qty_str or not unit_str:
+                report.error(line, "qty and unit are required")
+                continue
+            try:
+                qty = Decimal(qty_str)
+            except (InvalidOperation, ValueError):
+                report.error(line, f"Invalid qty '{qty_str}'")
+                continue
+            batches.append({
+                "orgID": org_id,
+                "masterIngID": master.ingID,
+                "qty": qty,
+                "unit": unit_str,
+                "expiry": expiry,
+                "batchNum": batch_num,
+                "received_at": received_at,
+            })
+        if not batches:
+            continue
+        db.session.execute(insert(StockBatch), batches)
+        deltas = {}
+        for batch in batches:
+            stock_delta(deltas, batch["masterIngID"], batch["unit"], batch["qty"], batches=1)
+        adjust_stock_on_hand(org_id, deltas)
+        report.created += len(batches)
+    return report
+
+
+def import_dish_rows(org_id, rows, report=None):
+    """
+    Create dishes (one CSV row per recipe line) that don't exist yet.
+
+    Rows are grouped by dishName first (compared as name_key, keeping the
+    first spelling), since a dish's lines need not be adjacent in the
+    file; recipe lines naming an unknown ingredient are
+    reported and left out while the dish itself is still created.
+    """
+    report = report or ImportReport()
+    dishes_map = OrderedDict()
+    for line, row in rows:
+        report.rows += 1
+        dish_name = (row.get("dishName") or row.get("name") or "").strip()
+        if not dish_name:
+            report.error(line, "dishName is required", skip=False)
+            continue
+        _, lines = dishes_map.setdefault(name_key(dish_name), (dish_name, []))
+        ing_name = (row.get("ingName") or "").strip()
+        if ing_name:
+            lines.append((line, ing_name, row.get("qty", ""), row.get("unit", "")))
+
+    existing = set()
+    for names_chunk in chunked([name for name, _ in dishes_map.values()]):
+        existing.update(name_key(name) for (name,) in db.session.execute(
+            select(Dish.dishName).where(Dish.orgID == org_id, Dish.dishName.in_(names_chunk))
+        ).all())
+    masters = load_master_ingredients(
+        org_id, [ing for _, lines in dishes_map.values() for _, ing, _, _ in lines]
+    )
+
+    for names_chunk in chunked([name for key, (name, _) in dishes_map.items() if key not in existing]):
+        ids = insert_with_ids(Dish, [{"dishName": name, "orgID": org_id} for name in names_chunk],
+                              ("dishName",))
+        links = []
+        for dish_id, dish_name in zip(ids, names_chunk):
+            linked = set()
+            for line, ing_name, qty_raw, unit in dishes_map[name_key(dish_name)][1]:
+                master = masters.get(name_key(ing_name))
+                if not master:
+                    report.error(line, f"Unknown ingredient '{ing_name}'", skip=False)
+                    continue
+                if master.ingID in linked:
+                    report.error(line, f"Duplicate ingredient '{ing_name}' for '{dish_name}'", skip=False)
+                    continue
+                linked.add(master.ingID)
+                qty_val = None
+                try:
+                    qty_val = Decimal(str(qty_raw)) if qty_raw else None
+                except (InvalidOperation, ValueError):
+                    pass
+                links.append({"dishID": dish_id, "ingID": master.ingID, "qty": qty_val,
+                              "unit": unit_registry.canonical(unit) or None})
+        for links_chunk in chunked(links):
+            db.session.execute(insert(DishIngredient), links_chunk)
+        report.created += len(ids)
+    report.skipped += len(existing)
+    return report
+
+
+IMPORT_UPLOAD_DIR = os.getenv(
+    "IMPORT_UPLOAD_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+)
+IMPORT_UPLOAD_TTL_SECONDS = int(os.getenv("IMPORT_UPLOAD_TTL_HOURS", "24")) * 3600
+IMPORT_UPLOAD_MAX_CHUNK_BYTES = 16 * 1024 * 1024
+# A running job's worker refreshes heartbeat_at this often; a queued or
+# running job silent for IMPORT_JOB_STALE_SECONDS lost its worker.
+IMPORT_JOB_HEARTBEAT_SECONDS = 30
+IMPORT_JOB_STALE_SECONDS = int(os.getenv("IMPORT_JOB_STALE_SECONDS", "300"))
+
+# kind -> (engine, audit resource_type)
+IMPORTERS = {
+    "ingredients": (import_ingredient_rows, "ingredient"),
+    "dishes": (import_dish_rows, "dish"),
+    "stock": (import_stock_rows, "stock"),
+}
+
+
+def update_import_job(job_id, **fields):
+    """Persist job progress on its own connection, visible while the import transaction is open."""
+    with db.engine.begin() as conn:
+        conn.execute(update(ImportJob).where(ImportJob.jobID == job_id)
+                     .values(heartbeat_at=datetime.utcnow(), **fields))
+
+
+def claim_import_job(job_id):
+    """Move a queued job to running; False if another worker already took it."""
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        return conn.execute(
+            update(ImportJob).where(ImportJob.jobID == job_id, ImportJob.status == "queued")
+            .values(status="running", started_at=now, heartbeat_at=now)
+        ).rowcount == 1
+
+
+def import_job_path(job_id):
+    """Where a job's CSV waits until the job has run."""
+    return os.path.join(IMPORT_UPLOAD_DIR, f"job-{job_id}.csv")
+
+
+def recover_import_jobs(job_ids=None):
+    """
+    Settle queued/running jobs whose worker went away (restart, crash, kill).
+
+    A job counts as orphaned once its heartbeat is IMPORT_JOB_STALE_SECONDS
+    old. Queued jobs whose CSV is still spooled are handed to this worker's
+    pool again (claim_import_job keeps the original worker from also
+    running them). Running jobs are failed instead: the import may already
+    have committed, and running it again could duplicate stock batches.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=IMPORT_JOB_STALE_SECONDS)
+    last_seen = func.coalesce(ImportJob.heartbeat_at, ImportJob.created_at)
+    query = select(ImportJob.jobID, ImportJob.status).where(
+        ImportJob.status.in_(("queued", "running")), last_seen < cutoff,
+    )
+    if job_ids is not None:
+        query = query.where(ImportJob.jobID.in_(list(job_ids)))
+    stale = db.session.execute(query).all()
+    db.session.rollback()
+    for job_id, status in stale:
+        path = import_job_path(job_id)
+        requeue = status == "queued" and os.path.exists(path)
+        values = {"heartbeat_at": datetime.utcnow()}
+        if not requeue:
+            values.update(status="failed", finished_at=datetime.utcnow(),
+                          message="Interrupted by a server restart; upload the file again")
+        with db.engine.begin() as conn:
+            # Only the worker whose UPDATE still sees the stale row acts on it
+            taken = conn.execute(
+                update(ImportJob).where(ImportJob.jobID == job_id, ImportJob.status == status,
+                                        last_seen < cutoff).values(**values)
+            ).rowcount == 1
+        if not taken:
+            continue
+        if requeue:
+            app.logger.info("Requeueing orphaned import job %s", job_id)
+            submit_background(run_import_job, job_id, path)
+        else:
+            app.logger.warning("Import job %s was interrupted; marked failed", job_id)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return len(stale)
+
+
+_import_recovery_pid = None
+
+
+@app.before_request
+def recover_import_jobs_on_start():
+    """Once per worker process, settle jobs orphaned by a previous one."""
+    global _import_recovery_pid
+    if _import_recovery_pid != os.getpid():
+        _import_recovery_pid = os.getpid()
+        submit_background(recover_import_jobs)
+
+
+def import_job_progress(report):
+    return {
+        "rows": report.rows,
+        "created": report.created,
+        "skipped": report.skipped,
+        "error_count": report.error_count,
+        "errors": json.dumps(report.errors),
+    }
+
+
+def run_import_job(job_id, path):
+    """Background body of an import job: parse ``path`` incrementally and import it."""
+    if not claim_import_job(job_id):
+        return
+    job = db.session.get(ImportJob, job_id)
+    importer, resource_type = IMPORTERS[job.kind]
+    kind, org_id, user_id = job.kind, job.orgID, job.userID
+    db.session.rollback()
+    report = ImportReport()
+
+    # Keep the heartbeat fresh through long phases with no progress updates
+    # (e.g. a dish import's inserts), so recover_import_jobs leaves it alone.
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(IMPORT_JOB_HEARTBEAT_SECONDS):
+            with app.app_context():
+                try:
+                    update_import_job(job_id)
+                except Exception:
+                    app.logger.exception("Import job %s heartbeat failed", job_id)
+
+    threading.Thread(target=heartbeat, name=f"import-heartbeat-{job_id}", daemon=True).start()
+
+    def tracked(rows):
+        for count, item in enumerate(rows, 1):
+            if count % IMPORT_CHUNK_SIZE == 0:
+                update_import_job(job_id, **{**import_job_progress(report), "rows": count})
+            yield item
+
     try:
-        stream = io.StringIO(file.stream.read().decode("utf-8-sig"))
-        reader = csv.DictReader(stream)
-        rows = list(reader)
-        return rows, None
+        with open(path, "rb") as fh:
+            importer(org_id, tracked(numbered_rows(iter_csv(fh))), report)
+        record_audit("IMPORT", resource_type,
+                      details={"created": report.created, "skipped": report.skipped, "jobID": job_id},
+                      user_id=user_id, org_id=org_id)
+        db.session.commit()
+        if kind == "stock":
+            stock_analytics.invalidate(org_id)
+        update_import_job(job_id, status="done", finished_at=datetime.utcnow(),
+                          **import_job_progress(report))
     except Exception as exc:
-        return None, (jsonify({"error": f"Unable to parse CSV: {exc}"}), 400)
+        db.session.rollback()
+        app.logger.exception("Import job %s failed", job_id)
+        update_import_job(job_id, status="failed", finished_at=datetime.utcnow(),
+                          message=str(exc)[:255], **import_job_progress(report))
+    finally:
+        stopped.set()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def start_import_job(kind, user, path):
+    """Record a queued ImportJob for the CSV at ``path`` and hand it to the background pool."""
+    job = ImportJob(jobID=uuid.uuid4().hex, orgID=user.orgID, userID=user.userID, kind=kind)
+    # Spool under the job id so recover_import_jobs can find the file again
+    os.replace(path, import_job_path(job.jobID))
+    path = import_job_path(job.jobID)
+    db.session.add(job)
+    db.session.commit()
+    submit_background(run_import_job, job.jobID, path)
+    return job
+
+
+def enqueue_csv_import(kind, user):
+    """Handle ``?async=1``: spool the upload to disk and return 202 with the job id."""
+    file, err = get_csv_upload()
+    if err:
+        return err
+    os.makedirs(IMPORT_UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_UPLOAD_DIR, f"{uuid.uuid4().hex}.csv")
+    with open(path, "wb") as fh:
+        shutil.copyfileobj(file.stream, fh, 1024 * 1024)
+    job = start_import_job(kind, user, path)
+    return jsonify({"msg": "Import queued", "jobId": job.jobID,
+                    "statusUrl": f"/import/jobs/{job.jobID}"}), 202
+
+
+def wants_async_import():
+    return request.args.get("async", "").lower() in ("1", "true", "yes")
 
 
 # ---- Ingredients export / import ----
@@ -1637,20 +3702,25 @@ def parse_csv_upload():
 @jwt_required()
 def export_ingredients():
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
-        ingredients = Ingredient.query.filter(
-            Ingredient.orgID == user.orgID,
-            Ingredient.expiry.is_(None),
-            Ingredient.batchNum.is_(None),
-        ).order_by(Ingredient.ingName.asc()).all()
-        rows = [{"ingName": i.ingName, "category": i.category or ""} for i in ingredients]
-        record_audit("EXPORT", "ingredient",
-                      details={"count": len(rows)},
-                      user_id=user.userID, org_id=user.orgID)
-        db.session.commit()
-        return make_csv_response(rows, ["ingName", "category"], "ingredients.csv")
+        org_id, user_id = user.orgID, user.userID
+        result = stream_rows(
+            select(Ingredient.ingName, Ingredient.category)
+            .where(
+                Ingredient.orgID == org_id,
+                IS_MASTER,
+            ),
+            Ingredient.ingName, Ingredient.ingID,
+        )
+        rows = ({"ingName": ing_name, "category": category or ""} for ing_name, category in result)
+        return stream_csv_response(
+            rows, ["ingName", "category"], "ingredients.csv",
+            on_complete=lambda count: record_audit_detached(
+                "EXPORT", "ingredient", details={"count": count},
+                user_id=user_id, org_id=org_id),
+        )
     except Exception as e:
         app.logger.exception("/export/ingredients failed")
         return jsonify({"error": str(e)}), 500
@@ -1660,41 +3730,23 @@ def export_ingredients():
 @jwt_required()
 def import_ingredients():
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
+        if wants_async_import():
+            return enqueue_csv_import("ingredients", user)
         rows, err = parse_csv_upload()
         if err:
             return err
-        created = 0
-        skipped = 0
-        for row in rows:
-            ing_name = (row.get("ingName") or row.get("name") or "").strip()
-            if not ing_name:
-                skipped += 1
-                continue
-            existing = Ingredient.query.filter(
-                Ingredient.orgID == user.orgID,
-                Ingredient.ingName == ing_name,
-                Ingredient.expiry.is_(None),
-                Ingredient.batchNum.is_(None),
-            ).first()
-            if existing:
-                skipped += 1
-                continue
-            db.session.add(Ingredient(
-                ingName=ing_name,
-                category=(row.get("category") or "").strip() or None,
-                expiry=None,
-                batchNum=None,
-                orgID=user.orgID,
-            ))
-            created += 1
+        report = import_ingredient_rows(user.orgID, numbered_rows(rows))
         record_audit("IMPORT", "ingredient",
-                      details={"created": created, "skipped": skipped},
+                      details={"created": report.created, "skipped": report.skipped},
                       user_id=user.userID, org_id=user.orgID)
         db.session.commit()
-        return jsonify({"msg": f"{created} ingredients imported, {skipped} skipped"}), 201
+        return jsonify({"msg": f"{report.created} ingredients imported, {report.skipped} skipped",
+                        **report.as_dict()}), 201
+    except (UnicodeDecodeError, csv.Error) as e:
+        return csv_parse_error(e)
     except Exception as e:
         db.session.rollback()
         app.logger.exception("/import/ingredients failed")
@@ -1703,40 +3755,55 @@ def import_ingredients():
 
 # ---- Dishes export / import ----
 
-@app.route("/export/dishes", methods=["GET"])
-@jwt_required()
-def export_dishes():
-    try:
-        user = get_current_user()
-        if not user:
-            return jsonify({"error": "Unauthorized"}), 401
-        dishes = Dish.query.filter(
-            Dish.orgID == user.orgID,
-            Dish.dishName != STOCK_DISH_NAME,
-        ).order_by(Dish.dishName.asc()).all()
-        rows = []
-        for dish in dishes:
-            links = (
-                db.session.query(DishIngredient, Ingredient)
-                .join(Ingredient, Ingredient.ingID == DishIngredient.ingID)
-                .filter(DishIngredient.dishID == dish.dishID)
-                .all()
-            )
-            if links:
-                for link, ing in links:
-                    rows.append({
-                        "dishName": dish.dishName,
-                        "ingName": ing.ingName,
-                        "qty": float(link.qty) if link.qty is not None else "",
-                        "unit": link.unit or "",
-                    })
-            else:
-                rows.append({"dishName": dish.dishName, "ingName": "", "qty": "", "unit": ""})
-        record_audit("EXPORT", "dish",
-                      details={"dish_count": len(dishes), "row_count": len(rows)},
-                      user_id=user.userID, org_id=user.orgID)
-        db.session.commit()
-        return make_csv_response(rows, ["dishName", "ingName", "qty", "unit"], "dishes.csv")
+@app.route("/export/dishes", methods=["GET"])
+@jwt_required()
+def export_dishes():
+    try:
+        user = current_identity()
+        if not user:
+            return jsonify({"error": "Unauthorized"}), 401
+        org_id, user_id = user.orgID, user.userID
+        # Outer joins keep dishes without ingredients; the master-ingredient
+        # conditions live in the ON clause so they don't drop those dishes.
+        result = stream_rows(
+            select(Dish.dishID, Dish.dishName, Ingredient.ingName, DishIngredient.qty, DishIngredient.unit)
+            .outerjoin(DishIngredient, DishIngredient.dishID == Dish.dishID)
+            .outerjoin(Ingredient, and_(
+                Ingredient.ingID == DishIngredient.ingID,
+                IS_MASTER,
+            ))
+            .where(Dish.orgID == org_id),
+            Dish.dishName, Dish.dishID,
+            func.coalesce(Ingredient.ingName, ""), func.coalesce(DishIngredient.ingID, 0),
+        )
+        stats = {"dish_count": 0}
+
+        def rows():
+            current_dish, current_name, emitted = None, None, False
+            for dish_id, dish_name, ing_name, qty, unit in result:
+                if dish_id != current_dish:
+                    if current_dish is not None and not emitted:
+                        yield {"dishName": current_name, "ingName": "", "qty": "", "unit": ""}
+                    current_dish, current_name, emitted = dish_id, dish_name, False
+                    stats["dish_count"] += 1
+                if ing_name is None:
+                    continue
+                emitted = True
+                yield {
+                    "dishName": dish_name,
+                    "ingName": ing_name,
+                    "qty": float(qty) if qty is not None else "",
+                    "unit": unit or "",
+                }
+            if current_dish is not None and not emitted:
+                yield {"dishName": current_name, "ingName": "", "qty": "", "unit": ""}
+
+        return stream_csv_response(
+            rows(), ["dishName", "ingName", "qty", "unit"], "dishes.csv",
+            on_complete=lambda count: record_audit_detached(
+                "EXPORT", "dish", details={"dish_count": stats["dish_count"], "row_count": count},
+                user_id=user_id, org_id=org_id),
+        )
     except Exception as e:
         app.logger.exception("/export/dishes failed")
         return jsonify({"error": str(e)}), 500
@@ -1746,63 +3813,23 @@ def export_dishes():
 @jwt_required()
 def import_dishes():
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
+        if wants_async_import():
+            return enqueue_csv_import("dishes", user)
         rows, err = parse_csv_upload()
         if err:
             return err
-        dishes_map: dict[str, list] = {}
-        for row in rows:
-            dish_name = (row.get("dishName") or row.get("name") or "").strip()
-            if not dish_name or dish_name == STOCK_DISH_NAME:
-                continue
-            dishes_map.setdefault(dish_name, [])
-            ing_name = (row.get("ingName") or "").strip()
-            if ing_name:
-                dishes_map[dish_name].append({
-                    "ingName": ing_name,
-                    "qty": row.get("qty", ""),
-                    "unit": row.get("unit", ""),
-                })
-        created = 0
-        skipped = 0
-        for dish_name, ingredients in dishes_map.items():
-            existing = Dish.query.filter(
-                Dish.orgID == user.orgID,
-                Dish.dishName == dish_name,
-            ).first()
-            if existing:
-                skipped += 1
-                continue
-            new_dish = Dish(dishName=dish_name, orgID=user.orgID)
-            db.session.add(new_dish)
-            db.session.flush()
-            for ing_info in ingredients:
-                master = Ingredient.query.filter(
-                    Ingredient.orgID == user.orgID,
-                    Ingredient.ingName == ing_info["ingName"],
-                    Ingredient.expiry.is_(None),
-                    Ingredient.batchNum.is_(None),
-                ).first()
-                if master:
-                    qty_val = None
-                    try:
-                        qty_val = Decimal(str(ing_info["qty"])) if ing_info["qty"] else None
-                    except (InvalidOperation, ValueError):
-                        pass
-                    db.session.add(DishIngredient(
-                        dishID=new_dish.dishID,
-                        ingID=master.ingID,
-                        qty=qty_val,
-                        unit=ing_info["unit"] or None,
-                    ))
-            created += 1
+        report = import_dish_rows(user.orgID, numbered_rows(rows))
         record_audit("IMPORT", "dish",
-                      details={"created": created, "skipped": skipped},
+                      details={"created": report.created, "skipped": report.skipped},
                       user_id=user.userID, org_id=user.orgID)
         db.session.commit()
-        return jsonify({"msg": f"{created} dishes imported, {skipped} skipped"}), 201
+        return jsonify({"msg": f"{report.created} dishes imported, {report.skipped} skipped",
+                        **report.as_dict()}), 201
+    except (UnicodeDecodeError, csv.Error) as e:
+        return csv_parse_error(e)
     except Exception as e:
         db.session.rollback()
         app.logger.exception("/import/dishes failed")
@@ -1815,42 +3842,34 @@ def import_dishes():
 @jwt_required()
 def export_stock():
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
-        stock_dish = Dish.query.filter(
-            Dish.orgID == user.orgID,
-            Dish.dishName == STOCK_DISH_NAME,
-        ).first()
-        stock_dish_id = stock_dish.dishID if stock_dish else None
-        batches = Ingredient.query.filter(
-            Ingredient.orgID == user.orgID,
-            or_(Ingredient.expiry.isnot(None), Ingredient.batchNum.isnot(None)),
-        ).order_by(Ingredient.ingName.asc()).all()
-        qty_map = {}
-        if stock_dish_id and batches:
-            ids = [b.ingID for b in batches]
-            qty_rows = DishIngredient.query.filter(
-                DishIngredient.dishID == stock_dish_id,
-                DishIngredient.ingID.in_(ids),
-            ).all()
-            qty_map = {r.ingID: {"qty": float(r.qty) if r.qty else "", "unit": r.unit or ""} for r in qty_rows}
-        rows = []
-        for b in batches:
-            q = qty_map.get(b.ingID, {})
-            rows.append({
-                "ingName": b.ingName,
-                "category": b.category or "",
-                "batchNum": b.batchNum or "",
-                "expiry": b.expiry.isoformat() if b.expiry else "",
-                "qty": q.get("qty", ""),
-                "unit": q.get("unit", ""),
-            })
-        record_audit("EXPORT", "stock",
-                      details={"count": len(rows)},
-                      user_id=user.userID, org_id=user.orgID)
-        db.session.commit()
-        return make_csv_response(rows, ["ingName", "category", "batchNum", "expiry", "qty", "unit"], "stock.csv")
+        org_id, user_id = user.orgID, user.userID
+        result = stream_rows(
+            select(Ingredient.ingName, Ingredient.category, StockBatch.batchNum, StockBatch.expiry,
+                   StockBatch.qty, StockBatch.unit)
+            .join(Ingredient, and_(Ingredient.ingID == StockBatch.masterIngID, Ingredient.orgID == org_id))
+            .where(StockBatch.orgID == org_id),
+            Ingredient.ingName, StockBatch.batchID,
+        )
+        rows = (
+            {
+                "ingName": ing_name,
+                "category": category or "",
+                "batchNum": batch_num or "",
+                "expiry": expiry.isoformat() if expiry else "",
+                "qty": float(qty) if qty else "",
+                "unit": unit or "",
+            }
+            for ing_name, category, batch_num, expiry, qty, unit in result
+        )
+        return stream_csv_response(
+            rows, ["ingName", "category", "batchNum", "expiry", "qty", "unit"], "stock.csv",
+            on_complete=lambda count: record_audit_detached(
+                "EXPORT", "stock", details={"count": count},
+                user_id=user_id, org_id=org_id),
+        )
     except Exception as e:
         app.logger.exception("/export/stock failed")
         return jsonify({"error": str(e)}), 500
@@ -1860,72 +3879,24 @@ def export_stock():
 @jwt_required()
 def import_stock():
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
+        if wants_async_import():
+            return enqueue_csv_import("stock", user)
         rows, err = parse_csv_upload()
         if err:
             return err
-        created = 0
-        skipped = 0
-        for row in rows:
-            ing_name = (row.get("ingName") or row.get("name") or "").strip()
-            if not ing_name:
-                skipped += 1
-                continue
-            master = Ingredient.query.filter(
-                Ingredient.orgID == user.orgID,
-                Ingredient.ingName == ing_name,
-                Ingredient.expiry.is_(None),
-                Ingredient.batchNum.is_(None),
-            ).first()
-            if not master:
-                skipped += 1
-                continue
-            expiry_str = (row.get("expiry") or "").strip()
-            batch_num = (row.get("batchNum") or "").strip() or None
-            expiry = None
-            if expiry_str:
-                try:
-                    expiry = datetime.strptime(expiry_str, "%Y-%m-%d").date()
-                except ValueError:
-                    skipped += 1
-                    continue
-            if not expiry and not batch_num:
-                skipped += 1
-                continue
-            qty_str = (row.get("qty") or "").strip()
-            unit_str = (row.get("unit") or "").strip()
-            if not qty_str or not unit_str:
-                skipped += 1
-                continue
-            try:
-                qty = Decimal(qty_str)
-            except (InvalidOperation, ValueError):
-                skipped += 1
-                continue
-            new_batch = Ingredient(
-                ingName=master.ingName,
-                category=master.category,
-                expiry=expiry,
-                batchNum=batch_num,
-                orgID=user.orgID,
-            )
-            db.session.add(new_batch)
-            db.session.flush()
-            stock_dish = get_or_create_stock_dish(user.orgID)
-            db.session.add(DishIngredient(
-                dishID=stock_dish.dishID,
-                ingID=new_batch.ingID,
-                qty=qty,
-                unit=unit_str,
-            ))
-            created += 1
+        report = import_stock_rows(user.orgID, numbered_rows(rows))
         record_audit("IMPORT", "stock",
-                      details={"created": created, "skipped": skipped},
+                      details={"created": report.created, "skipped": report.skipped},
                       user_id=user.userID, org_id=user.orgID)
         db.session.commit()
-        return jsonify({"msg": f"{created} batches imported, {skipped} skipped"}), 201
+        stock_analytics.invalidate(user.orgID)
+        return jsonify({"msg": f"{report.created} batches imported, {report.skipped} skipped",
+                        **report.as_dict()}), 201
+    except (UnicodeDecodeError, csv.Error) as e:
+        return csv_parse_error(e)
     except Exception as e:
         db.session.rollback()
         app.logger.exception("/import/stock failed")
@@ -1943,13 +3914,18 @@ def export_users():
             return jsonify({"error": "Unauthorized"}), 401
         if user.uRole != "admin":
             return jsonify({"error": "Forbidden"}), 403
-        users = User.query.filter(User.orgID == user.orgID).order_by(User.email.asc()).all()
-        rows = [{"email": u.email, "role": u.uRole} for u in users]
-        record_audit("EXPORT", "user",
-                      details={"count": len(rows)},
-                      user_id=user.userID, org_id=user.orgID)
-        db.session.commit()
-        return make_csv_response(rows, ["email", "role"], "users.csv")
+        org_id, user_id = user.orgID, user.userID
+        result = stream_rows(
+            select(User.email, User.uRole).where(User.orgID == org_id),
+            User.email, User.userID,
+        )
+        rows = ({"email": email, "role": role} for email, role in result)
+        return stream_csv_response(
+            rows, ["email", "role"], "users.csv",
+            on_complete=lambda count: record_audit_detached(
+                "EXPORT", "user", details={"count": count},
+                user_id=user_id, org_id=org_id),
+        )
     except Exception as e:
         app.logger.exception("/export/users failed")
         return jsonify({"error": str(e)}), 500
@@ -1994,18 +3970,207 @@ def import_users():
                       user_id=user.userID, org_id=user.orgID)
         db.session.commit()
         return jsonify({"msg": f"{created} users imported, {skipped} skipped"}), 201
+    except (UnicodeDecodeError, csv.Error) as e:
+        return csv_parse_error(e)
     except Exception as e:
         db.session.rollback()
         app.logger.exception("/import/users failed")
         return jsonify({"error": str(e)}), 500
 
 
+# ---- Import jobs & resumable uploads ----
+
+@app.route("/import/jobs/<job_id>", methods=["GET"])
+@jwt_required()
+def get_import_job(job_id):
+    try:
+        user = current_identity()
+        if not user:
+            return jsonify({"error": "Unauthorized"}), 401
+        job = db.session.get(ImportJob, job_id)
+        if not job or job.orgID != user.orgID:
+            return jsonify({"error": "Import job not found"}), 404
+        if job.status in ("queued", "running") and recover_import_jobs([job_id]):
+            db.session.refresh(job)
+        return jsonify({
+            "jobId": job.jobID,
+            "kind": job.kind,
+            "status": job.status,
+            "rows": job.rows,
+            "created": job.created,
+            "skipped": job.skipped,
+            "errorCount": job.error_count,
+            "errors": json.loads(job.errors) if job.errors else [],
+            "message": job.message,
+            "createdAt": job.created_at.isoformat() if job.created_at else None,
+            "startedAt": job.started_at.isoformat() if job.started_at else None,
+            "finishedAt": job.finished_at.isoformat() if job.finished_at else None,
+        }), 200
+    except Exception as e:
+        app.logger.exception("/import/jobs failed")
+        return jsonify({"error": str(e)}), 500
+
+
+# Chunked uploads live next to each other in IMPORT_UPLOAD_DIR:
+# <id>.json holds the owner and declared size, <id>.part the bytes so far.
+# Clients resume by asking GET /import/uploads/<id> for the received offset.
+
+def upload_paths(upload_id):
+    if not re.fullmatch(r"[0-9a-f]{32}", upload_id or ""):
+        return None, None
+    base = os.path.join(IMPORT_UPLOAD_DIR, upload_id)
+    return f"{base}.json", f"{base}.part"
+
+
+def load_upload(upload_id, user):
+    """Return (meta, data_path) for an upload owned by the user's org, or (None, None)."""
+    meta_path, data_path = upload_paths(upload_id)
+    if not meta_path or not os.path.exists(meta_path):
+        return None, None
+    with open(meta_path, encoding="utf-8") as fh:
+        meta = json.load(fh)
+    if meta.get("orgID") != user.orgID:
+        return None, None
+    return meta, data_path
+
+
+def purge_stale_uploads():
+    cutoff = time.time() - IMPORT_UPLOAD_TTL_SECONDS
+    for name in os.listdir(IMPORT_UPLOAD_DIR):
+        path = os.path.join(IMPORT_UPLOAD_DIR, name)
+        if name.endswith((".json", ".part")) and os.path.getmtime(path) < cutoff:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+@app.route("/import/uploads", methods=["POST"])
+@jwt_required()
+def create_import_upload():
+    try:
+        user = current_identity()
+        if not user:
+            return jsonify({"error": "Unauthorized"}), 401
+        data = request.get_json(silent=True) or {}
+        kind = (data.get("kind") or "").strip().lower()
+        if kind not in IMPORTERS:
+            return jsonify({"error": f"kind must be one of {sorted(IMPORTERS)}"}), 400
+        size = data.get("size")
+        if size is not None and (not isinstance(size, int) or size < 0):
+            return jsonify({"error": "size must be a non-negative integer"}), 400
+        os.makedirs(IMPORT_UPLOAD_DIR, exist_ok=True)
+        purge_stale_uploads()
+        upload_id = uuid.uuid4().hex
+        meta_path, data_path = upload_paths(upload_id)
+        open(data_path, "wb").close()
+        with open(meta_path, "w", encoding="utf-8") as fh:
+            json.dump({"orgID": user.orgID, "userID": user.userID, "kind": kind, "size": size,
+                       "filename": data.get("filename")}, fh)
+        return jsonify({"uploadId": upload_id, "received": 0,
+                        "maxChunkBytes": IMPORT_UPLOAD_MAX_CHUNK_BYTES}), 201
+    except Exception as e:
+        app.logger.exception("/import/uploads failed")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/import/uploads/<upload_id>", methods=["GET", "PUT"])
+@jwt_required()
+def import_upload_chunk(upload_id):
+    """GET reports the received offset; PUT ?offset=N appends the raw request body."""
+    try:
+        user = current_identity()
+        if not user:
+            return jsonify({"error": "Unauthorized"}), 401
+        meta, data_path = load_upload(upload_id, user)
+        if not meta:
+            return jsonify({"error": "Upload not found"}), 404
+        received = os.path.getsize(data_path)
+        if request.method == "GET":
+            return jsonify({"uploadId": upload_id, "received": received, "size": meta.get("size")}), 200
+
+        offset = request.args.get("offset", type=int)
+        if offset != received:
+            return jsonify({"error": "Offset does not match received bytes", "received": received}), 409
+        if (request.content_length or 0) > IMPORT_UPLOAD_MAX_CHUNK_BYTES:
+            return jsonify({"error": f"Chunks are limited to {IMPORT_UPLOAD_MAX_CHUNK_BYTES} bytes"}), 413
+        with open(data_path, "ab") as fh:
+            shutil.copyfileobj(request.stream, fh, 1024 * 1024)
+            fh.flush()
+            os.fsync(fh.fileno())
+        return jsonify({"uploadId": upload_id, "received": os.path.getsize(data_path)}), 200
+    except Exception as e:
+        app.logger.exception("/import/uploads chunk failed")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/import/uploads/<upload_id>/complete", methods=["POST"])
+@jwt_required()
+def complete_import_upload(upload_id):
+    try:
+        user = current_identity()
+        if not user:
+            return jsonify({"error": "Unauthorized"}), 401
+        meta, data_path = load_upload(upload_id, user)
+        if not meta:
+            return jsonify({"error": "Upload not found"}), 404
+        received = os.path.getsize(data_path)
+        if meta.get("size") is not None and received != meta["size"]:
+            return jsonify({"error": "Upload is incomplete", "received": received,
+                            "size": meta["size"]}), 409
+        csv_path = os.path.join(IMPORT_UPLOAD_DIR, f"{upload_id}.csv")
+        os.rename(data_path, csv_path)
+        os.remove(upload_paths(upload_id)[0])
+        job = start_import_job(meta["kind"], user, csv_path)
+        return jsonify({"msg": "Import queued", "jobId": job.jobID,
+                        "statusUrl": f"/import/jobs/{job.jobID}"}), 202
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception("/import/uploads complete failed")
+        return jsonify({"error": str(e)}), 500
+
+
 # --- Audit Log Route ---
 
+def explain_query(statement):
+    """Run EXPLAIN for a SQLAlchemy statement and return the plan rows as dicts."""
+    bind = db.session.get_bind()
+    compiled = statement.compile(dialect=bind.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    result = db.session.connection().exec_driver_sql(f"EXPLAIN {compiled}", params)
+    return [dict(row) for row in result.mappings().all()]
+
+
+def encode_audit_cursor(log):
+    raw = json.dumps([log.timestamp.isoformat(), log.logID])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_audit_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, log_id = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return datetime.fromisoformat(ts), int(log_id)
+    except (ValueError, TypeError, json.JSONDecodeError) as exc:
+        raise ValueError("cursor is invalid") from exc
+
+
 @app.route("/audit-logs", methods=["GET"])
 @jwt_required()
 def get_audit_logs():
-    """Return paginated audit logs for the current org (admin only)."""
+    """
+    Return audit logs for the current org, newest first (admin only).
+
+    Pagination is keyset-based: pass the previous response's ``nextCursor``
+    as ``?cursor=`` to fetch the following page in constant time at any
+    depth. ``?page=`` (OFFSET) is still accepted when no cursor is given.
+    ``?count=exact|estimate|none`` picks how ``total`` is computed
+    (default: exact for page-based requests, none with a cursor).
+    ``?from=`` / ``?to=`` (YYYY-MM-DD, inclusive) bound the timestamp;
+    history older than AUDIT_RETENTION_DAYS lives in the archive files.
+    """
     try:
         user = get_current_user()
         if not user:
@@ -2015,10 +4180,21 @@ def get_audit_logs():
 
         page = request.args.get("page", 1, type=int)
         per_page = request.args.get("per_page", 50, type=int)
-        per_page = min(per_page, 200)
+        per_page = max(1, min(per_page, 200))
+        cursor = request.args.get("cursor", "").strip()
+
+        count_mode = request.args.get("count", "none" if cursor else "exact").strip()
+        if count_mode not in {"exact", "estimate", "none"}:
+            return jsonify({"error": "count must be exact, estimate or none"}), 400
 
         action_filter = request.args.get("action", "").strip()
         resource_filter = request.args.get("resource_type", "").strip()
+        try:
+            date_from = parse_date(request.args.get("from"), "from")
+            date_to = parse_date(request.args.get("to"), "to")
+            after = decode_audit_cursor(cursor) if cursor else None
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
 
         query = AuditLog.query.filter(AuditLog.orgID == user.orgID)
 
@@ -2026,11 +4202,32 @@ def get_audit_logs():
             query = query.filter(AuditLog.action == action_filter)
         if resource_filter:
             query = query.filter(AuditLog.resource_type == resource_filter)
+        query = audit_window(
+            query,
+            start=datetime.combine(date_from, datetime.min.time()) if date_from else None,
+            end=datetime.combine(date_to + timedelta(days=1), datetime.min.time()) if date_to else None,
+        )
 
-        query = query.order_by(AuditLog.timestamp.desc())
+        total = None
+        if count_mode == "exact":
+            total = query.order_by(None).count()
+        elif count_mode == "estimate":
+            plan = explain_query(query.order_by(None).with_entities(AuditLog.logID).statement)
+            total = int(plan[0].get("rows") or 0) if plan else 0
+
+        if after:
+            after_ts, after_id = after
+            query = query.filter(or_(
+                AuditLog.timestamp < after_ts,
+                and_(AuditLog.timestamp == after_ts, AuditLog.logID < after_id),
+            ))
+        query = query.order_by(AuditLog.timestamp.desc(), AuditLog.logID.desc())
+        if not after and page > 1:
+            query = query.offset((page - 1) * per_page)
 
-        total = query.count()
-        logs = query.offset((page - 1) * per_page).limit(per_page).all()
+        logs = query.limit(per_page + 1).all()
+        has_more = len(logs) > per_page
+        logs = logs[:per_page]
 
         # Look up user emails for display
         user_ids = {log.userID for log in logs if log.userID}
@@ -2055,8 +4252,11 @@ def get_audit_logs():
                 for log in logs
             ],
             "total": total,
-            "page": page,
+            "totalMode": count_mode,
+            "page": None if after else page,
             "per_page": per_page,
+            "hasMore": has_more,
+            "nextCursor": encode_audit_cursor(logs[-1]) if has_more and logs else None,
         }), 200
     except Exception as e:
         app.logger.exception("/audit-logs failed")
@@ -2065,30 +4265,9 @@ def get_audit_logs():
 
 # --- Gemini Agentic Chatbot Route ---
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from sqlalchemy import text as sql_text
 
-# Dangerous SQL patterns that should never be allowed
-BLOCKED_SQL_PATTERNS = [
-    r"\bDROP\s+DATABASE\b",
-    r"\bDROP\s+TABLE\s+(?!dish_ing|dishes|ing|orgs|users)",  # only allow known tables
-    r"\bTRUNCATE\b",
-    r"\bALTER\s+TABLE\b",
-    r"\bCREATE\s+TABLE\b",
-    r"\bGRANT\b",
-    r"\bREVOKE\b",
-    r"\bSHOW\s+VARIABLES\b",
-    r"\bLOAD\s+DATA\b",
-    r"\bINTO\s+OUTFILE\b",
-    r"\bINTO\s+DUMPFILE\b",
-]
-
-WRITE_SQL_PATTERNS = [
-    r"\bINSERT\b",
-    r"\bUPDATE\b",
-    r"\bDELETE\b",
-    r"\bREPLACE\b",
-]
-
 DB_SCHEMA_DESCRIPTION = """
 Database schema (MySQL):
 
@@ -2110,26 +4289,38 @@ TABLE dishes:
   - dishID INT PRIMARY KEY AUTO_INCREMENT
   - dishName VARCHAR(100) NOT NULL
   - orgID INT FK -> orgs.orgID
-  Note: Dishes with dishName='__STOCK__' are internal system records for stock tracking.
-        Never show __STOCK__ dishes to users; filter them out in queries.
 
 TABLE ing (ingredients):
   - ingID INT PRIMARY KEY AUTO_INCREMENT
   - ingName VARCHAR(100) NOT NULL
   - category VARCHAR(50)        -- e.g. Produce, Dairy, Meat, Dry Goods, Spices
-  - expiry DATE                 -- NULL for master ingredient types; set for stock batches
-  - batchNum VARCHAR(50)        -- NULL for master ingredient types; set for stock batches
+  - expiry DATE, batchNum VARCHAR(50)  -- legacy, always NULL; batches live in stock_batches
   - orgID INT FK -> orgs.orgID
-  Note: Rows with expiry=NULL AND batchNum=NULL are "master ingredient types" (templates).
-        Rows with expiry OR batchNum set are stock batches (physical inventory).
+  - is_batch TINYINT(1)         -- legacy generated column, always 0
+  Note: Every row is a "master ingredient type" (catalog entry / template).
 
-TABLE dish_ing (recipe links & stock quantities):
+TABLE stock_batches (physical inventory):
+  - batchID INT PRIMARY KEY AUTO_INCREMENT
+  - orgID INT FK -> orgs.orgID
+  - masterIngID INT FK -> ing.ingID   -- the ingredient type this batch is of
+  - qty DECIMAL(12,3)           -- quantity remaining
+  - unit VARCHAR(20)
+  - expiry DATE (nullable), batchNum VARCHAR(50) (nullable)
+  - received_at DATETIME
+  Note: Indexed on (orgID, expiry) and (orgID, masterIngID, expiry). Join ing on
+        ing.ingID = stock_batches.masterIngID for the ingredient name and category.
+
+TABLE stock_on_hand (running stock totals, maintained with every batch change):
+  - orgID INT, masterIngID INT FK -> ing.ingID, unit VARCHAR(20)   -- primary key
+  - qty DECIMAL(14,3)           -- total qty across the ingredient's batches in this unit
+  - batchCount INT
+  Note: One row per ingredient type and unit; the fastest way to answer "how much X do we have".
+
+TABLE dish_ing (recipe links):
   - dishID INT FK -> dishes.dishID (PK part 1)
   - ingID INT FK -> ing.ingID (PK part 2)
   - qty DECIMAL(10,2)
   - unit VARCHAR(20)
-  Note: Links ingredients to dishes (recipes). Also used with the __STOCK__ dish to track
-        batch quantities. To get stock qty for a batch, join dish_ing where dishID = __STOCK__ dish.
 
 TABLE audit_logs:
   - logID INT PRIMARY KEY AUTO_INCREMENT
@@ -2144,6 +4335,36 @@ TABLE audit_logs:
   Note: Immutable audit trail of every action. ORDER actions contain PO numbers in details JSON.
         CONSUME actions contain dish name and quantity in details JSON.
 
+TABLE consumption_ledger (per-ingredient stock deductions):
+  - entryID INT PRIMARY KEY AUTO_INCREMENT
+  - orgID INT FK -> orgs.orgID
+  - logID INT (nullable)          -- CONSUME audit_logs row that produced this deduction
+  - dishID INT (nullable)         -- dish that was cooked
+  - batchIngID INT (nullable)     -- stock batch (stock_batches.batchID) that was drawn down
+  - ingName VARCHAR(100), category VARCHAR(50), unit VARCHAR(20)
+  - qty DECIMAL(12,3)
+  - day DATE                      -- UTC day of the consumption
+  - timestamp DATETIME
+
+TABLE consumption_daily (daily rollup of consumption_ledger):
+  - orgID INT, day DATE, ingName VARCHAR(100), category VARCHAR(50), unit VARCHAR(20)
+  - qty DECIMAL(14,3)             -- total consumed that day
+  Note: Prefer this table for consumption trends and usage rates (e.g. SUM(qty) over the
+        last 7 or 30 days GROUP BY ingName, unit) instead of parsing audit_logs JSON.
+
+VIEW v_current_stock (current stock per ingredient; prefer this over summing stock_batches by hand):
+  - orgID INT, ingName VARCHAR(100), category VARCHAR(50), unit VARCHAR(20)
+  - totalQty DECIMAL      -- sum of remaining qty across batches with qty > 0
+  - batchCount INT, nextExpiry DATE
+
+VIEW v_consumption_recent (usage per ingredient over the last 30 days):
+  - orgID INT, ingName VARCHAR(100), category VARCHAR(50), unit VARCHAR(20)
+  - last7DaysQty DECIMAL, last30DaysQty DECIMAL, avgDailyQty30 DECIMAL
+
+VIEW v_open_orders (purchase orders not yet due for delivery):
+  - logID INT, orgID INT, userID INT, placedAt DATETIME
+  - poNumber VARCHAR, totalCost DECIMAL(12,2), itemCount INT, estimatedDelivery DATE
+
 TABLE org_settings:
   - id INT PRIMARY KEY AUTO_INCREMENT
   - orgID INT FK -> orgs.orgID (UNIQUE)
@@ -2152,6 +4373,7 @@ TABLE org_settings:
 """
 
 
+@functools.lru_cache(maxsize=1024)
 def build_system_prompt(org_name, org_email, user_email, user_role, org_id):
     return f"""You are **StockSense AI**, the intelligent assistant for the StockSense inventory management platform.
 
@@ -2174,29 +4396,31 @@ StockSense is a restaurant / food-service inventory management system that helps
 2. **Run SQL queries** against the database to look up information. Use the `run_sql_query` function.
 3. **Modify data** when the user explicitly asks you to add, update, or delete records. Use the `run_sql_write` function.
 4. **Provide insights** — e.g. expiring ingredients, low stock alerts, recipe cost estimates, usage patterns, waste analysis.
-5. **Analyze consumption trends** — query audit_logs WHERE action='CONSUME' to see what dishes were cooked, how often, and which ingredients are being used fastest.
+5. **Analyze consumption trends** — query consumption_daily for per-ingredient usage, and audit_logs WHERE action='CONSUME' to see what dishes were cooked and how often.
 6. **Analyze procurement history** — query audit_logs WHERE action='ORDER' to see past purchase orders, PO numbers, vendors, and costs.
 7. **Calculate stockout risk** — compare current stock quantities against average daily usage to estimate days remaining.
 8. **Track waste** — identify expired batches (expiry < CURDATE()) and their quantities.
 
 ## Stock & Batch System
-- Master ingredient types have expiry=NULL AND batchNum=NULL. They are templates.
-- Stock batches have expiry or batchNum set. They represent physical inventory.
-- To get the **quantity** of a stock batch, join the `dish_ing` table where dishID = the `__STOCK__` dish for this org.
-  Example: SELECT i.ingName, di.qty, di.unit FROM ing i JOIN dish_ing di ON di.ingID = i.ingID JOIN dishes d ON d.dishID = di.dishID WHERE d.dishName = '__STOCK__' AND d.orgID = {org_id} AND i.orgID = {org_id}
-- To get **total stock** per ingredient: GROUP BY i.ingName and SUM(di.qty).
+- Rows in `ing` are master ingredient types (templates). Physical inventory lives in `stock_batches`, one row per batch with its qty, unit, expiry and batchNum.
+- To list batches with their ingredient names, join `ing` on the master:
+  Example: SELECT i.ingName, b.qty, b.unit, b.expiry FROM stock_batches b JOIN ing i ON i.ingID = b.masterIngID WHERE b.orgID = {org_id} AND i.orgID = {org_id}
+- To get **total stock** per ingredient read `stock_on_hand` (join ing on ing.ingID = masterIngID); use the `v_current_stock` view when you also need batch counts or the next expiry.
+- For usage rates use `v_consumption_recent`; for purchase orders still awaiting delivery use `v_open_orders`. Always filter views by orgID = {org_id} too.
 - Batches with batchNum starting with 'PO-' were created by the procurement/order system.
 
 ## Audit Log System
 - The audit_logs table records every user action with timestamps.
 - Actions: CREATE, UPDATE, DELETE, LOGIN, LOGIN_FAILED, EXPORT, IMPORT, CONSUME, CHAT, ORDER
-- CONSUME details JSON contains: dishName, quantity, deductions (list of ingredients affected)
+- CONSUME details JSON contains: dishName, quantity, deductions_count; bulk POS consumes instead contain lines (list of {{dishName, quantity}})
 - ORDER details JSON contains: poNumber, orderItems (ingredient, vendor, qty, unit, cost), totalCost, estimatedDelivery
 - Use audit_logs to answer questions about "what happened", "who did what", "when was X changed", etc.
 
 ## Rules
 - ALWAYS filter queries by orgID = {org_id} so you never leak data from other organizations.
-- ALWAYS filter out __STOCK__ dishes when listing dishes for users (WHERE dishName != '__STOCK__').
+- Every table in a query (each join, subquery and UNION branch) needs its own `alias.orgID = {org_id}` condition joined with AND; dish_ing has no orgID, so join it to a filtered dishes or ing row (`di.dishID = d.dishID`). Queries that break this are rejected with the reason — fix and retry.
+- Add rows to dish_ing with INSERT ... SELECT from dishes and ing filtered by orgID, not INSERT ... VALUES; add stock_batches rows with INSERT ... SELECT taking masterIngID from ing.ingID filtered by orgID. masterIngID cannot be changed by UPDATE.
+- Prefer aggregates (COUNT, SUM, GROUP BY) over listing raw rows. Results over {CHAT_SQL_MAX_ROWS} rows are truncated and come back with a per-column `summary`; queries that would scan large tables without a selective filter are rejected, so add a WHERE clause and retry.
 - NEVER select, return, or expose the `hashed_pwd` column from the users table.
 - NEVER run DROP DATABASE, TRUNCATE, ALTER TABLE, or other destructive DDL.
 - When modifying data, confirm what you're about to do before executing, unless the user's intent is very clear.
@@ -2205,66 +4429,923 @@ StockSense is a restaurant / food-service inventory management system that helps
 - If a query returns no results, say so clearly.
 - When showing tabular data, use markdown tables.
 - You can run multiple queries in sequence to answer complex questions — do so proactively.
-- When asked about stock levels, always join through the __STOCK__ dish to get quantities.
+- When asked about stock levels, read totals from stock_on_hand and per-batch quantities from stock_batches.
 
 {DB_SCHEMA_DESCRIPTION}
 """
 
 
+# Read-only reporting views over indexed tables, created by
+# ensure_reporting_views() (and database/views.sql). Each maps to the base
+# tables whose writes invalidate cached results that read it.
+REPORTING_VIEWS = {
+    "v_current_stock": ({"stock_batches", "ing"}, """
+        SELECT b.orgID, i.ingName, i.category, b.unit,
+               SUM(b.qty) AS totalQty,
+               COUNT(*) AS batchCount,
+               MIN(b.expiry) AS nextExpiry
+        FROM stock_batches b
+        JOIN ing i ON i.ingID = b.masterIngID AND i.orgID = b.orgID
+        WHERE b.qty > 0
+        GROUP BY b.orgID, i.ingName, i.category, b.unit
+    """),
+    "v_consumption_recent": ({"consumption_daily"}, """
+        SELECT orgID, ingName, category, unit,
+               SUM(CASE WHEN day >= CURDATE() - INTERVAL 7 DAY THEN qty ELSE 0 END) AS last7DaysQty,
+               SUM(qty) AS last30DaysQty,
+               ROUND(SUM(qty) / 30, 3) AS avgDailyQty30
+        FROM consumption_daily
+        WHERE day >= CURDATE() - INTERVAL 30 DAY
+        GROUP BY orgID, ingName, category, unit
+    """),
+    "v_open_orders": ({"audit_logs"}, """
+        SELECT logID, orgID, userID, timestamp AS placedAt,
+               JSON_UNQUOTE(JSON_EXTRACT(details, '$.poNumber')) AS poNumber,
+               CAST(JSON_EXTRACT(details, '$.totalCost') AS DECIMAL(12,2)) AS totalCost,
+               JSON_LENGTH(details, '$.orderItems') AS itemCount,
+               CAST(JSON_UNQUOTE(JSON_EXTRACT(details, '$.estimatedDelivery')) AS DATE) AS estimatedDelivery
+        FROM audit_logs
+        WHERE action = 'ORDER'
+          AND CAST(JSON_UNQUOTE(JSON_EXTRACT(details, '$.estimatedDelivery')) AS DATE) >= CURDATE()
+    """),
+}
+
+
+def ensure_reporting_views():
+    for name, (_, definition) in REPORTING_VIEWS.items():
+        db.session.execute(sql_text(f"CREATE OR REPLACE VIEW {name} AS {definition}"))
+    db.session.commit()
+
+
+_SQL_QUOTED_RE = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*"|`[^`]*`)""")
+
+
+def normalize_sql(query_str):
+    """Lower-case and collapse whitespace outside quoted literals; drop trailing semicolons."""
+    parts = _SQL_QUOTED_RE.split(query_str.strip().rstrip(";").strip())
+    return "".join(
+        part if i % 2 else " ".join(part.split()).lower()
+        for i, part in enumerate(parts)
+    )
+
+
+# --- SQL Validation ---
+# Chat tool SQL is tokenized once and walked with a small state machine
+# rather than pattern-matched. The walk classifies the statement, resolves
+# every table reference and alias, and only accepts the query if each table
+# is pinned to the caller's org by an AND-connected `alias.orgID = <org>`
+# condition (dish_ing through an equi-join to a pinned dishes/ing row).
+# Literals come back as bound parameters so equivalent questions share one
+# statement text.
+
+class SqlRejected(Exception):
+    """Raised when a chat tool query is unsafe or outside what the validator understands."""
+
+
+SqlToken = namedtuple("SqlToken", ["kind", "value"])
+SqlAnalysis = namedtuple("SqlAnalysis", ["kind", "sql", "params", "tables", "bounded_sql"])
+
+_SQL_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--(?=\s|$)[^\n]*|\#[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<ident>`(?:[^`]|``)+`)
+  | (?P<number>0[xX][0-9a-fA-F]+|0[bB][01]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_$][\w$]*)
+  | (?P<variable>@@?[\w$.]*|\?|:\w+)
+  | (?P<op><=>|<=|>=|<>|!=|:=|\|\||&&|->>|->|[-+*/%=<>(),.;!~^&|])
+""", re.VERBOSE | re.DOTALL)
+
+# Tables the chat tools may reference. Org tables carry their own orgID;
+# child tables are scoped through the listed parent columns.
+CHAT_SQL_ORG_TABLES = frozenset({
+    "orgs", "users", "dishes", "ing", "stock_batches", "stock_on_hand", "audit_logs",
+    "consumption_ledger", "consumption_daily", "org_settings",
+}) | frozenset(REPORTING_VIEWS)
+CHAT_SQL_CHILD_TABLES = {"dish_ing": {"dishid": "dishes", "ingid": "ing"}}
+# Org-table columns that point at another org-scoped row: writes may only
+# take them (as column <- parent.column) from a parent filtered by orgID.
+CHAT_SQL_ORG_REFERENCES = {"stock_batches": {"masteringid": ("ing", "ingid")}}
+_CHAT_SQL_REFERENCE_COLUMNS = frozenset(
+    column for columns in CHAT_SQL_ORG_REFERENCES.values() for column in columns
+)
+CHAT_SQL_READ_ONLY_TABLES = frozenset({
+    "audit_logs", "consumption_ledger", "consumption_daily", "stock_on_hand",
+}) | frozenset(REPORTING_VIEWS)
+CHAT_SQL_HIDDEN_COLUMNS = frozenset({"hashed_pwd"})
+
+_SQL_FORBIDDEN_FUNCTIONS = frozenset({
+    "SLEEP", "BENCHMARK", "LOAD_FILE", "GET_LOCK", "RELEASE_LOCK", "RELEASE_ALL_LOCKS",
+    "IS_FREE_LOCK", "IS_USED_LOCK", "MASTER_POS_WAIT", "SOURCE_POS_WAIT",
+})
+_SQL_JOIN_MODIFIERS = frozenset({"INNER", "LEFT", "RIGHT", "OUTER", "CROSS", "NATURAL"})
+_SQL_RESERVED = frozenset({
+    "AS", "ON", "USING", "WHERE", "GROUP", "ORDER", "BY", "LIMIT", "OFFSET", "HAVING", "WINDOW",
+    "JOIN", "STRAIGHT_JOIN", "UNION", "INTERSECT", "EXCEPT", "FOR", "LOCK", "SET", "VALUES", "VALUE",
+    "SELECT", "FROM", "INTO", "AND", "OR", "XOR", "NOT", "IN", "IS", "LIKE", "BETWEEN", "EXISTS",
+    "USE", "FORCE", "IGNORE", "INDEX", "KEY", "PARTITION", "LATERAL", "WITH",
+    "LOW_PRIORITY", "HIGH_PRIORITY", "QUICK", "DELAYED", "CASE", "WHEN", "THEN", "ELSE", "END",
+}) | _SQL_JOIN_MODIFIERS
+_SQL_TABLE_PREFIXES = frozenset({"LOW_PRIORITY", "HIGH_PRIORITY", "QUICK", "IGNORE", "DELAYED", "LATERAL"})
+_SQL_PREDICATE_START = frozenset({"WHERE", "ON", "AND", "(", "&&"})
+_SQL_PREDICATE_END = frozenset({
+    "AND", "OR", "XOR", "GROUP", "ORDER", "LIMIT", "HAVING", "WINDOW", "UNION", "INTERSECT", "EXCEPT",
+    "JOIN", "STRAIGHT_JOIN", "WHERE", ")", "&&", "||",
+}) | _SQL_JOIN_MODIFIERS
+_SQL_CLAUSES = {
+    "WHERE": "where", "ON": "on", "HAVING": "having", "GROUP": "group", "ORDER": "order",
+    "LIMIT": "limit", "OFFSET": "limit", "WINDOW": "other", "USING": "other", "SET": "set",
+    "VALUES": "values", "VALUE": "values",
+}
+# Literals that stay inline: LIMIT/ORDER BY/GROUP BY positions, type
+# arguments such as DECIMAL(12,2), JSON paths, and typed or
+# charset-introduced strings.
+_SQL_INLINE_CLAUSES = frozenset({"limit", "order", "group"})
+_SQL_TYPE_WORDS = frozenset({
+    "DECIMAL", "NUMERIC", "CHAR", "VARCHAR", "BINARY", "VARBINARY", "FLOAT", "DOUBLE",
+    "DATETIME", "TIME", "TIMESTAMP", "INT", "INTEGER",
+})
+_SQL_INLINE_AFTER = frozenset({"DATE", "TIME", "TIMESTAMP", "X", "B", "N", "->", "->>"})
+_SQL_STRING_ESCAPES = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a", "%": "\\%", "_": "\\_"}
+
+
+def tokenize_sql(query_str):
+    """Split SQL into tokens, dropping whitespace and plain comments."""
+    tokens = []
+    pos, end = 0, len(query_str)
+    while pos < end:
+        match = _SQL_TOKEN_RE.match(query_str, pos)
+        if not match:
+            raise SqlRejected(f"Could not parse SQL near {query_str[pos:pos + 20]!r}.")
+        pos = match.end()
+        kind, value = match.lastgroup, match.group()
+        if kind == "space":
+            continue
+        if kind == "comment":
+            if value.startswith(("/*!", "/*+")):
+                raise SqlRejected("Executable comments and optimizer hints are not allowed.")
+            continue
+        if kind == "variable":
+            raise SqlRejected("Variables and placeholders are not allowed.")
+        tokens.append(SqlToken(kind, value))
+    return tokens
+
+
+def _sql_literal_value(token):
+    if token.kind == "string":
+        quote, body = token.value[0], token.value[1:-1]
+        out, i = [], 0
+        while i < len(body):
+            if body[i] == "\\" and i + 1 < len(body):
+                out.append(_SQL_STRING_ESCAPES.get(body[i + 1], body[i + 1]))
+                i += 2
+            elif body[i] == quote and body[i + 1:i + 2] == quote:
+                out.append(quote)
+                i += 2
+            else:
+                out.append(body[i])
+                i += 1
+        return "".join(out)
+    if token.value[:2].lower() in ("0x", "0b"):
+        return int(token.value, 0)
+    if any(c in token.value for c in ".eE"):
+        return Decimal(token.value)
+    return int(token.value)
+
+
+class _SqlRef:
+    """One table reference in FROM/JOIN/UPDATE/INSERT INTO."""
+    __slots__ = ("table", "alias", "top_level")
+
+    def __init__(self, table, top_level):
+        self.table, self.alias, self.top_level = table, table, top_level
+
+
+class _SqlFrame:
+    """One parenthesis level: a query block (statement or subquery) or a plain group."""
+
+    def __init__(self, kind, parent, start, cond=False, role=None):
+        self.kind, self.parent, self.start, self.role = kind, parent, start, role
+        self.cond = cond            # group that is itself an AND-operand of a condition
+        self.conds = []             # equality predicates seen at this level
+        self.has_or = False
+        self.between = False
+        self.commas = []
+        # query blocks only
+        self.clause = None
+        self.from_state = None
+        self.last_ref = None
+        self.refs = []
+        self.aliases = {}
+        self.join_kind = None
+        self.join_ref = None
+        self.joining = False
+        self.select_start = self.select_end = None
+
+    def in_condition(self):
+        return self.clause in ("where", "on") if self.kind == "query" else self.cond
+
+
+class _SqlAnalyzer:
+    """Single pass over the tokens of one statement; see the section comment."""
+
+    def __init__(self, tokens, org_id):
+        self.tokens = tokens
+        self.org = None if org_id is None else str(org_id)
+        self.refs = []
+        self.pinned = set()          # ids of refs with an accepted orgID predicate
+        self.links = []              # accepted (child, column, parent, column) equi-joins
+        self.ctes = set()
+        self.between_ands = set()
+        self.kind = self.verb = None
+        self.insert_target = None
+        self.insert_columns = []
+        self.insert_rows = []
+        self.insert_org_assigned = False
+        self.top = None
+        self.top_select = None       # token index of the outer query block's SELECT
+        self.top_limit = False       # the statement itself (not a subquery) has a LIMIT
+
+    def tok(self, i):
+        return self.tokens[i] if 0 <= i < len(self.tokens) else None
+
+    def upper(self, i):
+        token = self.tok(i)
+        if token is None:
+            return None
+        return token.value.upper() if token.kind == "word" else token.value
+
+    @staticmethod
+    def name(token):
+        return token.value.strip("`").replace("``", "`").lower()
+
+    @staticmethod
+    def function_name(token):
+        """Upper-cased name a token would call if followed by "(", quoted or not."""
+        if token.kind == "word":
+            return token.value.upper()
+        if token.kind == "ident" or (token.kind == "string" and token.value[0] == '"'):
+            return token.value[1:-1].replace(token.value[0] * 2, token.value[0]).upper()
+        return None
+
+    def is_org_literal(self, tokens):
+        return (self.org is not None and len(tokens) == 1 and tokens[0].kind in ("number", "string")
+                and str(_sql_literal_value(tokens[0])) == self.org)
+
+    # -- walk ----------------------------------------------------------
+    def run(self):
+        if self.tokens and self.tokens[-1].value == ";":
+            self.tokens.pop()
+        if not self.tokens:
+            raise SqlRejected("Empty query.")
+        if any(t.value == ";" for t in self.tokens):
+            raise SqlRejected("Only one statement per query is allowed.")
+        self.classify()
+        self.top = frame = _SqlFrame("query", None, 0)
+        for i, token in enumerate(self.tokens):
+            value = self.upper(i)
+            if token.kind in ("word", "ident") and self.name(token) in CHAT_SQL_HIDDEN_COLUMNS:
+                raise SqlRejected(f"{self.name(token)} cannot be queried.")
+            if self.upper(i + 1) == "(" and self.function_name(token) in _SQL_FORBIDDEN_FUNCTIONS:
+                raise SqlRejected(f"{self.function_name(token)}() is not allowed.")
+            if token.kind == "word":
+                self.on_word(frame, i, value)
+            elif token.kind == "ident" and frame.kind == "query":
+                self.on_name(frame, i)
+            elif value == "(":
+                frame = self.open_paren(frame, i)
+            elif value == ")":
+                if frame.parent is None:
+                    raise SqlRejected("Unbalanced parentheses.")
+                frame = self.close_paren(frame, i)
+            elif value == ",":
+                frame.commas.append(i)
+                if frame.kind == "query" and frame.clause == "from":
+                    frame.from_state, frame.join_kind = "expect_table", None
+            elif value == "=":
+                self.on_equals(frame, i)
+            elif value == "||" and frame.in_condition():
+                frame.has_or = True
+        if frame is not self.top:
+            raise SqlRejected("Unbalanced parentheses.")
+        self.set_clause(frame, len(self.tokens), None)
+        self.check_constraints()
+
+    def classify(self):
+        i = 0
+        while self.upper(i) == "(":
+            i += 1
+        verb = self.upper(i)
+        if verb == "WITH":
+            depth = 0
+            for j in range(i + 1, len(self.tokens)):
+                value = self.upper(j)
+                depth += (value == "(") - (value == ")")
+                if depth == 0 and value in ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE"):
+                    verb = value
+                    break
+        if verb == "REPLACE":
+            raise SqlRejected("REPLACE is not allowed; use INSERT or UPDATE.")
+        if verb not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            raise SqlRejected("Only SELECT, INSERT, UPDATE and DELETE statements are allowed.")
+        self.verb = verb
+        self.kind = "read" if verb == "SELECT" else "write"
+
+    def set_clause(self, frame, i, clause):
+        if frame.clause in ("where", "on"):
+            if not frame.has_or:
+                self.accept(frame, frame.conds)
+            frame.conds, frame.has_or, frame.between = [], False, False
+        if frame.clause == "select" and frame.select_end is None:
+            frame.select_end = i
+        frame.clause = clause
+
+    def accept(self, frame, conds):
+        # An outer join's ON clause only restricts the table being joined in,
+        # and a WHERE/ON only restricts the tables of its own query block: a
+        # correlated subquery naming an outer alias can link to it, but its
+        # result (think NOT EXISTS, or EXISTS (...) OR 1=1) never pins it.
+        outer = frame.clause == "on" and frame.join_kind == "LEFT"
+        local = {id(ref) for ref in frame.refs}
+        for cond in conds:
+            if cond[0] == "org":
+                if id(cond[1]) in local and (not outer or cond[1] is frame.join_ref):
+                    self.pinned.add(id(cond[1]))
+                continue
+            _, a, col_a, b, col_b = cond
+            if id(a) in local and (not outer or a is frame.join_ref):
+                self.links.append((a, col_a, b, col_b))
+            if id(b) in local and (not outer or b is frame.join_ref):
+                self.links.append((b, col_b, a, col_a))
+
+    def on_word(self, frame, i, value):
+        nxt = self.upper(i + 1)
+        # TABLE t, VALUES ROW(...) and ROW(...) produce rows without a
+        # FROM/WHERE to pin, so they are only allowed as INSERT ... VALUES rows.
+        if value == "TABLE":
+            raise SqlRejected("TABLE is not allowed; use SELECT ... WHERE orgID = ....")
+        if value == "VALUES" and not (frame is self.top and frame.clause == "insert"):
+            raise SqlRejected("VALUES is only allowed in INSERT ... VALUES.")
+        if (value == "ROW" and self.upper(i - 1) != "CURRENT"
+                and not (frame is self.top and frame.clause == "values")):
+            raise SqlRejected("ROW(...) is only allowed in INSERT ... VALUES.")
+        if value == "INTO" and not (self.verb == "INSERT" and frame is self.top and frame.clause == "insert"):
+            raise SqlRejected("SELECT ... INTO is not allowed.")
+        if (value == "FOR" and nxt in ("UPDATE", "SHARE")) or (value == "LOCK" and nxt == "IN"):
+            raise SqlRejected("Locking reads are not allowed.")
+        if value == "DUPLICATE":
+            raise SqlRejected("ON DUPLICATE KEY UPDATE is not allowed.")
+        if frame is self.top:
+            if value == "SELECT" and self.top_select is None:
+                self.top_select = i
+            elif value == "LIMIT":
+                self.top_limit = True
+        if value == "USING" and self.verb == "DELETE" and frame is self.top:
+            raise SqlRejected("DELETE ... USING is not supported; use DELETE alias FROM ... JOIN.")
+        if value in ("OR", "XOR"):
+            if frame.in_condition():
+                frame.has_or = True
+            return
+        if value == "BETWEEN":
+            frame.between = True
+            return
+        if value == "AND" and frame.between:
+            self.between_ands.add(i)
+            frame.between = False
+            return
+        if frame.kind != "query":
+            return
+
+        clause = frame.clause
+        if value == "WITH" and clause is None:
+            frame.clause = "with"
+        elif clause == "with" and value not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            if value not in ("AS", "RECURSIVE"):
+                self.ctes.add(self.name(self.tokens[i]))
+        elif value == "SELECT":
+            self.set_clause(frame, i, "select")
+            if frame.select_start is None:
+                frame.select_start = i + 1
+        elif value in ("UNION", "INTERSECT", "EXCEPT"):
+            if self.verb != "SELECT":
+                raise SqlRejected(f"{value} is only allowed in SELECT statements.")
+            self.set_clause(frame, i, None)
+            frame.aliases, frame.refs, frame.last_ref, frame.join_kind = {}, [], None, None
+        elif value == "UPDATE" and clause in (None, "with"):
+            frame.clause, frame.from_state = "from", "expect_table"
+        elif value == "DELETE" and clause in (None, "with"):
+            frame.clause = "delete"
+        elif value == "INSERT" and clause in (None, "with"):
+            frame.clause = "insert"
+        elif clause == "insert":
+            if value == "INTO":
+                frame.from_state = "expect_table"
+            elif value in ("VALUES", "VALUE", "SET"):
+                frame.clause = _SQL_CLAUSES[value]
+            elif frame.from_state == "expect_table":
+                self.on_name(frame, i)
+            elif value not in _SQL_TABLE_PREFIXES:
+                raise SqlRejected(f"Unexpected {value} in INSERT.")
+        elif value == "FROM":
+            self.set_clause(frame, i, "from")
+            frame.from_state, frame.join_kind = "expect_table", None
+        elif value in ("JOIN", "STRAIGHT_JOIN") and clause in ("from", "on", "other"):
+            kind = frame.join_kind if clause == "from" and frame.from_state == "join" else None
+            self.set_clause(frame, i, "from")
+            frame.from_state, frame.join_kind, frame.joining = "expect_table", kind, True
+        elif value in _SQL_JOIN_MODIFIERS and clause in ("from", "on", "other"):
+            if value == "RIGHT":
+                raise SqlRejected("RIGHT JOIN is not supported; use LEFT JOIN.")
+            pending = value if value == "LEFT" else (frame.join_kind if frame.from_state == "join" else None)
+            self.set_clause(frame, i, "from")
+            frame.from_state, frame.join_kind = "join", pending
+        elif value in _SQL_CLAUSES and (value != "SET" or clause == "from"):
+            if value == "ON" and not (clause == "from" and frame.from_state in ("after_table", "aliased")):
+                raise SqlRejected("Unexpected ON.")
+            self.set_clause(frame, i, _SQL_CLAUSES[value])
+        elif clause == "from":
+            self.on_name(frame, i)
+
+    def on_name(self, frame, i):
+        """A word or quoted identifier inside FROM/JOIN/UPDATE or an INSERT target."""
+        if frame.clause not in ("from", "insert"):
+            return
+        token = self.tokens[i]
+        value = self.upper(i)
+        state = frame.from_state
+        if state == "expect_table":
+            if token.kind == "word" and value in _SQL_TABLE_PREFIXES:
+                return
+            if self.upper(i + 1) == ".":
+                raise SqlRejected("Database-qualified table names are not allowed.")
+            if self.upper(i + 1) == "(" and frame.clause == "from":
+                # Table functions (JSON_TABLE) only read the columns they are given.
+                self.add_ref(frame, None)
+                return
+            name = self.name(token)
+            if name in self.ctes and frame.clause == "from":
+                ref = None
+            elif name in CHAT_SQL_ORG_TABLES or name in CHAT_SQL_CHILD_TABLES:
+                ref = _SqlRef(name, frame is self.top)
+                self.refs.append(ref)
+                frame.refs.append(ref)
+                frame.aliases[name] = ref
+            else:
+                raise SqlRejected(f"Unknown table: {name}.")
+            self.add_ref(frame, ref)
+            if frame.clause == "insert":
+                self.insert_target = ref
+        elif state in ("after_table", "alias") and frame.clause == "from":
+            if value == "AS" and token.kind == "word":
+                frame.from_state = "alias"
+                return
+            if token.kind == "word" and value in _SQL_RESERVED:
+                return
+            alias = self.name(token)
+            ref = frame.last_ref
+            if ref is not None:
+                if frame.aliases.get(ref.table) is ref:
+                    del frame.aliases[ref.table]
+                ref.alias = alias
+            frame.aliases[alias] = ref
+            frame.from_state = "aliased"
+
+    def add_ref(self, frame, ref):
+        frame.last_ref, frame.from_state = ref, "after_table"
+        if frame.joining:
+            frame.join_ref, frame.joining = ref, False
+
+    def open_paren(self, frame, i):
+        if frame is self.top and frame.clause == "values" and (
+                self.upper(i - 1) not in ("VALUES", "VALUE", ",", "ROW") or self.upper(i + 1) in ("SELECT", "WITH")):
+            raise SqlRejected("INSERT ... VALUES rows must be literal tuples.")
+        if self.upper(i + 1) in ("SELECT", "WITH"):
+            role = None
+            if frame.kind == "query" and frame.clause == "from":
+                if frame.from_state != "expect_table":
+                    raise SqlRejected("Unsupported FROM clause.")
+                role = "derived"
+            return _SqlFrame("query", frame, i + 1, role=role)
+        role = None
+        if frame.kind == "query":
+            if frame.clause == "from" and frame.from_state == "expect_table":
+                raise SqlRejected("Parenthesized joins are not supported.")
+            if frame.clause == "insert" and frame.from_state == "after_table":
+                role = "columns"
+            elif frame is self.top and frame.clause == "values":
+                role = "row"
+        before = self.upper(i - 1)
+        cond = (frame.in_condition() and before in _SQL_PREDICATE_START
+                and i - 1 not in self.between_ands)
+        return _SqlFrame("group", frame, i + 1, cond=cond, role=role)
+
+    def close_paren(self, frame, i):
+        parent = frame.parent
+        if frame.kind == "query":
+            self.set_clause(frame, i, None)
+            if frame.role == "derived":
+                self.add_ref(parent, None)
+            return parent
+        after = self.upper(i + 1)
+        if frame.cond and not frame.has_or and (after is None or after in _SQL_PREDICATE_END):
+            parent.conds.extend(frame.conds)
+        if frame.role == "columns":
+            self.insert_columns = [self.name(t) for t in self.tokens[frame.start:i] if t.value != ","]
+        elif frame.role == "row":
+            self.insert_rows.append(self.items(frame, frame.start, i))
+        return parent
+
+    def items(self, frame, start, end):
+        commas = [c for c in frame.commas if start <= c < end]
+        return [self.tokens[a:b] for a, b in zip([start] + [c + 1 for c in commas], commas + [end])]
+
+    # -- predicates ----------------------------------------------------
+    def operand(self, i, step):
+        """Column reference or literal ending (step=-1) or starting (step=1) at i; returns (operand, far end)."""
+        token = self.tok(i)
+        if token is None:
+            return None, i
+        if token.kind in ("number", "string"):
+            return ("lit", [token]), i
+        if token.kind not in ("word", "ident") or (token.kind == "word" and token.value.upper() in _SQL_RESERVED):
+            return None, i
+        far = self.tok(i + 2 * step)
+        if self.upper(i + step) == "." and far is not None and far.kind in ("word", "ident"):
+            qualifier, column = (far, token) if step < 0 else (token, far)
+            return ("col", self.name(qualifier), self.name(column)), i + 2 * step
+        if step > 0 and self.upper(i + 1) in ("(", "."):
+            return None, i
+        return ("col", None, self.name(token)), i
+
+    def resolve(self, frame, qualifier, column):
+        query = frame
+        while query.kind != "query":
+            query = query.parent
+        if qualifier is None:
+            if column == "orgid":
+                candidates = [ref for ref in query.refs if ref.table in CHAT_SQL_ORG_TABLES]
+            elif len(query.refs) == 1:
+                candidates = query.refs
+            else:
+                candidates = [ref for ref in query.refs if column in CHAT_SQL_CHILD_TABLES.get(ref.table, {})]
+            return candidates[0] if len(candidates) == 1 else None
+        while query is not None:
+            if qualifier in query.aliases:
+                return query.aliases[qualifier]
+            query = query.parent
+        return None
+
+    def on_equals(self, frame, i):
+        left, start = self.operand(i - 1, -1)
+        right, end = self.operand(i + 1, 1)
+        if frame.kind == "query" and frame.clause == "set":
+            if left and left[0] == "col" and left[2] in _CHAT_SQL_REFERENCE_COLUMNS:
+                raise SqlRejected(f"{left[2]} cannot be set directly; insert the row with "
+                                  f"INSERT ... SELECT from ing filtered by orgID = {self.org}.")
+            if left and left[0] == "col" and left[2] == "orgid":
+                if not (right and right[0] == "lit" and self.is_org_literal(right[1])):
+                    raise SqlRejected("orgID cannot be changed.")
+                self.insert_org_assigned = True
+            return
+        if not (left and right and frame.in_condition()):
+            return
+        if self.upper(start - 1) not in _SQL_PREDICATE_START or start - 1 in self.between_ands:
+            return
+        after = self.upper(end + 1)
+        if after is not None and after not in _SQL_PREDICATE_END:
+            return
+        if left[0] == "lit":
+            left, right = right, left
+        if left[0] != "col":
+            return
+        ref = self.resolve(frame, left[1], left[2])
+        if ref is None:
+            return
+        if right[0] == "lit":
+            if left[2] == "orgid" and self.is_org_literal(right[1]):
+                frame.conds.append(("org", ref))
+        elif left[2] == right[2]:
+            other = self.resolve(frame, right[1], right[2])
+            if other is not None:
+                frame.conds.append(("link", ref, left[2], other, right[2]))
+
+    # -- final checks --------------------------------------------------
+    def check_constraints(self):
+        if self.kind == "write":
+            for ref in self.refs:
+                if ref.top_level and ref.table in CHAT_SQL_READ_ONLY_TABLES:
+                    raise SqlRejected(f"{ref.table} is read-only.")
+        if self.org is None:
+            return
+        pinned = {id(ref) for ref in self.refs
+                  if id(ref) in self.pinned and ref.table in CHAT_SQL_ORG_TABLES}
+        for ref in self.refs:
+            if ref is self.insert_target:
+                continue
+            parents = CHAT_SQL_CHILD_TABLES.get(ref.table)
+            if parents is not None:
+                if not any(child is ref and column in parents and parent.table == parents[column]
+                           and id(parent) in pinned for child, column, parent, _ in self.links):
+                    raise SqlRejected(
+                        f"{ref.alias} must be joined to dishes or ing filtered by orgID = {self.org} "
+                        f"(e.g. {ref.alias}.dishID = d.dishID AND d.orgID = {self.org}).")
+            elif id(ref) not in pinned:
+                raise SqlRejected(f"Every table must be filtered by orgID = {self.org} "
+                                  f"(missing for {ref.alias}).")
+        if self.insert_target is not None:
+            self.check_insert(pinned)
+
+    def check_insert(self, pinned):
+        target = self.insert_target
+        if self.insert_org_assigned and not self.insert_columns:
+            return
+        if not self.insert_columns:
+            raise SqlRejected("INSERT must list its columns.")
+        required = {column: (parent, column) for column, parent in
+                    (CHAT_SQL_CHILD_TABLES.get(target.table) or {"orgid": None}).items()}
+        required.update(CHAT_SQL_ORG_REFERENCES.get(target.table, {}))
+        if self.insert_rows:
+            parents = sorted({parent for parent, _ in required.values() if parent})
+            if parents:
+                raise SqlRejected(f"Insert into {target.table} with INSERT ... SELECT from "
+                                  f"{' and '.join(parents)} filtered by orgID = {self.org}.")
+            if "orgid" not in self.insert_columns:
+                raise SqlRejected(f"INSERT into {target.table} must set orgID = {self.org}.")
+            index = self.insert_columns.index("orgid")
+            for row in self.insert_rows:
+                if len(row) != len(self.insert_columns) or not self.is_org_literal(row[index]):
+                    raise SqlRejected(f"INSERT into {target.table} must set orgID = {self.org}.")
+            return
+        top = self.top
+        if top.select_start is None:
+            raise SqlRejected("INSERT must use VALUES, SET or SELECT.")
+        items = self.items(top, top.select_start, top.select_end or len(self.tokens))
+        if len(items) != len(self.insert_columns):
+            raise SqlRejected("INSERT column count does not match the SELECT list.")
+        for column, (parent_table, parent_column) in required.items():
+            if column not in self.insert_columns:
+                raise SqlRejected(f"INSERT into {target.table} must set {column}.")
+            item = items[self.insert_columns.index(column)]
+            if len(item) > 2 and item[-2].value.upper() == "AS":
+                item = item[:-2]
+            if column == "orgid" and self.is_org_literal(item):
+                continue
+            ref = None
+            if len(item) == 1 and item[0].kind in ("word", "ident"):
+                ref = self.resolve(top, None, self.name(item[0]))
+                source = self.name(item[0])
+            elif len(item) == 3 and item[1].value == ".":
+                ref = self.resolve(top, self.name(item[0]), self.name(item[2]))
+                source = self.name(item[2])
+            if (ref is None or source != parent_column or id(ref) not in pinned
+                    or (parent_table is not None and ref.table != parent_table)):
+                raise SqlRejected(f"INSERT into {target.table} must take {column} from a table "
+                                  f"filtered by orgID = {self.org}.")
+
+    # -- parameterization ----------------------------------------------
+    def parameterize(self, bound=None):
+        """
+        Rebuild the statement with bindable literals as :pN (other colons
+        escaped for text()). ``bound=(timeout_ms, limit)`` also puts a
+        MAX_EXECUTION_TIME hint after the outer query block's SELECT and
+        appends LIMIT ``limit`` unless the statement has its own.
+        """
+        hint_at = None
+        if bound is not None:
+            hint_at = self.top_select
+            if hint_at is None:  # (SELECT ...) UNION (SELECT ...): hint the first block
+                hint_at = next(i for i, t in enumerate(self.tokens) if self.upper(i) == "SELECT")
+        parts, params = [], {}
+        prev = prev_kind = None
+        for i, (token, bindable) in enumerate(zip(self.tokens, self.bindable())):
+            if bindable:
+                name = f"p{len(params)}"
+                params[name] = _sql_literal_value(token)
+                rendered = f":{name}"
+            else:
+                rendered = token.value.replace(":", "\\:")
+            if parts and not (token.value in (".", ",", ")") or prev in (".", "(")
+                              or (token.value == "(" and prev_kind in ("word", "ident"))):
+                parts.append(" ")
+            parts.append(rendered)
+            if i == hint_at:
+                parts.append(f" /*+ MAX_EXECUTION_TIME({int(bound[0])}) */")
+            prev, prev_kind = token.value, token.kind
+        if bound is not None and not self.top_limit:
+            parts.append(f" LIMIT {int(bound[1])}")
+        return "".join(parts), params
+
+    def bindable(self):
+        clause, stack, flags = None, [], []
+        for i, token in enumerate(self.tokens):
+            value = self.upper(i)
+            if token.kind == "word" and value in _SQL_CLAUSES:
+                clause = _SQL_CLAUSES[value]
+            elif token.kind == "word" and value in ("SELECT", "FROM", "UNION", "INTERSECT", "EXCEPT"):
+                clause = None
+            elif value == "(":
+                stack.append((clause, self.upper(i - 1)))
+                if self.upper(i + 1) in ("SELECT", "WITH"):
+                    clause = None
+            elif value == ")" and stack:
+                clause = stack.pop()[0]
+            ok = token.kind == "string" or (token.kind == "number" and token.value[:2].lower() not in ("0x", "0b"))
+            if ok:
+                opener = stack[-1][1] if stack else None
+                before = self.upper(i - 1)
+                ok = not (clause in _SQL_INLINE_CLAUSES or opener in _SQL_TYPE_WORDS
+                          or before in _SQL_INLINE_AFTER
+                          or (token.kind == "string" and before is not None and before.startswith("_")))
+            flags.append(ok)
+        return flags
+
+
+def analyze_sql(query_str, org_id=None):
+    """
+    Tokenize and check one chat tool statement. Returns an SqlAnalysis with
+    kind ("read"/"write"), the statement with literals bound as :pN, their
+    values, the base tables it touches and, for reads, the statement bounded
+    by a MAX_EXECUTION_TIME hint and a LIMIT; raises SqlRejected.
+    """
+    analyzer = _SqlAnalyzer(tokenize_sql(query_str), org_id)
+    analyzer.run()
+    sql, params = analyzer.parameterize()
+    bounded_sql = None
+    if analyzer.kind == "read":
+        bounded_sql, _ = analyzer.parameterize(bound=(CHAT_SQL_TIMEOUT_MS, CHAT_SQL_FETCH_LIMIT + 1))
+    tables = set()
+    for ref in analyzer.refs:
+        tables |= REPORTING_VIEWS[ref.table][0] if ref.table in REPORTING_VIEWS else {ref.table}
+    return SqlAnalysis(analyzer.kind, sql, params, tables, bounded_sql)
+
+
 def validate_sql(query_str, allow_writes=False, org_id=None):
     """Validate a SQL query for safety. Returns (is_safe, reason)."""
-    normalized = query_str.strip().upper()
+    try:
+        analysis = analyze_sql(query_str, org_id)
+    except SqlRejected as e:
+        return False, str(e)
+    if analysis.kind == "write" and not allow_writes:
+        return False, "Write operations not allowed in read-only mode. Use run_sql_write instead."
+    return True, "OK"
 
-    # Block dangerous patterns
-    for pattern in BLOCKED_SQL_PATTERNS:
-        if re.search(pattern, normalized, re.IGNORECASE):
-            return False, f"Blocked: query matches dangerous pattern"
 
-    # Check for write operations
-    is_write = any(re.search(p, normalized, re.IGNORECASE) for p in WRITE_SQL_PATTERNS)
-    if is_write and not allow_writes:
-        return False, "Write operations not allowed in read-only mode. Use run_sql_write instead."
+# Chat tool SELECT results per (org, normalized SQL). Entries carry the
+# versions of the tables they read, so a local write invalidates them at once.
+_chat_sql_cache = TTLCache(
+    "chat_sql_results",
+    maxsize=2048,
+    ttl_seconds=int(os.getenv("CHAT_SQL_CACHE_TTL_SECONDS", "60")),
+)
 
-    # Ensure org_id filter is present (basic check)
-    if org_id is not None and str(org_id) not in query_str:
-        return False, f"Query must filter by orgID = {org_id} for data isolation."
 
-    return True, "OK"
+# Limits for chat tool SELECTs: what the model sees, how far we read, how
+# long MySQL may run, and how big a full table scan EXPLAIN may plan.
+CHAT_SQL_MAX_ROWS = int(os.getenv("CHAT_SQL_MAX_ROWS", "200"))
+CHAT_SQL_FETCH_LIMIT = int(os.getenv("CHAT_SQL_FETCH_LIMIT", "5000"))
+CHAT_SQL_TIMEOUT_MS = int(os.getenv("CHAT_SQL_TIMEOUT_MS", "5000"))
+CHAT_SQL_MAX_SCAN_ROWS = int(os.getenv("CHAT_SQL_MAX_SCAN_ROWS", "50000"))
+CHAT_SQL_FETCH_BATCH = 500
+
+
+def _json_converter(value):
+    """Pick how to make a column's values JSON-friendly from its first non-null value."""
+    if isinstance(value, Decimal):
+        return float
+    if hasattr(value, "isoformat"):
+        return lambda v: v.isoformat()
+    return None
+
+
+class RowSerializer:
+    """Turns fetched row batches into dicts, choosing one converter per column as values appear."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.converters = [None] * len(columns)
+        self.pending = set(range(len(columns)))
+
+    def convert(self, raw_rows):
+        for row in raw_rows:
+            if not self.pending:
+                break
+            for i in list(self.pending):
+                if row[i] is not None:
+                    self.converters[i] = _json_converter(row[i])
+                    self.pending.discard(i)
+        convert = [(i, fn) for i, fn in enumerate(self.converters) if fn]
+        rows = []
+        for row in raw_rows:
+            values = list(row)
+            for i, fn in convert:
+                if values[i] is not None:
+                    values[i] = fn(values[i])
+            rows.append(dict(zip(self.columns, values)))
+        return rows
+
+
+def summarize_columns(columns, rows):
+    """Per-column stats for a truncated result: nulls, distinct values, and min/max/avg for numbers."""
+    summary = {}
+    for col in columns:
+        values = [row[col] for row in rows if row[col] is not None]
+        stats = {"nulls": len(rows) - len(values), "distinct": len(set(map(str, values)))}
+        numbers = [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+        if numbers and len(numbers) == len(values):
+            stats.update(min=min(numbers), max=max(numbers),
+                         avg=round(sum(numbers) / len(numbers), 4), sum=round(sum(numbers), 4))
+        elif values and all(isinstance(v, str) for v in values):
+            stats.update(min=min(values), max=max(values))
+        summary[col] = stats
+    return summary
+
+
+def check_query_cost(query_str, params=None):
+    """
+    EXPLAIN a SELECT and return an error message if MySQL plans a full scan
+    of more than CHAT_SQL_MAX_SCAN_ROWS rows, else None.
+    """
+    plan = db.session.execute(sql_text(f"EXPLAIN {query_str}"), params or {}).mappings().all()
+    for step in plan:
+        if (step.get("type") or "").upper() == "ALL" and (step.get("rows") or 0) > CHAT_SQL_MAX_SCAN_ROWS:
+            return (f"Query rejected: it would scan ~{step['rows']} rows of {step.get('table')} "
+                    f"without an index. Filter by orgID plus a date range, ingredient or other "
+                    f"selective condition, or query an aggregate view.")
+    return None
 
 
 def execute_sql_query(query_str, org_id, allow_writes=False):
-    """Execute a SQL query and return results as a list of dicts."""
-    is_safe, reason = validate_sql(query_str, allow_writes=allow_writes, org_id=org_id)
-    if not is_safe:
-        return {"error": reason}
+    """
+    Execute a SQL query and return results as a list of dicts.
 
+    SELECTs are cost-checked with EXPLAIN, time-boxed, and capped at
+    CHAT_SQL_FETCH_LIMIT + 1 rows by a LIMIT on the outer query (the
+    mysql-connector driver buffers whole results, so the LIMIT is what bounds
+    memory). Results are cut to CHAT_SQL_MAX_ROWS rows with a per-column
+    summary so large results don't flood the model's context.
+    """
     try:
-        result = db.session.execute(sql_text(query_str))
+        analysis = analyze_sql(query_str, org_id)
+    except SqlRejected as e:
+        return {"error": str(e)}
+    if analysis.kind == "write" and not allow_writes:
+        return {"error": "Write operations not allowed in read-only mode. Use run_sql_write instead."}
+    query_str, params = analysis.sql, analysis.params
+
+    cache_key = versions = None
+    if not allow_writes:
+        versions = table_versions(analysis.tables)
+        cache_key = (org_id, normalize_sql(query_str), tuple(sorted(params.items())))
+        cached = _chat_sql_cache.get(cache_key)
+        if cached is not None and cached[0] == versions:
+            return dict(cached[1], cached=True)
 
+    try:
         if allow_writes:
+            result = db.session.execute(sql_text(query_str), params)
+            if "stock_batches" in analysis.tables:
+                rebuild_stock_on_hand(org_id)
             db.session.commit()
+            stock_analytics.invalidate(org_id)
             return {"success": True, "rows_affected": result.rowcount}
 
+        if analysis.kind == "read":
+            rejection = check_query_cost(query_str, params)
+            if rejection:
+                return {"error": rejection}
+            query_str = analysis.bounded_sql
+
+        result = db.session.execute(sql_text(query_str), params)
+
         # For SELECT queries
         if result.returns_rows:
             columns = list(result.keys())
+            serializer = RowSerializer(columns)
             rows = []
-            for row in result.fetchall():
-                row_dict = {}
-                for i, col in enumerate(columns):
-                    val = row[i]
-                    # Convert non-serializable types
-                    if isinstance(val, Decimal):
-                        val = float(val)
-                    elif isinstance(val, (datetime,)):
-                        val = val.isoformat()
-                    elif hasattr(val, 'isoformat'):
-                        val = val.isoformat()
-                    row_dict[col] = val
-                rows.append(row_dict)
-            return {"columns": columns, "rows": rows, "row_count": len(rows)}
+            while len(rows) <= CHAT_SQL_FETCH_LIMIT:
+                batch = result.fetchmany(CHAT_SQL_FETCH_BATCH)
+                if not batch:
+                    break
+                rows.extend(serializer.convert(batch))
+            result.close()
+            payload = {"columns": columns, "rows": rows, "row_count": len(rows)}
+            if len(rows) > CHAT_SQL_MAX_ROWS:
+                more = len(rows) > CHAT_SQL_FETCH_LIMIT
+                rows = rows[:CHAT_SQL_FETCH_LIMIT]
+                payload.update({
+                    "rows": rows[:CHAT_SQL_MAX_ROWS],
+                    "row_count": len(rows),
+                    "row_count_is_lower_bound": more,
+                    "truncated": True,
+                    "summary": summarize_columns(columns, rows),
+                    "note": (f"Only the first {CHAT_SQL_MAX_ROWS} rows are shown; use the summary, "
+                             f"or aggregate with GROUP BY / add filters for exact answers."),
+                })
+            _chat_sql_cache.set(cache_key, (versions, payload))
+            return payload
         else:
             db.session.commit()
+            stock_analytics.invalidate(org_id)
             return {"success": True, "rows_affected": result.rowcount}
 
     except Exception as e:
@@ -2315,9 +5396,450 @@ sql_read_tool = genai.protos.Tool(
 )
 
 
+# Models to try in priority order; falls back on rate-limit errors
+CHAT_MODELS = [
+    'gemini-2.5-flash-lite',
+    'gemini-3-flash-preview',
+    'gemini-2.5-flash',
+]
+CHAT_MAX_TOOL_TURNS = 10
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "6000"))
+CHAT_HISTORY_KEEP_MESSAGES = 6  # most recent messages always kept verbatim
+
+
+_genai_lock = threading.Lock()
+_genai_api_key = None
+
+
+def ensure_genai_configured(api_key):
+    """Configure the Gemini SDK once per process (again only if the key changes)."""
+    global _genai_api_key
+    if _genai_api_key == api_key:
+        return
+    with _genai_lock:
+        if _genai_api_key != api_key:
+            genai.configure(api_key=api_key)
+            _genai_api_key = api_key
+
+
+# GenerativeModel objects are built once per (model, system prompt) and
+# reused; the prompt only varies by org and user, so the set stays small.
+_chat_models = TTLCache("chat_models", maxsize=256, ttl_seconds=3600)
+
+
+def get_chat_model(model_name, system_prompt):
+    key = (model_name, hashlib.sha256(system_prompt.encode("utf-8")).hexdigest())
+    model = _chat_models.get(key)
+    if model is None:
+        model = genai.GenerativeModel(
+            model_name,
+            tools=[sql_read_tool],
+            system_instruction=system_prompt,
+        )
+        _chat_models.set(key, model)
+    return model
+
+
+class Conversation:
+    """Server-side chat history for one conversationId, in Gemini history format."""
+
+    def __init__(self, conversation_id, org_id, user_id, history=None):
+        self.id = conversation_id
+        self.org_id = org_id
+        self.user_id = user_id
+        self.history = list(history or [])
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.history)
+
+    def append_exchange(self, message, reply):
+        with self.lock:
+            self.history.append({"role": "user", "parts": [message]})
+            self.history.append({"role": "model", "parts": [reply]})
+
+    def estimated_tokens(self):
+        # ~4 characters per token is close enough for budgeting
+        with self.lock:
+            return sum(len(part) for entry in self.history for part in entry["parts"]) // 4
+
+
+# Process-local: a conversation started on another worker (or evicted)
+# answers 409 and the client resends its history once.
+chat_conversations = TTLCache(
+    "chat_conversations",
+    maxsize=int(os.getenv("CHAT_CONVERSATIONS_MAX", "2000")),
+    ttl_seconds=int(os.getenv("CHAT_CONVERSATION_TTL_SECONDS", str(2 * 3600))),
+)
+
+
+def compact_conversation(conversation):
+    """
+    Background task: once a conversation exceeds CHAT_HISTORY_TOKEN_BUDGET,
+    fold everything but the latest messages into a model-written summary.
+    Falls back to dropping the oldest messages if summarizing fails.
+    """
+    if conversation.estimated_tokens() <= CHAT_HISTORY_TOKEN_BUDGET:
+        return
+    history = conversation.snapshot()
+    older, recent = history[:-CHAT_HISTORY_KEEP_MESSAGES], history[-CHAT_HISTORY_KEEP_MESSAGES:]
+    if not older:
+        return
+    transcript = "\n".join(f"{entry['role']}: {' '.join(entry['parts'])}" for entry in older)
+    prompt = ("Summarize this conversation between a restaurant inventory manager and an assistant. "
+              "Keep facts, numbers, names and open requests; at most 200 words.\n\n" + transcript)
+    try:
+        _, response = model_router.call(
+            CHAT_MODELS, lambda model_name: genai.GenerativeModel(model_name).generate_content(prompt)
+        )
+        summary = [
+            {"role": "user", "parts": [f"Summary of our earlier conversation: {response.text.strip()}"]},
+            {"role": "model", "parts": ["Understood, I'll keep that in mind."]},
+        ]
+    except Exception:
+        app.logger.warning("Chat summarization failed; trimming history instead")
+        summary = []
+    with conversation.lock:
+        # Keep anything appended while the summary was being written
+        conversation.history = summary + recent + conversation.history[len(history):]
+
+
+# Read-only tool calls from one model turn run side by side on this pool,
+# each in its own app context and therefore its own DB session.
+chat_tool_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CHAT_TOOL_WORKERS", "4")),
+    thread_name_prefix="chat-tool",
+)
+
+
+def is_rate_limit_error(err):
+    if isinstance(err, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+        return True
+    err_str = str(err)
+    return "429" in err_str or "quota" in err_str.lower() or "ResourceExhausted" in err_str
+
+
+def is_retryable_model_error(err):
+    """Errors worth routing to another model: throttling and upstream outages."""
+    return is_rate_limit_error(err) or isinstance(err, (
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+    ))
+
+
+class ModelUnavailable(Exception):
+    """Every candidate model is cooling down (or just failed)."""
+
+    def __init__(self, retry_after, last_error=None):
+        super().__init__(f"All AI models are currently unavailable; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+        self.last_error = last_error
+
+
+class ModelRouter:
+    """
+    Circuit breakers for Gemini models, shared by all workers on a host.
+
+    A rate-limited model is opened (skipped) at once for the server's retry
+    hint or an exponential cool-down; other upstream errors open it after
+    FAILURE_THRESHOLD in a row. When the cool-down ends, exactly one caller
+    across workers gets to probe the model; a success closes the breaker.
+    State lives in a small SQLite file so every gunicorn worker sees the same
+    breakers; if that file is unusable the router fails open.
+    """
+
+    FAILURE_THRESHOLD = 3
+
+    def __init__(self, path, base_cooldown=30, max_cooldown=600, probe_seconds=60):
+        self.path = path
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_seconds = probe_seconds
+        try:
+            with self._db() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS model_health (model TEXT PRIMARY KEY, "
+                    "failures INTEGER NOT NULL, open_until REAL NOT NULL, probe_until REAL NOT NULL, "
+                    "last_error TEXT)"
+                )
+        except sqlite3.Error:
+            app.logger.exception("Model health store unavailable at %s", path)
+
+    def _db(self):
+        return sqlite3.connect(self.path, timeout=2)
+
+    def _states(self, models):
+        try:
+            with self._db() as conn:
+                rows = conn.execute(
+                    f"SELECT model, failures, open_until, probe_until, last_error FROM model_health "
+                    f"WHERE model IN ({','.join('?' * len(models))})", list(models),
+                ).fetchall()
+        except sqlite3.Error:
+            return {}
+        return {row[0]: row[1:] for row in rows}
+
+    def available(self, models):
+        """Models to try now, in preference order, skipping open breakers."""
+        now = time.time()
+        states = self._states(models)
+        result = []
+        for model in models:
+            _, open_until, _, _ = states.get(model, (0, 0, 0, None))
+            if open_until == 0:
+                result.append(model)
+            elif open_until <= now and self._claim_probe(model, now):
+                result.append(model)
+        return result
+
+    def _claim_probe(self, model, now):
+        try:
+            with self._db() as conn:
+                cursor = conn.execute(
+                    "UPDATE model_health SET probe_until = ? "
+                    "WHERE model = ? AND open_until <= ? AND probe_until <= ?",
+                    (now + self.probe_seconds, model, now, now),
+                )
+                return cursor.rowcount == 1
+        except sqlite3.Error:
+            return True
+
+    def retry_after(self, models):
+        now = time.time()
+        waits = [state[1] - now for state in self._states(models).values() if state[1] > now]
+        return max(min(waits), 1) if waits else 1
+
+    def record_success(self, model):
+        try:
+            with self._db() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO model_health VALUES (?, 0, 0, 0, NULL)", (model,)
+                )
+        except sqlite3.Error:
+            pass
+
+    def record_failure(self, model, err):
+        now = time.time()
+        try:
+            with self._db() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT failures FROM model_health WHERE model = ?", (model,)
+                ).fetchone()
+                failures = (row[0] if row else 0) + 1
+                open_until = 0
+                if is_rate_limit_error(err) or failures >= self.FAILURE_THRESHOLD:
+                    cooldown = min(self.base_cooldown * 2 ** (failures - 1), self.max_cooldown)
+                    hint = re.search(r"retry(?:_delay| in)\D{0,20}?(\d+(?:\.\d+)?)\s*s", str(err))
+                    if hint:
+                        cooldown = max(cooldown, float(hint.group(1)))
+                    open_until = now + cooldown
+                conn.execute(
+                    "INSERT OR REPLACE INTO model_health VALUES (?, ?, ?, 0, ?)",
+                    (model, failures, open_until, str(err)[:200]),
+                )
+        except sqlite3.Error:
+            app.logger.exception("Could not record failure for %s", model)
+            return
+        if open_until:
+            app.logger.warning("Model %s circuit open for %.0fs: %s", model, open_until - now, str(err)[:200])
+
+    def call(self, models, func):
+        """Return (model, func(model)) from the first healthy model that succeeds."""
+        last_error = None
+        for model in self.available(models):
+            try:
+                result = func(model)
+            except Exception as err:
+                if not is_retryable_model_error(err):
+                    raise
+                self.record_failure(model, err)
+                last_error = err
+                continue
+            self.record_success(model)
+            return model, result
+        raise ModelUnavailable(self.retry_after(models), last_error)
+
+    def status(self, models):
+        now = time.time()
+        states = self._states(models)
+        report = {}
+        for model in models:
+            failures, open_until, _, last_error = states.get(model, (0, 0, 0, None))
+            report[model] = {
+                "state": "closed" if not open_until else ("open" if open_until > now else "half-open"),
+                "failures": failures,
+                "retryInSeconds": round(open_until - now, 1) if open_until > now else 0,
+                "lastError": last_error,
+            }
+        return report
+
+
+model_router = ModelRouter(
+    os.getenv("MODEL_HEALTH_DB", os.path.join(tempfile.gettempdir(), "stocksense-model-health.sqlite")),
+    base_cooldown=int(os.getenv("MODEL_COOLDOWN_SECONDS", "30")),
+    max_cooldown=int(os.getenv("MODEL_MAX_COOLDOWN_SECONDS", "600")),
+)
+
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def execute_tool_call(fn_name, fn_args, org_id):
+    """Run one model function call. Returns (action or None, response dict, elapsed ms)."""
+    started = time.perf_counter()
+    app.logger.info(f"AI function call: {fn_name}({fn_args})")
+    if fn_name not in ("run_sql_query", "run_sql_write"):
+        return None, {"error": f"Unknown function: {fn_name}"}, 0.0
+    query = fn_args.get("query", "")
+    is_write = fn_name == "run_sql_write"
+    result = execute_sql_query(query, org_id=org_id, allow_writes=is_write)
+    action = {"action": "write" if is_write else "query", "purpose": fn_args.get("purpose", ""), "query": query}
+    return action, {"result": json.dumps(result, default=str)}, elapsed_ms(started)
+
+
+def _execute_tool_call_isolated(fn_name, fn_args, org_id):
+    with app.app_context():
+        try:
+            return execute_tool_call(fn_name, fn_args, org_id)
+        finally:
+            db.session.remove()
+
+
+def run_tool_calls(calls, org_id):
+    """
+    Execute one turn's function calls, returning (name, args, action,
+    response, ms) in call order. Several reads run concurrently; a turn
+    containing a write runs sequentially on the request's session.
+    """
+    parsed = [(fc.name, dict(fc.args) if fc.args else {}) for fc in calls]
+    if len(parsed) > 1 and all(name == "run_sql_query" for name, _ in parsed):
+        futures = [chat_tool_executor.submit(_execute_tool_call_isolated, name, args, org_id)
+                   for name, args in parsed]
+        outcomes = [future.result() for future in futures]
+    else:
+        outcomes = [execute_tool_call(name, args, org_id) for name, args in parsed]
+    return [(name, args) + outcome for (name, args), outcome in zip(parsed, outcomes)]
+
+
+def run_chat_agent(chat_session, message, org_id, stream=False):
+    """
+    Drive one user message through the model / tool-call loop.
+
+    Yields ("delta", ...) for streamed text, ("tool", ...) as calls start and
+    finish, and finally ("done", {response, actions, metadata}) where
+    metadata splits the latency between model round-trips and SQL.
+    """
+    started = time.perf_counter()
+    turns = []
+    actions_taken = []
+    content = message
+    final_text = ""
+    for turn in range(1, CHAT_MAX_TOOL_TURNS + 2):
+        model_started = time.perf_counter()
+        response = chat_session.send_message(content, stream=stream)
+        final_text = ""
+        function_calls = []
+        for chunk in (response if stream else [response]):
+            for candidate in chunk.candidates:
+                for part in candidate.content.parts:
+                    if part.function_call:
+                        function_calls.append(part.function_call)
+                    elif part.text:
+                        final_text += part.text
+                        if stream:
+                            yield "delta", {"turn": turn, "text": part.text}
+        turn_timing = {"turn": turn, "modelMs": elapsed_ms(model_started), "sqlMs": 0.0, "toolCalls": 0}
+        turns.append(turn_timing)
+
+        # Stop once the model answers in text (or the tool budget is spent)
+        if not function_calls or turn > CHAT_MAX_TOOL_TURNS:
+            break
+
+        for fc in function_calls:
+            yield "tool", {"turn": turn, "name": fc.name, "status": "running",
+                           "purpose": (dict(fc.args) if fc.args else {}).get("purpose", "")}
+        sql_started = time.perf_counter()
+        outcomes = run_tool_calls(function_calls, org_id)
+        turn_timing["sqlMs"] = elapsed_ms(sql_started)
+        turn_timing["toolCalls"] = len(outcomes)
+
+        content = []
+        for name, args, action, result, ms in outcomes:
+            if action:
+                actions_taken.append(action)
+            yield "tool", {"turn": turn, "name": name, "status": "error" if "error" in result else "done",
+                           "purpose": args.get("purpose", ""), "ms": ms}
+            content.append(genai.protos.Part(
+                function_response=genai.protos.FunctionResponse(name=name, response=result)
+            ))
+
+    if not final_text:
+        final_text = "I processed your request but couldn't generate a text response."
+    yield "done", {
+        "response": final_text,
+        "actions": actions_taken,
+        "metadata": {
+            "totalMs": elapsed_ms(started),
+            "modelMs": round(sum(t["modelMs"] for t in turns), 1),
+            "sqlMs": round(sum(t["sqlMs"] for t in turns), 1),
+            "turns": turns,
+        },
+    }
+
+
+def chat_events(system_prompt, history, message, org_id, stream=False):
+    """run_chat_agent over the healthy CHAT_MODELS, routing around throttled ones."""
+    last_error = None
+    for model_name in model_router.available(CHAT_MODELS):
+        emitted = False
+        try:
+            app.logger.info(f"Trying Gemini model: {model_name}")
+            model = get_chat_model(model_name, system_prompt)
+            chat_session = model.start_chat(history=history)
+            for kind, payload in run_chat_agent(chat_session, message, org_id, stream=stream):
+                emitted = emitted or stream
+                if kind == "done":
+                    payload["metadata"]["model"] = model_name
+                    app.logger.info(f"Chat succeeded with model: {model_name}")
+                yield kind, payload
+            model_router.record_success(model_name)
+            return
+        except Exception as model_err:
+            if not is_retryable_model_error(model_err):
+                raise
+            model_router.record_failure(model_name, model_err)
+            # Only fall back before anything reached the client
+            if emitted:
+                raise
+            last_error = model_err
+
+    retry_after = model_router.retry_after(CHAT_MODELS)
+    app.logger.error("No Gemini model available (retry in %.0fs)", retry_after)
+    detail = f" Last error: {str(last_error)[:200]}" if last_error else ""
+    yield "error", {
+        "error": f"All AI models are currently rate-limited. Please try again in {retry_after:.0f} seconds.{detail}",
+        "status": 429,
+        "retryAfter": round(retry_after),
+    }
+
+
+def sse_event(kind, payload):
+    return f"event: {kind}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
 @app.route("/chat", methods=["POST"])
 @jwt_required()
 def chat_endpoint():
+    """
+    Agentic chat. Returns JSON by default; with {"stream": true}, ?stream=1
+    or Accept: text/event-stream it streams server-sent events instead
+    (delta / tool / done / error).
+    """
     try:
         user = get_current_user()
         if not user:
@@ -2331,9 +5853,6 @@ def chat_endpoint():
         if not message:
             return jsonify({"error": "Missing message field"}), 400
 
-        # Get conversation history from client (list of {role, text} dicts)
-        history_raw = data.get("history", [])
-
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             app.logger.error("GEMINI_API_KEY is not set")
@@ -2344,6 +5863,7 @@ def chat_endpoint():
         org_name = org.orgName if org else "Unknown"
         org_email = org.org_email if org else None
         org_id = user.orgID
+        user_id = user.userID
 
         system_prompt = build_system_prompt(
             org_name=org_name,
@@ -2353,148 +5873,125 @@ def chat_endpoint():
             org_id=org_id,
         )
 
-        genai.configure(api_key=api_key)
+        ensure_genai_configured(api_key)
+
+        # History lives server-side under conversationId; a client-sent
+        # history (list of {role, text} dicts) is only used to (re)start one.
+        conversation_id = data.get("conversationId")
+        history_raw = data.get("history")
+        conversation = chat_conversations.get((org_id, user_id, conversation_id)) if conversation_id else None
+        if conversation is None:
+            if conversation_id and history_raw is None:
+                return jsonify({"error": "Conversation expired; resend with history",
+                                "code": "conversation_expired"}), 409
+            gemini_history = []
+            for entry in history_raw or []:
+                role = entry.get("role", "user")
+                text = entry.get("text", "")
+                if role in ("user", "model") and text:
+                    gemini_history.append({"role": role, "parts": [text]})
+            conversation = Conversation(conversation_id or uuid.uuid4().hex, org_id, user_id, gemini_history)
+            chat_conversations.set((org_id, user_id, conversation.id), conversation)
+        gemini_history = conversation.snapshot()
+
+        def audit_chat(payload):
+            record_audit_detached("CHAT", "chat",
+                                   details={"model": payload["metadata"]["model"],
+                                            "actions_count": len(payload["actions"]),
+                                            "message_preview": message[:100],
+                                            "totalMs": payload["metadata"]["totalMs"]},
+                                   user_id=user_id, org_id=org_id)
+
+        def finish_turn(payload):
+            payload["conversationId"] = conversation.id
+            conversation.append_exchange(message, payload["response"])
+            chat_conversations.set((org_id, user_id, conversation.id), conversation)
+            if conversation.estimated_tokens() > CHAT_HISTORY_TOKEN_BUDGET:
+                submit_background(compact_conversation, conversation)
+            audit_chat(payload)
+
+        stream = (bool(data.get("stream")) or request.args.get("stream") == "1"
+                  or "text/event-stream" in (request.headers.get("Accept") or ""))
+        if stream:
+            def generate():
+                try:
+                    for kind, payload in chat_events(system_prompt, gemini_history, message,
+                                                      org_id, stream=True):
+                        if kind == "done":
+                            finish_turn(payload)
+                        yield sse_event(kind, payload)
+                except Exception as e:
+                    app.logger.exception("/chat stream failed with error")
+                    yield sse_event("error", {"error": str(e)})
+
+            return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        for kind, payload in chat_events(system_prompt, gemini_history, message, org_id):
+            if kind == "error":
+                return (jsonify({"error": payload["error"], "retryAfter": payload["retryAfter"]}),
+                        payload["status"], {"Retry-After": str(payload["retryAfter"])})
+            if kind == "done":
+                finish_turn(payload)
+                return jsonify(payload), 200
+        return jsonify({"error": "No response from AI model"}), 500
 
-        # Models to try in priority order; falls back on rate-limit errors
-        GEMINI_MODELS = [
-            'gemini-2.5-flash-lite',
-            'gemini-3-flash-preview',
-            'gemini-2.5-flash',
-        ]
+    except Exception as e:
+        app.logger.exception("/chat failed with error")
+        return jsonify({"error": str(e)}), 500
 
-        # Build Gemini conversation history
-        gemini_history = []
-        for entry in history_raw:
-            role = entry.get("role", "user")
-            text = entry.get("text", "")
-            if role in ("user", "model") and text:
-                gemini_history.append({"role": role, "parts": [text]})
 
-        last_error = None
-        for model_name in GEMINI_MODELS:
-            try:
-                app.logger.info(f"Trying Gemini model: {model_name}")
-                model = genai.GenerativeModel(
-                    model_name,
-                    tools=[sql_read_tool],
-                    system_instruction=system_prompt,
-                )
+# ─── Sustainability Endpoints ────────────────────────────────────────────────
 
-                chat_session = model.start_chat(history=gemini_history)
-
-                # Send the user message and handle function calling loop
-                response = chat_session.send_message(message)
-
-                # Agentic loop: keep processing function calls until we get a text response
-                max_iterations = 10
-                iteration = 0
-                actions_taken = []
-
-                while iteration < max_iterations:
-                    iteration += 1
-
-                    # Check if there are function calls in the response
-                    function_calls = []
-                    for candidate in response.candidates:
-                        for part in candidate.content.parts:
-                            if part.function_call:
-                                function_calls.append(part.function_call)
-
-                    if not function_calls:
-                        break  # No more function calls, we have the final text response
-
-                    # Process each function call
-                    function_responses = []
-                    for fc in function_calls:
-                        fn_name = fc.name
-                        fn_args = dict(fc.args) if fc.args else {}
-
-                        app.logger.info(f"AI function call: {fn_name}({fn_args})")
-
-                        if fn_name == "run_sql_query":
-                            query = fn_args.get("query", "")
-                            purpose = fn_args.get("purpose", "")
-                            result = execute_sql_query(query, org_id=org_id, allow_writes=False)
-                            actions_taken.append({"action": "query", "purpose": purpose, "query": query})
-                            function_responses.append(
-                                genai.protos.Part(
-                                    function_response=genai.protos.FunctionResponse(
-                                        name="run_sql_query",
-                                        response={"result": json.dumps(result, default=str)},
-                                    )
-                                )
-                            )
-
-                        elif fn_name == "run_sql_write":
-                            query = fn_args.get("query", "")
-                            purpose = fn_args.get("purpose", "")
-                            result = execute_sql_query(query, org_id=org_id, allow_writes=True)
-                            actions_taken.append({"action": "write", "purpose": purpose, "query": query})
-                            function_responses.append(
-                                genai.protos.Part(
-                                    function_response=genai.protos.FunctionResponse(
-                                        name="run_sql_write",
-                                        response={"result": json.dumps(result, default=str)},
-                                    )
-                                )
-                            )
-
-                        else:
-                            function_responses.append(
-                                genai.protos.Part(
-                                    function_response=genai.protos.FunctionResponse(
-                                        name=fn_name,
-                                        response={"error": f"Unknown function: {fn_name}"},
-                                    )
-                                )
-                            )
-
-                    # Send all function responses back to the model
-                    response = chat_session.send_message(function_responses)
-
-                # Extract final text
-                final_text = ""
-                for candidate in response.candidates:
-                    for part in candidate.content.parts:
-                        if part.text:
-                            final_text += part.text
-
-                if not final_text:
-                    final_text = "I processed your request but couldn't generate a text response."
-
-                app.logger.info(f"Chat succeeded with model: {model_name}")
-                record_audit("CHAT", "chat",
-                              details={"model": model_name,
-                                       "actions_count": len(actions_taken),
-                                       "message_preview": message[:100]},
-                              user_id=user.userID, org_id=org_id)
-                db.session.commit()
-                return jsonify({
-                    "response": final_text,
-                    "actions": actions_taken,
-                }), 200
-
-            except Exception as model_err:
-                err_str = str(model_err)
-                # If it's a rate-limit (429) or quota error, try next model
-                if "429" in err_str or "quota" in err_str.lower() or "rate" in err_str.lower() or "ResourceExhausted" in err_str:
-                    app.logger.warning(f"Model {model_name} rate-limited, trying next: {err_str[:200]}")
-                    last_error = model_err
-                    continue
-                else:
-                    # Non-rate-limit error — raise immediately
-                    raise model_err
+# Tried in order through model_router; throttled models are skipped
+RECIPE_MODELS = ["gemini-2.5-flash-lite", "gemini-2.5-flash"]
+
+# Suggestions depend only on the model and the set of ingredient names, so
+# they are cached by content: a day's page views cost one Gemini call.
+recipe_suggestion_cache = StaleWhileRevalidateCache(
+    "recipe_suggestions",
+    maxsize=int(os.getenv("RECIPE_CACHE_MAXSIZE", "512")),
+    fresh_seconds=int(os.getenv("RECIPE_CACHE_FRESH_SECONDS", str(6 * 3600))),
+    stale_seconds=int(os.getenv("RECIPE_CACHE_STALE_SECONDS", str(48 * 3600))),
+    sqlite_path=os.getenv("RECIPE_CACHE_SQLITE") or None,
+)
 
-        # All models exhausted
-        app.logger.error("All Gemini models rate-limited")
-        return jsonify({"error": f"All AI models are currently rate-limited. Please try again in a minute. Last error: {str(last_error)[:200]}"}), 429
 
-    except Exception as e:
-        app.logger.exception("/chat failed with error")
-        return jsonify({"error": str(e)}), 500
+def recipe_cache_key(model_names, ingredient_names):
+    normalized = sorted({name_key(name) for name in ingredient_names})
+    return StaleWhileRevalidateCache.make_key(list(model_names), normalized)
 
 
-# ─── Sustainability Endpoints ────────────────────────────────────────────────
+def generate_recipe_suggestions(model_names, ingredient_names):
+    """Ask Gemini for recipes using ``ingredient_names``; returns the parsed JSON list."""
+    ensure_genai_configured(os.getenv("GEMINI_API_KEY", ""))
+
+    prompt = (
+        f"I have these ingredients that are expiring soon or overstocked: "
+        f"{', '.join(ingredient_names)}.\n\n"
+        f"Suggest 3-5 practical recipes to use them up. "
+        f"For each recipe, provide:\n"
+        f"- Recipe name\n"
+        f"- Brief description (1-2 sentences)\n"
+        f"- Ingredients used from my list\n"
+        f"- Simple cooking steps (3-5 steps)\n\n"
+        f"Return ONLY valid JSON array with objects having keys: "
+        f"\"name\", \"description\", \"ingredients\" (array of strings), \"steps\" (array of strings). "
+        f"No markdown, no code fences, just the JSON array."
+    )
+
+    _, response = model_router.call(
+        model_names, lambda model_name: genai.GenerativeModel(model_name).generate_content(prompt)
+    )
+    raw_text = response.text.strip()
+
+    # Strip markdown code fences if present
+    if raw_text.startswith("```"):
+        raw_text = re.sub(r"^```(?:json)?\s*", "", raw_text)
+        raw_text = re.sub(r"\s*```$", "", raw_text)
+
+    return json.loads(raw_text)
+
 
 @app.route("/sustainability/recipes", methods=["GET"])
 @jwt_required()
@@ -2503,7 +6000,7 @@ def sustainability_recipes():
     Use Gemini to suggest recipes for overstocked or expiring-soon ingredients.
     """
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -2513,45 +6010,25 @@ def sustainability_recipes():
         overstock_threshold = settings.get("overstockThreshold", 10)
         recipe_days = settings.get("sustainabilityRecipeDays", 5)
 
-        # Grab stock batches that are expiring within recipe_days or are overstocked
-        stock_dish = Dish.query.filter(
-            Dish.orgID == org_id,
-            Dish.dishName == STOCK_DISH_NAME,
-        ).first()
-        stock_dish_id = stock_dish.dishID if stock_dish else None
-
         today = datetime.utcnow().date()
         from datetime import timedelta
         soon = today + timedelta(days=recipe_days)
 
-        # Get expiring-soon batches
-        expiring = Ingredient.query.filter(
-            Ingredient.orgID == org_id,
-            Ingredient.expiry.isnot(None),
-            Ingredient.expiry <= soon,
-            Ingredient.expiry >= today,
-        ).all()
-
-        # Get overstocked batches (qty > threshold)
-        overstocked_ids = []
-        if stock_dish_id:
-            high_qty = DishIngredient.query.filter(
-                DishIngredient.dishID == stock_dish_id,
-                DishIngredient.qty > overstock_threshold,
-            ).all()
-            overstocked_ids = [row.ingID for row in high_qty]
-
-        overstocked = []
-        if overstocked_ids:
-            overstocked = Ingredient.query.filter(
-                Ingredient.ingID.in_(overstocked_ids),
+        # Names of stock batches expiring within recipe_days or overstocked (qty > threshold)
+        ingredient_names = [
+            name for (name,) in db.session.query(Ingredient.ingName)
+            .join(StockBatch, StockBatch.masterIngID == Ingredient.ingID)
+            .filter(
                 Ingredient.orgID == org_id,
-            ).all()
-
-        # Build ingredient list for Gemini prompt
-        ingredient_names = list(set(
-            [ing.ingName for ing in expiring] + [ing.ingName for ing in overstocked]
-        ))
+                StockBatch.orgID == org_id,
+                or_(
+                    StockBatch.expiry.between(today, soon),
+                    StockBatch.qty > overstock_threshold,
+                ),
+            )
+            .distinct()
+            .all()
+        ]
 
         if not ingredient_names:
             return jsonify({
@@ -2561,41 +6038,23 @@ def sustainability_recipes():
             }), 200
 
         # Ask Gemini for recipes
-        gemini_key = os.getenv("GEMINI_API_KEY", "")
-        if not gemini_key:
+        if not os.getenv("GEMINI_API_KEY", ""):
             return jsonify({"error": "Gemini API key not configured"}), 500
 
-        import google.generativeai as genai
-        genai.configure(api_key=gemini_key)
-        model = genai.GenerativeModel("gemini-2.5-flash-lite")
-
-        prompt = (
-            f"I have these ingredients that are expiring soon or overstocked: "
-            f"{', '.join(ingredient_names)}.\n\n"
-            f"Suggest 3-5 practical recipes to use them up. "
-            f"For each recipe, provide:\n"
-            f"- Recipe name\n"
-            f"- Brief description (1-2 sentences)\n"
-            f"- Ingredients used from my list\n"
-            f"- Simple cooking steps (3-5 steps)\n\n"
-            f"Return ONLY valid JSON array with objects having keys: "
-            f"\"name\", \"description\", \"ingredients\" (array of strings), \"steps\" (array of strings). "
-            f"No markdown, no code fences, just the JSON array."
-        )
-
-        response = model.generate_content(prompt)
-        raw_text = response.text.strip()
-
-        # Strip markdown code fences if present
-        if raw_text.startswith("```"):
-            raw_text = re.sub(r"^```(?:json)?\s*", "", raw_text)
-            raw_text = re.sub(r"\s*```$", "", raw_text)
-
-        recipes = json.loads(raw_text)
+        ingredient_names.sort(key=str.casefold)
+        cache_key = recipe_cache_key(RECIPE_MODELS, ingredient_names)
+        try:
+            recipes, cache_state = recipe_suggestion_cache.get_or_compute(
+                cache_key, lambda: generate_recipe_suggestions(RECIPE_MODELS, ingredient_names)
+            )
+        except ModelUnavailable as exc:
+            return (jsonify({"error": str(exc), "retryAfter": round(exc.retry_after)}),
+                    429, {"Retry-After": str(round(exc.retry_after))})
 
         return jsonify({
             "recipes": recipes,
             "ingredients_used": ingredient_names,
+            "cache": cache_state,
         }), 200
 
     except Exception as e:
@@ -2603,6 +6062,118 @@ def sustainability_recipes():
         return jsonify({"error": str(e)}), 500
 
 
+# --- USDA Local Food Portal ---
+
+USDA_DIRECTORIES = ["agritourism", "csa", "farmersmarket", "foodhub", "onfarmmarket"]
+USDA_GEO_PRECISION = 2  # decimal places of lat/long per cache bucket (~1 km)
+
+
+class UsdaUpstreamError(Exception):
+    def __init__(self, status, body=""):
+        super().__init__(f"USDA API returned {status}")
+        self.status = status
+        self.body = body
+
+
+class UsdaHttpUpstream:
+    """Live usdalocalfoodportal.com client over a pooled keep-alive session with retries."""
+
+    BASE_URL = "https://www.usdalocalfoodportal.com/api"
+
+    def __init__(self, api_key, timeout=15):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = http_requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET"], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = (
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"
+        )
+
+    def search(self, directory, params):
+        url = f"{self.BASE_URL}/{directory}/"
+        app.logger.info("USDA API request: %s params=%s", url, params)
+        resp = self.session.get(url, params={**params, "apikey": self.api_key}, timeout=self.timeout)
+        if resp.status_code != 200:
+            raise UsdaUpstreamError(resp.status_code, resp.text[:500])
+        data = resp.json() if resp.text.strip() else []
+        # The USDA API wraps results in {"data": [...]}
+        if isinstance(data, dict) and "data" in data:
+            data = data["data"]
+        return data
+
+
+class UsdaFakeUpstream:
+    """
+    Offline stand-in selected with USDA_UPSTREAM=fake. Serves the JSON list in
+    USDA_FAKE_FIXTURE if set, otherwise one synthetic listing per directory,
+    and records every call in ``calls`` so tests can assert on coalescing.
+    """
+
+    def __init__(self, fixture_path=None):
+        self.calls = []
+        self.fixture = None
+        if fixture_path:
+            with open(fixture_path, encoding="utf-8") as fh:
+                self.fixture = json.load(fh)
+
+    def search(self, directory, params):
+        self.calls.append((directory, dict(params)))
+        if self.fixture is not None:
+            return self.fixture
+        return [{
+            "listing_name": f"Sample {directory}",
+            "location_address": "1 Main St",
+            "location_x": params.get("x"),
+            "location_y": params.get("y"),
+        }]
+
+
+def make_usda_upstream():
+    if os.getenv("USDA_UPSTREAM", "").lower() == "fake":
+        return UsdaFakeUpstream(os.getenv("USDA_FAKE_FIXTURE") or None)
+    api_key = os.getenv("usdalocalfoodportal_API_KEY", "")
+    return UsdaHttpUpstream(api_key) if api_key else None
+
+
+usda_upstream = make_usda_upstream()  # replaceable, e.g. with a UsdaFakeUpstream in tests
+usda_cache = TTLCache(
+    "usda_food_portal",
+    maxsize=2048,
+    ttl_seconds=int(os.getenv("USDA_CACHE_TTL_SECONDS", str(6 * 3600))),
+)
+usda_single_flight = SingleFlight()
+usda_rate_limiter = RateLimiter(
+    rate=float(os.getenv("USDA_MAX_RPS", "5")),
+    burst=int(os.getenv("USDA_BURST", "10")),
+)
+
+
+def usda_lookup(directory, params):
+    """
+    Return (results, cached) for a directory search. Results are cached per
+    query bucket; concurrent misses for one bucket share one upstream call,
+    and upstream calls are rate limited per process.
+    """
+    key = (directory,) + tuple(sorted(params.items()))
+    results = usda_cache.get(key)
+    if results is not None:
+        return results, True
+
+    def fetch():
+        if not usda_rate_limiter.acquire(timeout=5):
+            raise UsdaUpstreamError(429, "local rate limit")
+        data = usda_upstream.search(directory, params)
+        data = data if isinstance(data, list) else []
+        usda_cache.set(key, data)
+        return data
+
+    results, shared = usda_single_flight.do(key, fetch)
+    return results, shared
+
+
 @app.route("/sustainability/nearby-food-resources", methods=["GET"])
 @jwt_required()
 def nearby_food_resources():
@@ -2612,7 +6183,7 @@ def nearby_food_resources():
     Supports query params: directory, radius, zip, state, city
     """
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -2620,28 +6191,30 @@ def nearby_food_resources():
         if not org:
             return jsonify({"error": "Organization not found"}), 404
 
-        usda_key = os.getenv("usdalocalfoodportal_API_KEY", "")
-        if not usda_key:
+        if usda_upstream is None:
             return jsonify({"error": "USDA API key not configured"}), 500
 
         # Which USDA directory to query
         directory = request.args.get("directory", "farmersmarket")
-        valid_dirs = ["agritourism", "csa", "farmersmarket", "foodhub", "onfarmmarket"]
-        if directory not in valid_dirs:
+        if directory not in USDA_DIRECTORIES:
             directory = "farmersmarket"
 
-        radius = request.args.get("radius", "30")
+        try:
+            radius = str(max(1, min(int(request.args.get("radius", "30")), 100)))
+        except ValueError:
+            radius = "30"
 
-        # Build query params — prefer org lat/long, fall back to zip/state params
-        params = {"apikey": usda_key}
+        # Build query params — prefer org lat/long, fall back to zip/state params.
+        # Coordinates are rounded so nearby lookups share one cache bucket.
+        params = {}
 
         q_zip = request.args.get("zip", "")
         q_state = request.args.get("state", "")
         q_city = request.args.get("city", "")
 
         if org.latCoord is not None and org.longCoord is not None:
-            params["x"] = str(float(org.longCoord))
-            params["y"] = str(float(org.latCoord))
+            params["x"] = str(round(float(org.longCoord), USDA_GEO_PRECISION))
+            params["y"] = str(round(float(org.latCoord), USDA_GEO_PRECISION))
             params["radius"] = radius
         elif q_zip:
             params["zip"] = q_zip
@@ -2655,31 +6228,21 @@ def nearby_food_resources():
                 "error": "No location available. Please update your organization address or provide zip/state parameters."
             }), 400
 
-        url = f"https://www.usdalocalfoodportal.com/api/{directory}/"
-        app.logger.info("USDA API request: %s params=%s", url, params)
-
-        resp = http_requests.get(url, params=params, timeout=15,
-                                 headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)"})
-
-        if resp.status_code != 200:
-            app.logger.warning("USDA API returned %s: %s", resp.status_code, resp.text[:500])
-            return jsonify({"error": "USDA API error", "status": resp.status_code}), 502
-
-        data = resp.json() if resp.text.strip() else []
-
-        # The USDA API wraps results in {"data": [...]}
-        if isinstance(data, dict) and "data" in data:
-            data = data["data"]
-
-        # Normalize if the API returns something unexpected
-        if not isinstance(data, list):
-            data = []
+        try:
+            data, cached = usda_lookup(directory, params)
+        except UsdaUpstreamError as exc:
+            app.logger.warning("USDA API returned %s: %s", exc.status, exc.body)
+            return jsonify({"error": "USDA API error", "status": exc.status}), 502
+        except http_requests.RequestException as exc:
+            app.logger.warning("USDA API request failed: %s", exc)
+            return jsonify({"error": "USDA API unavailable"}), 502
 
         return jsonify({
             "directory": directory,
             "radius": radius,
             "results": data,
             "count": len(data),
+            "cached": cached,
             "org_location": {
                 "lat": float(org.latCoord) if org.latCoord else None,
                 "lon": float(org.longCoord) if org.longCoord else None,
@@ -2691,27 +6254,170 @@ def nearby_food_resources():
         return jsonify({"error": str(e)}), 500
 
 
+# --- Stock & Usage Analytics ---
+
+FORECAST_WINDOW_DAYS = 30
+URGENCY_ORDER = {"out-of-stock": 0, "critical": 1, "warning": 2, "ok": 3}
+
+
+class OrgStockSnapshot:
+    """
+    Point-in-time usage and stock totals for one org, keyed by
+    (ingName, category, canonical unit). Shared by /predict/stockouts and
+    /vendors/pricing; org settings are applied per call, not cached.
+    """
+
+    def __init__(self, org_id, usage_totals, stock_levels, days_in_window, as_of):
+        self.org_id = org_id
+        self.usage_totals = usage_totals
+        self.stock_levels = stock_levels
+        self.days_in_window = days_in_window
+        self.as_of = as_of
+
+    def keys(self):
+        return set(self.usage_totals) | set(self.stock_levels)
+
+    def forecast(self, key, lead_time_days, low_stock_threshold):
+        """Return stock, usage rate, days-until-stockout and urgency for one key."""
+        current_stock = self.stock_levels.get(key, 0)
+        total_used = self.usage_totals.get(key, 0)
+        avg_daily = total_used / self.days_in_window if total_used > 0 else 0
+
+        if avg_daily > 0:
+            days_until_stockout = round(current_stock / avg_daily, 1)
+        else:
+            days_until_stockout = None  # No usage data, can't predict
+
+        urgency = "ok"
+        if days_until_stockout is not None:
+            if days_until_stockout <= 0:
+                urgency = "out-of-stock"
+            elif days_until_stockout <= lead_time_days:
+                urgency = "critical"
+            elif days_until_stockout <= lead_time_days + low_stock_threshold:
+                urgency = "warning"
+        needs_reorder = urgency != "ok"
+
+        # Suggested reorder quantity: enough for lead_time + 7 buffer days
+        suggested_qty = None
+        if needs_reorder and avg_daily > 0:
+            suggested_qty = max(round(avg_daily * (lead_time_days + 7) - current_stock, 1), 0)
+
+        return {
+            "currentStock": current_stock,
+            "avgDailyUsage": avg_daily,
+            "daysUntilStockout": days_until_stockout,
+            "reorderUrgency": urgency,
+            "needsReorder": needs_reorder,
+            "suggestedReorderQty": suggested_qty,
+        }
+
+
+class StockAnalytics:
+    """
+    Builds OrgStockSnapshot objects with a fixed number of set-based queries
+    and caches them per org until stock or consumption changes.
+
+    Mutating endpoints call invalidate(org_id) after committing. A snapshot
+    that was being computed while an invalidation happened is not cached.
+    """
+
+    def __init__(self, ttl_seconds=300):
+        self._lock = threading.Lock()
+        self._snapshots = TTLCache("stock_analytics", maxsize=1024, ttl_seconds=ttl_seconds)
+        self._generations = {}  # org_id -> invalidation counter
+
+    def snapshot(self, org_id):
+        now = datetime.utcnow()
+        with self._lock:
+            generation = self._generations.get(org_id, 0)
+        cached = self._snapshots.get(org_id)
+        if cached and cached.as_of.date() == now.date():
+            return cached
+
+        snap = self._build(org_id, now)
+        with self._lock:
+            if self._generations.get(org_id, 0) == generation:
+                self._snapshots.set(org_id, snap)
+        return snap
+
+    def invalidate(self, org_id):
+        with self._lock:
+            self._snapshots.pop(org_id)
+            self._generations[org_id] = self._generations.get(org_id, 0) + 1
+
+    def _build(self, org_id, now):
+        lookback = now - timedelta(days=FORECAST_WINDOW_DAYS)
+
+        # Consumption over the window from the daily rollup (query 1)
+        usage_rows = (
+            db.session.query(
+                ConsumptionDaily.ingName,
+                ConsumptionDaily.category,
+                ConsumptionDaily.unit,
+                func.sum(ConsumptionDaily.qty),
+            )
+            .filter(
+                ConsumptionDaily.orgID == org_id,
+                ConsumptionDaily.day >= lookback.date(),
+            )
+            .group_by(
+                ConsumptionDaily.ingName,
+                ConsumptionDaily.category,
+                ConsumptionDaily.unit,
+            )
+            .all()
+        )
+        # Current stock from the maintained stock_on_hand totals (query 2)
+        stock_rows = (
+            db.session.query(
+                Ingredient.ingName,
+                Ingredient.category,
+                StockOnHand.unit,
+                StockOnHand.qty,
+            )
+            .join(Ingredient, and_(Ingredient.ingID == StockOnHand.masterIngID, Ingredient.orgID == org_id))
+            .filter(StockOnHand.orgID == org_id, StockOnHand.batchCount > 0)
+            .all()
+        )
+        # Both sides in canonical units, so "lb" stock and "lbs" usage share a key
+        totals = org_units(org_id).normalize(
+            [("usage", name, category or None, unit, total) for name, category, unit, total in usage_rows]
+            + [("stock", name, category or None, unit, total) for name, category, unit, total in stock_rows]
+        )
+        usage_totals = totals.get("usage", {})
+        stock_levels = totals.get("stock", {})
+
+        days_in_window = max((now.date() - lookback.date()).days, 1)
+        return OrgStockSnapshot(org_id, usage_totals, stock_levels, days_in_window, now)
+
+
+stock_analytics = StockAnalytics(
+    ttl_seconds=int(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", "300")),
+)
+
+
 # --- Stockout Prediction & Reorder Suggestions ---
 
 @app.route("/predict/stockouts", methods=["GET"])
 @jwt_required()
 def predict_stockouts():
     """
-    Analyse current stock levels and recent consumption (audit log CONSUME
-    entries) to predict when each ingredient will run out, and suggest
+    Analyse current stock levels and recent consumption (the consumption
+    ledger's daily rollup) to predict when each ingredient will run out, and suggest
     reorder timing based on configurable supplier lead‑time.
 
-    Algorithm (per ingredient, per unit):
-      1. Gather CONSUME audit entries for the last 30 days.
+    Algorithm (per ingredient, in canonical units — see StockAnalytics):
+      1. Sum the consumption_daily rollup over the last 30 days.
       2. Compute daily average usage rate.
-      3. Calculate current total stock from __STOCK__ batches.
+      3. Read current total stock from stock_on_hand.
       4. days_until_stockout = current_stock / avg_daily_usage
       5. Compare against supplier lead‑time to flag reorder urgency.
 
     Returns a list sorted by urgency (lowest days‑until‑stockout first).
     """
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -2720,161 +6426,27 @@ def predict_stockouts():
         lead_time_days = settings.get("supplierLeadTimeDays", 3)
         low_stock_threshold = settings.get("lowStockThreshold", 2)
 
-        from datetime import timedelta
-        now = datetime.utcnow()
-        lookback = now - timedelta(days=30)
-        today = now.date()
-
-        # ---- 1. Gather recent consumption from audit_logs ----
-        consume_logs = AuditLog.query.filter(
-            AuditLog.orgID == org_id,
-            AuditLog.action == "CONSUME",
-            AuditLog.resource_type == "stock",
-            AuditLog.timestamp >= lookback,
-        ).all()
-
-        # Build per-ingredient daily usage from deduction details
-        # details JSON: {"dishName": ..., "quantity": N, "deductions_count": M}
-        # We also stored per-deduction info in /stock/consume response but the
-        # audit log stores the dish-level summary. We need to re-derive
-        # ingredient-level usage from consumption quantity × recipe ratios.
-
-        # Gather dish → recipe ingredient ratios
-        dish_recipes = {}  # dishID -> [{ingName, category, qty, unit}, ...]
-        all_dishes = Dish.query.filter(
-            Dish.orgID == org_id,
-            Dish.dishName != STOCK_DISH_NAME,
-        ).all()
-        dish_name_to_id = {d.dishName: d.dishID for d in all_dishes}
-
-        for dish in all_dishes:
-            recipe_rows = (
-                db.session.query(DishIngredient, Ingredient)
-                .join(Ingredient, Ingredient.ingID == DishIngredient.ingID)
-                .filter(
-                    DishIngredient.dishID == dish.dishID,
-                    Ingredient.expiry.is_(None),
-                    Ingredient.batchNum.is_(None),
-                )
-                .all()
-            )
-            dish_recipes[dish.dishID] = [
-                {
-                    "ingName": ing.ingName,
-                    "category": ing.category,
-                    "qty": float(link.qty) if link.qty else 0,
-                    "unit": link.unit or "",
-                }
-                for link, ing in recipe_rows
-            ]
-
-        # Accumulate per-ingredient usage over the 30-day window
-        # key = (ingName, category, unit) -> total_qty_consumed
-        usage_totals = {}
-        usage_daily_buckets = {}  # key -> set of dates with consumption
-        for log in consume_logs:
-            try:
-                details = json.loads(log.details) if log.details else {}
-            except (json.JSONDecodeError, TypeError):
-                continue
-            dish_name = details.get("dishName", "")
-            cooked_qty = Decimal(str(details.get("quantity", 0)))
-            dish_id = dish_name_to_id.get(dish_name)
-            if not dish_id or dish_id not in dish_recipes:
-                continue
-            log_date = log.timestamp.date()
-            for recipe_ing in dish_recipes[dish_id]:
-                key = (recipe_ing["ingName"], recipe_ing["category"], recipe_ing["unit"])
-                consumed = float(cooked_qty) * recipe_ing["qty"]
-                usage_totals[key] = usage_totals.get(key, 0) + consumed
-                if key not in usage_daily_buckets:
-                    usage_daily_buckets[key] = set()
-                usage_daily_buckets[key].add(log_date)
-
-        # ---- 2. Current stock levels ----
-        stock_dish = Dish.query.filter(
-            Dish.orgID == org_id,
-            Dish.dishName == STOCK_DISH_NAME,
-        ).first()
-
-        stock_levels = {}  # (ingName, category, unit) -> total qty
-        if stock_dish:
-            batch_rows = (
-                db.session.query(Ingredient, DishIngredient)
-                .join(DishIngredient, and_(
-                    DishIngredient.dishID == stock_dish.dishID,
-                    DishIngredient.ingID == Ingredient.ingID,
-                ))
-                .filter(
-                    Ingredient.orgID == org_id,
-                    or_(Ingredient.expiry.isnot(None), Ingredient.batchNum.isnot(None)),
-                )
-                .all()
-            )
-            for batch, link in batch_rows:
-                if link.qty is None:
-                    continue
-                key = (batch.ingName, batch.category, link.unit or "")
-                stock_levels[key] = stock_levels.get(key, 0) + float(link.qty)
-
-        # ---- 3. Compute predictions ----
-        days_in_window = max((today - lookback.date()).days, 1)
+        snapshot = stock_analytics.snapshot(org_id)
         predictions = []
-        all_keys = set(list(usage_totals.keys()) + list(stock_levels.keys()))
-
-        for key in all_keys:
+        for key in snapshot.keys():
             ing_name, category, unit = key
-            current_stock = stock_levels.get(key, 0)
-            total_used = usage_totals.get(key, 0)
-            active_days = len(usage_daily_buckets.get(key, set())) or days_in_window
-            # Use active days (days where consumption actually happened) for rate,
-            # but cap at window length
-            avg_daily = total_used / days_in_window if total_used > 0 else 0
-
-            if avg_daily > 0:
-                days_until_stockout = round(current_stock / avg_daily, 1)
-            else:
-                days_until_stockout = None  # No usage data, can't predict
-
-            # Reorder urgency
-            needs_reorder = False
-            reorder_urgency = "ok"
-            if days_until_stockout is not None:
-                if days_until_stockout <= 0:
-                    reorder_urgency = "out-of-stock"
-                    needs_reorder = True
-                elif days_until_stockout <= lead_time_days:
-                    reorder_urgency = "critical"
-                    needs_reorder = True
-                elif days_until_stockout <= lead_time_days + low_stock_threshold:
-                    reorder_urgency = "warning"
-                    needs_reorder = True
-
-            # Suggested reorder quantity: enough for lead_time + 7 buffer days
-            suggested_reorder_qty = None
-            if needs_reorder and avg_daily > 0:
-                buffer_days = lead_time_days + 7
-                suggested_reorder_qty = round(avg_daily * buffer_days - current_stock, 1)
-                if suggested_reorder_qty < 0:
-                    suggested_reorder_qty = 0
-
+            fc = snapshot.forecast(key, lead_time_days, low_stock_threshold)
             predictions.append({
                 "ingName": ing_name,
                 "category": category or "Uncategorized",
                 "unit": unit,
-                "currentStock": round(current_stock, 2),
-                "avgDailyUsage": round(avg_daily, 2),
-                "daysUntilStockout": days_until_stockout,
-                "reorderUrgency": reorder_urgency,
-                "needsReorder": needs_reorder,
-                "suggestedReorderQty": suggested_reorder_qty,
+                "currentStock": round(fc["currentStock"], 2),
+                "avgDailyUsage": round(fc["avgDailyUsage"], 2),
+                "daysUntilStockout": fc["daysUntilStockout"],
+                "reorderUrgency": fc["reorderUrgency"],
+                "needsReorder": fc["needsReorder"],
+                "suggestedReorderQty": fc["suggestedReorderQty"],
                 "supplierLeadTimeDays": lead_time_days,
             })
 
         # Sort: out-of-stock first, then critical, warning, ok. Within each, by days.
-        urgency_order = {"out-of-stock": 0, "critical": 1, "warning": 2, "ok": 3}
         predictions.sort(key=lambda p: (
-            urgency_order.get(p["reorderUrgency"], 4),
+            URGENCY_ORDER.get(p["reorderUrgency"], 4),
             p["daysUntilStockout"] if p["daysUntilStockout"] is not None else 9999,
         ))
 
@@ -2919,6 +6491,8 @@ _VENDOR_POOL = [
     {"name": "Farm2Table Direct",    "rating": 4.9, "minOrder": 2,  "deliveryDays": 1, "sustainable": True},
 ]
 
+# Keyed by canonical unit; aliases ("lbs") and other units of the same
+# dimension resolve through _unit_price_range().
 _UNIT_BASE_PRICES = {
     "lb":    {"low": 1.20, "high": 6.50},
     "oz":    {"low": 0.15, "high": 1.20},
@@ -2932,6 +6506,21 @@ _UNIT_BASE_PRICES = {
 }
 
 
+def _unit_price_range(unit):
+    """
+    Base price range per ``unit``: looked up by canonical spelling, else
+    scaled from the first priced unit it converts to (ml from L, ...).
+    """
+    unit = unit_registry.canonical(unit)
+    if unit in _UNIT_BASE_PRICES:
+        return _UNIT_BASE_PRICES[unit]
+    for priced, price_range in _UNIT_BASE_PRICES.items():
+        factor = unit_registry.factor(unit, priced)
+        if factor is not None:
+            return {bound: price * float(factor) for bound, price in price_range.items()}
+    return {"low": 0.50, "high": 5.00}
+
+
 def _seed_for(name: str) -> int:
     return int(_hl.md5(name.encode()).hexdigest(), 16) % (10 ** 9)
 
@@ -2941,7 +6530,7 @@ def _generate_vendors_for_ingredient(ing_name: str, unit: str, qty_needed: float
     seed = _seed_for(ing_name)
     rng = _rnd.Random(seed)
 
-    price_range = _UNIT_BASE_PRICES.get(unit, {"low": 0.50, "high": 5.00})
+    price_range = _unit_price_range(unit)
     base_price = rng.uniform(price_range["low"], price_range["high"])
 
     # Pick 3-4 vendors deterministically
@@ -2977,10 +6566,10 @@ def vendors_pricing():
     """
     Return simulated vendor pricing for ingredients that need reorder.
     Optionally filter to a single ingredient via ?ingredient=<name>.
-    Re-uses the same stock & consumption logic as /predict/stockouts.
+    Reads the same cached StockAnalytics snapshot as /predict/stockouts.
     """
     try:
-        user = get_current_user()
+        user = current_identity()
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
 
@@ -2991,124 +6580,21 @@ def vendors_pricing():
         lead_time_days = settings.get("supplierLeadTimeDays", 3)
         low_stock_threshold = settings.get("lowStockThreshold", 2)
 
-        from datetime import timedelta
-        now = datetime.now()
-        lookback = now - timedelta(days=30)
-        today = now.date()
-
-        # ---- Consumption from audit_logs (same as predict_stockouts) ----
-        consume_logs = AuditLog.query.filter(
-            AuditLog.orgID == org_id,
-            AuditLog.action == "CONSUME",
-            AuditLog.resource_type == "stock",
-            AuditLog.timestamp >= lookback,
-        ).all()
-
-        # Dish recipes
-        all_dishes = Dish.query.filter(
-            Dish.orgID == org_id,
-            Dish.dishName != STOCK_DISH_NAME,
-        ).all()
-        dish_name_to_id = {d.dishName: d.dishID for d in all_dishes}
-
-        dish_recipes = {}
-        for dish in all_dishes:
-            recipe_rows = (
-                db.session.query(DishIngredient, Ingredient)
-                .join(Ingredient, Ingredient.ingID == DishIngredient.ingID)
-                .filter(
-                    DishIngredient.dishID == dish.dishID,
-                    Ingredient.expiry.is_(None),
-                    Ingredient.batchNum.is_(None),
-                )
-                .all()
-            )
-            dish_recipes[dish.dishID] = [
-                {
-                    "ingName": ing.ingName,
-                    "category": ing.category,
-                    "qty": float(link.qty) if link.qty else 0,
-                    "unit": link.unit or "",
-                }
-                for link, ing in recipe_rows
-            ]
-
-        # Per-ingredient usage totals
-        usage_totals = {}
-        days_in_window = max((today - lookback.date()).days, 1)
-        for log in consume_logs:
-            try:
-                details = json.loads(log.details) if log.details else {}
-            except (json.JSONDecodeError, TypeError):
-                continue
-            dish_name = details.get("dishName", "")
-            cooked_qty = float(details.get("quantity", 0))
-            dish_id = dish_name_to_id.get(dish_name)
-            if not dish_id or dish_id not in dish_recipes:
-                continue
-            for recipe_ing in dish_recipes[dish_id]:
-                key = (recipe_ing["ingName"], recipe_ing["category"], recipe_ing["unit"])
-                usage_totals[key] = usage_totals.get(key, 0) + cooked_qty * recipe_ing["qty"]
-
-        # ---- Current stock levels ----
-        stock_dish = Dish.query.filter(
-            Dish.orgID == org_id,
-            Dish.dishName == STOCK_DISH_NAME,
-        ).first()
-
-        stock_levels = {}
-        if stock_dish:
-            batch_rows = (
-                db.session.query(Ingredient, DishIngredient)
-                .join(DishIngredient, and_(
-                    DishIngredient.dishID == stock_dish.dishID,
-                    DishIngredient.ingID == Ingredient.ingID,
-                ))
-                .filter(
-                    Ingredient.orgID == org_id,
-                    or_(Ingredient.expiry.isnot(None), Ingredient.batchNum.isnot(None)),
-                )
-                .all()
-            )
-            for batch, link in batch_rows:
-                if link.qty is None:
-                    continue
-                key = (batch.ingName, batch.category, link.unit or "")
-                stock_levels[key] = stock_levels.get(key, 0) + float(link.qty)
-
-        # ---- Build result items ----
-        all_keys = set(list(usage_totals.keys()) + list(stock_levels.keys()))
+        snapshot = stock_analytics.snapshot(org_id)
         result_items = []
 
-        for key in all_keys:
+        for key in snapshot.keys():
             ing_name, category, unit = key
             if filter_ingredient and ing_name.lower() != filter_ingredient.lower():
                 continue
 
-            current_stock = stock_levels.get(key, 0)
-            total_used = usage_totals.get(key, 0)
-            avg_daily = round(total_used / days_in_window, 2) if total_used > 0 else 0.0
-
-            if avg_daily > 0:
-                days_left = round(current_stock / avg_daily, 1)
-            else:
-                days_left = None
-
-            if days_left is None:
-                urgency = "ok"
-            elif days_left <= 0:
-                urgency = "out-of-stock"
-            elif days_left <= lead_time_days:
-                urgency = "critical"
-            elif days_left <= lead_time_days + low_stock_threshold:
-                urgency = "warning"
-            else:
-                urgency = "ok"
-
-            needs_reorder = urgency in ("out-of-stock", "critical", "warning")
-            suggested_qty = round(avg_daily * (lead_time_days + 7) - current_stock, 1) if avg_daily > 0 and needs_reorder else 0
-            if suggested_qty < 0:
-                suggested_qty = 0
+            fc = snapshot.forecast(key, lead_time_days, low_stock_threshold)
+            current_stock = fc["currentStock"]
+            avg_daily = round(fc["avgDailyUsage"], 2)
+            days_left = fc["daysUntilStockout"]
+            urgency = fc["reorderUrgency"]
+            needs_reorder = fc["needsReorder"]
+            suggested_qty = fc["suggestedReorderQty"] or 0
 
             unit_for_vendor = unit or "each"
             vendors = _generate_vendors_for_ingredient(ing_name, unit_for_vendor, suggested_qty)
@@ -3136,8 +6622,7 @@ def vendors_pricing():
             })
 
         # Sort by urgency
-        urgency_order = {"out-of-stock": 0, "critical": 1, "warning": 2, "ok": 3}
-        result_items.sort(key=lambda x: (urgency_order.get(x["reorderUrgency"], 4),
+        result_items.sort(key=lambda x: (URGENCY_ORDER.get(x["reorderUrgency"], 4),
                                           x["daysUntilStockout"] if x["daysUntilStockout"] is not None else 9999))
 
         return jsonify({"items": result_items, "supplierLeadTimeDays": lead_time_days}), 200
@@ -3153,9 +6638,8 @@ def vendors_place_order():
     """
     Place a procurement order.  For each item the endpoint:
       1. Looks up (or creates) the master ingredient row.
-      2. Creates a new stock-batch Ingredient row (with a system-generated
-         batchNum like "PO-20260208-0001") and links it to the __STOCK__ dish
-         with the ordered qty/unit.
+      2. Creates a stock_batches row for the ordered qty/unit (with a
+         system-generated batchNum like "PO-20260208-0001").
       3. Logs the action in audit_logs.
     Returns a rich receipt with orderID, PO number, per-item details and ETA.
 
@@ -3183,23 +6667,24 @@ def vendors_place_order():
         # Generate a unique PO number  (PO-YYYYMMDD-XXXX)
         now = datetime.now()
         today_str = now.strftime("%Y%m%d")
-        today_count = AuditLog.query.filter(
-            AuditLog.orgID == org_id,
-            AuditLog.action == "ORDER",
-            AuditLog.timestamp >= now.replace(hour=0, minute=0, second=0, microsecond=0),
+        today_count = audit_window(
+            AuditLog.query.filter(
+                AuditLog.orgID == org_id,
+                AuditLog.action == "ORDER",
+            ),
+            start=now.replace(hour=0, minute=0, second=0, microsecond=0),
         ).count()
         po_number = f"PO-{today_str}-{today_count + 1:04d}"
 
-        stock_dish = get_or_create_stock_dish(org_id)
-
         total_cost = 0.0
         line_items = []
+        deltas = {}
 
         for idx, item in enumerate(items):
             ing_name = (item.get("ingName") or "").strip()
             vendor   = (item.get("vendorName") or "").strip()
             qty_val  = float(item.get("qty", 0))
-            unit_val = (item.get("unit") or "each").strip()
+            unit_val = unit_registry.canonical(item.get("unit")) or "each"
             unit_price = float(item.get("unitPrice", 0))
             cost     = round(float(item.get("totalCost", qty_val * unit_price)), 2)
             total_cost += cost
@@ -3211,8 +6696,7 @@ def vendors_place_order():
             master = Ingredient.query.filter(
                 Ingredient.orgID == org_id,
                 Ingredient.ingName == ing_name,
-                Ingredient.expiry.is_(None),
-                Ingredient.batchNum.is_(None),
+                IS_MASTER,
             ).first()
 
             batch_num = f"{po_number}-{idx + 1:02d}"
@@ -3220,23 +6704,19 @@ def vendors_place_order():
 
             if master:
                 # Create a real stock batch tied to the master ingredient
-                new_batch = Ingredient(
-                    ingName=master.ingName,
-                    category=master.category,
+                new_batch = StockBatch(
+                    orgID=org_id,
+                    masterIngID=master.ingID,
+                    qty=Decimal(str(qty_val)),
+                    unit=unit_val,
                     expiry=estimated_delivery + timedelta(days=90),  # Default 90-day shelf life
                     batchNum=batch_num,
-                    orgID=org_id,
+                    received_at=now,
                 )
                 db.session.add(new_batch)
                 db.session.flush()
-
-                db.session.add(DishIngredient(
-                    dishID=stock_dish.dishID,
-                    ingID=new_batch.ingID,
-                    qty=Decimal(str(qty_val)),
-                    unit=unit_val,
-                ))
-                batch_id = new_batch.ingID
+                stock_delta(deltas, master.ingID, unit_val, new_batch.qty, batches=1)
+                batch_id = new_batch.batchID
             else:
                 batch_id = None  # Ingredient doesn't exist as master — still log it
 
@@ -3253,6 +6733,7 @@ def vendors_place_order():
                 "estimatedDelivery": str(estimated_delivery),
             })
 
+        adjust_stock_on_hand(org_id, deltas)
         record_audit(
             action="ORDER",
             resource_type="procurement",
@@ -3268,6 +6749,7 @@ def vendors_place_order():
             org_id=org_id,
         )
         db.session.commit()
+        stock_analytics.invalidate(org_id)
 
         return jsonify({
             "message": f"Order placed successfully — {len(line_items)} line item(s)",
@@ -3380,4 +6862,5 @@ def vendors_order_export_csv():
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        ensure_reporting_views()
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,227 @@
+"""
+archive_audit_logs.py — Retention job for the append-only audit_logs table.
+
+Moves every whole calendar month older than the retention horizon out of
+MySQL into gzip-compressed NDJSON files (one JSON object per audit row),
+then removes those rows. When audit_logs has been converted to monthly
+RANGE partitions (see database/audit_logs_partitioning.sql) an archived
+month is removed with ALTER TABLE ... DROP PARTITION; otherwise it is
+deleted in small chunks so the job never holds long locks.
+
+Before deleting, CONSUME history in the archived range is replayed into
+the consumption ledger (backfill_consumption_ledger) so forecasting never
+depends on rows that are about to leave the table.
+
+Usage:
+  python archive_audit_logs.py --older-than-days 365 --archive-dir ./archive
+  python archive_audit_logs.py --dry-run            # report what would move
+  python archive_audit_logs.py --add-partitions 3   # pre-create future months
+
+--older-than-days defaults to AUDIT_RETENTION_DAYS from the environment.
+"""
+
+import os
+import sys
+import gzip
+import json
+from datetime import datetime, date, timedelta
+
+# Allow running from back-end/ or project root
+sys.path.insert(0, os.path.dirname(__file__))
+
+from sqlalchemy import text as sql_text
+
+from app import app, db, AuditLog, AUDIT_RETENTION_DAYS, backfill_consumption_ledger
+
+CHUNK_SIZE = 5000
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(value):
+    return date(value.year + (value.month == 12), value.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def list_partitions():
+    """Return {partition_name: upper_bound_literal} or {} if not partitioned."""
+    rows = db.session.execute(sql_text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'audit_logs' "
+        "AND PARTITION_NAME IS NOT NULL"
+    )).all()
+    return {name: description for name, description in rows}
+
+
+def add_partitions(months_ahead):
+    """Split pmax so monthly partitions exist for the next ``months_ahead`` months."""
+    partitions = list_partitions()
+    if "pmax" not in partitions:
+        print("  audit_logs is not partitioned; nothing to do")
+        return
+    month = month_start(datetime.utcnow())
+    new_parts = []
+    for _ in range(months_ahead + 1):
+        if partition_name(month) not in partitions:
+            new_parts.append(
+                f"PARTITION {partition_name(month)} VALUES LESS THAN ('{next_month(month):%Y-%m-%d}')"
+            )
+        month = next_month(month)
+    if not new_parts:
+        print("  partitions already exist")
+        return
+    new_parts.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    db.session.execute(sql_text(
+        f"ALTER TABLE audit_logs REORGANIZE PARTITION pmax INTO ({', '.join(new_parts)})"
+    ))
+    print(f"  added {len(new_parts) - 1} partition(s)")
+
+
+def export_month(month, archive_dir):
+    """Append every row of ``month`` to its archive file. Returns (rows, max_logID)."""
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(next_month(month), datetime.min.time())
+    path = os.path.join(archive_dir, f"audit_logs-{month:%Y-%m}.ndjson.gz")
+    written = 0
+    last_id = 0
+    with gzip.open(path, "at", encoding="utf-8") as fh:
+        while True:
+            logs = (
+                AuditLog.query.filter(
+                    AuditLog.timestamp >= start,
+                    AuditLog.timestamp < end,
+                    AuditLog.logID > last_id,
+                )
+                .order_by(AuditLog.logID.asc())
+                .limit(CHUNK_SIZE)
+                .all()
+            )
+            if not logs:
+                break
+            for log in logs:
+                fh.write(json.dumps({
+                    "logID": log.logID,
+                    "timestamp": log.timestamp.isoformat(),
+                    "userID": log.userID,
+                    "orgID": log.orgID,
+                    "action": log.action,
+                    "resource_type": log.resource_type,
+                    "resource_id": log.resource_id,
+                    "details": log.details,
+                    "ip_address": log.ip_address,
+                }) + "\n")
+            written += len(logs)
+            last_id = logs[-1].logID
+            db.session.expunge_all()
+        fh.flush()
+        os.fsync(fh.fileno())
+    return written, last_id, path
+
+
+def purge_month(month, max_log_id, partitions):
+    """Remove an archived month, dropping its partition when it has one."""
+    name = partition_name(month)
+    if name in partitions:
+        db.session.execute(sql_text(f"ALTER TABLE audit_logs DROP PARTITION {name}"))
+        return
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(next_month(month), datetime.min.time())
+    while True:
+        result = db.session.execute(
+            sql_text(
+                "DELETE FROM audit_logs WHERE timestamp >= :start AND timestamp < :end "
+                "AND logID <= :max_id LIMIT :chunk"
+            ),
+            {"start": start, "end": end, "max_id": max_log_id, "chunk": CHUNK_SIZE},
+        )
+        db.session.commit()
+        if result.rowcount < CHUNK_SIZE:
+            break
+
+
+def backfill_ledger_before(cutoff):
+    """Make sure CONSUME rows about to be archived are reflected in the ledger."""
+    org_ids = [
+        org_id for (org_id,) in db.session.query(AuditLog.orgID).filter(
+            AuditLog.action == "CONSUME",
+            AuditLog.timestamp < cutoff,
+            AuditLog.orgID.isnot(None),
+        ).distinct().all()
+    ]
+    for org_id in org_ids:
+        replayed, _ = backfill_consumption_ledger(org_id)
+        db.session.commit()
+        if replayed:
+            print(f"  org {org_id}: replayed {replayed} CONSUME entries into the ledger")
+
+
+def run(older_than_days, archive_dir, dry_run=False, skip_ledger=False):
+    cutoff = month_start(datetime.utcnow() - timedelta(days=older_than_days))
+    oldest = db.session.query(db.func.min(AuditLog.timestamp)).scalar()
+    if not oldest or oldest.date() >= cutoff:
+        print(f"  nothing older than {cutoff} to archive")
+        return
+
+    months = []
+    month = month_start(oldest)
+    while month < cutoff:
+        months.append(month)
+        month = next_month(month)
+
+    if dry_run:
+        for month in months:
+            start = datetime.combine(month, datetime.min.time())
+            end = datetime.combine(next_month(month), datetime.min.time())
+            count = AuditLog.query.filter(
+                AuditLog.timestamp >= start, AuditLog.timestamp < end,
+            ).count()
+            print(f"  {month:%Y-%m}: {count} rows would be archived")
+        return
+
+    os.makedirs(archive_dir, exist_ok=True)
+    if not skip_ledger:
+        backfill_ledger_before(datetime.combine(cutoff, datetime.min.time()))
+
+    partitions = list_partitions()
+    for month in months:
+        written, max_log_id, path = export_month(month, archive_dir)
+        if written:
+            purge_month(month, max_log_id, partitions)
+        elif partition_name(month) in partitions:
+            purge_month(month, 0, partitions)
+        db.session.commit()
+        print(f"  {month:%Y-%m}: archived {written} rows to {path}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Archive old audit-log rows")
+    parser.add_argument("--older-than-days", type=int, default=AUDIT_RETENTION_DAYS,
+                        help="Retention horizon in days (default: AUDIT_RETENTION_DAYS)")
+    parser.add_argument("--archive-dir", default=os.getenv("AUDIT_ARCHIVE_DIR", "archive"),
+                        help="Directory for the .ndjson.gz files (default: ./archive)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report how many rows each month would move")
+    parser.add_argument("--skip-ledger-backfill", action="store_true",
+                        help="Do not replay archived CONSUME rows into the ledger first")
+    parser.add_argument("--add-partitions", type=int, default=None, metavar="MONTHS",
+                        help="Create monthly partitions this many months ahead and exit")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.add_partitions is not None:
+            print("Extending audit_logs partitions...")
+            add_partitions(args.add_partitions)
+            sys.exit(0)
+        if args.older_than_days <= 0:
+            print("ERROR: set --older-than-days or AUDIT_RETENTION_DAYS to a positive value.")
+            sys.exit(1)
+        print(f"Archiving audit logs older than {args.older_than_days} days...")
+        run(args.older_than_days, args.archive_dir,
+            dry_run=args.dry_run, skip_ledger=args.skip_ledger_backfill)
+        print("  Done!")
@@ -0,0 +1,49 @@
+"""
+backfill_consumption_ledger.py — Rebuild the consumption ledger and its
+daily rollup from existing CONSUME audit-log history.
+
+/stock/consume writes consumption_ledger rows as it deducts stock, but
+consumption recorded before the ledger existed (or by seed_mock_data.py)
+only lives in audit_logs. This script replays every CONSUME entry that has
+no ledger rows yet, re-deriving ingredient usage from current recipes, and
+then recomputes consumption_daily from the full ledger. It is safe to run
+more than once.
+
+Usage:
+  python backfill_consumption_ledger.py --org-id <ORG_ID>
+  python backfill_consumption_ledger.py            # every organisation
+"""
+
+import os
+import sys
+
+# Allow running from back-end/ or project root
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import app, db, Org, backfill_consumption_ledger
+
+
+def run(org_ids):
+    for org_id in org_ids:
+        replayed, written = backfill_consumption_ledger(org_id)
+        db.session.commit()
+        print(f"  org {org_id}: replayed {replayed} CONSUME entries, "
+              f"wrote {written} ledger rows")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Backfill the consumption ledger")
+    parser.add_argument("--org-id", type=int, default=None,
+                        help="Organization ID to backfill (default: all)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        if args.org_id is not None:
+            org_ids = [args.org_id]
+        else:
+            org_ids = [org.orgID for org in Org.query.order_by(Org.orgID.asc()).all()]
+        print(f"Backfilling consumption ledger for {len(org_ids)} organisation(s)...")
+        run(org_ids)
+        print("  Done!")
@@ -0,0 +1,107 @@
+"""
+bench_import.py — Measure the bulk CSV import engine on large synthetic files.
+
+Generates supplier-style CSVs in memory (masters, stock batches and dish
+recipes), runs them through the same functions the /import/* endpoints
+use, and prints rows/second for each phase. Everything happens inside one
+transaction that is rolled back at the end unless --commit is given, so it
+is safe to point at a development database.
+
+Usage:
+  1. Ensure the Flask back-end is configured (DB connection, .env).
+  2. Run:  python bench_import.py --org-id <ORG_ID> --rows 100000
+     (defaults to org 1 and 100k stock rows)
+"""
+
+import os
+import sys
+import csv
+import io
+import random
+from datetime import date, timedelta
+
+# Allow running from back-end/ or project root
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import app, db, Org
+from app import import_ingredient_rows, import_stock_rows, import_dish_rows, numbered_rows
+
+CATEGORIES = ["Produce", "Dairy", "Meat", "Dry Goods", "Seafood"]
+UNITS = ["kg", "g", "L", "ml", "pcs"]
+
+
+def to_csv_rows(headers, records):
+    """Round-trip records through the csv module so parsing cost is included."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=headers)
+    writer.writeheader()
+    writer.writerows(records)
+    buffer.seek(0)
+    return list(csv.DictReader(buffer))
+
+
+def make_files(rows, masters, dishes, seed):
+    rnd = random.Random(seed)
+    names = [f"Bench Ingredient {i:05d}" for i in range(masters)]
+    ingredients = to_csv_rows(["ingName", "category"], [
+        {"ingName": name, "category": rnd.choice(CATEGORIES)} for name in names
+    ])
+    today = date.today()
+    stock = to_csv_rows(["ingName", "batchNum", "expiry", "qty", "unit"], [
+        {
+            "ingName": rnd.choice(names),
+            "batchNum": f"B{i:07d}",
+            "expiry": (today + timedelta(days=rnd.randint(1, 60))).isoformat(),
+            "qty": f"{rnd.uniform(0.5, 50):.2f}",
+            "unit": rnd.choice(UNITS),
+        }
+        for i in range(rows)
+    ])
+    recipe_lines = []
+    for d in range(dishes):
+        for name in rnd.sample(names, k=min(len(names), rnd.randint(3, 8))):
+            recipe_lines.append({
+                "dishName": f"Bench Dish {d:05d}",
+                "ingName": name,
+                "qty": f"{rnd.uniform(0.05, 1):.2f}",
+                "unit": rnd.choice(UNITS),
+            })
+    dishes_csv = to_csv_rows(["dishName", "ingName", "qty", "unit"], recipe_lines)
+    return ingredients, stock, dishes_csv
+
+
+def run_phase(label, func, org_id, rows):
+    report = func(org_id, numbered_rows(rows)).as_dict()
+    print(f"  {label:<12} {report['rows']:>8} rows  {report['created']:>8} created  "
+          f"{report['errorCount']:>5} errors  {report['elapsedMs'] / 1000:>7.2f}s  "
+          f"{report['rowsPerSecond'] or 0:>10.0f} rows/s")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the bulk CSV import engine")
+    parser.add_argument("--org-id", type=int, default=1, help="Target org ID (default: 1)")
+    parser.add_argument("--rows", type=int, default=100_000, help="Stock batch rows (default: 100000)")
+    parser.add_argument("--masters", type=int, default=2_000, help="Master ingredients (default: 2000)")
+    parser.add_argument("--dishes", type=int, default=5_000, help="Dishes (default: 5000)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--commit", action="store_true", help="Keep the imported rows")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not db.session.get(Org, args.org_id):
+            print(f"ERROR: Org {args.org_id} does not exist.")
+            sys.exit(1)
+        print(f"Generating {args.rows} stock rows, {args.masters} masters, {args.dishes} dishes...")
+        ingredients, stock, dishes = make_files(args.rows, args.masters, args.dishes, args.seed)
+        try:
+            run_phase("ingredients", import_ingredient_rows, args.org_id, ingredients)
+            run_phase("stock", import_stock_rows, args.org_id, stock)
+            run_phase("dishes", import_dish_rows, args.org_id, dishes)
+            if args.commit:
+                db.session.commit()
+                print("  Committed.")
+        finally:
+            if not args.commit:
+                db.session.rollback()
+                print("  Rolled back.")
@@ -0,0 +1,230 @@
+"""
+bench_sql_validator.py — Corpus, fuzz run and timing for the chat SQL validator.
+
+Runs analyze_sql() over a corpus of queries the chatbot should be able to
+run and queries that must be refused (cross-org reads, OR-injected filters,
+stacked statements, executable comments, locking reads, ...), then derives
+attack variants from every accepted query and checks they are refused too.
+A random token-soup fuzz run checks the validator only ever answers with
+SqlRejected, never another exception. Finally it prints microseconds per
+query. It also builds the chat system prompt once, since a stray brace in
+that f-string breaks every /chat request. Nothing touches the database.
+
+Usage:
+  1. Ensure the Flask back-end is importable (dependencies installed, .env).
+  2. Run:  python bench_sql_validator.py --fuzz 100000 --repeat 2000
+     Exits non-zero if any corpus entry or fuzz case misbehaves.
+"""
+
+import os
+import sys
+import time
+import random
+
+# Allow running from back-end/ or project root
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import analyze_sql, build_system_prompt, SqlRejected
+
+ORG_ID = 5
+
+ACCEPT = [
+    "SELECT COUNT(*) FROM dishes WHERE orgID = 5 AND dishName != 'Soup'",
+    "SELECT i.ingName, b.qty, b.unit FROM stock_batches b JOIN ing i ON i.ingID = b.masterIngID "
+    "WHERE b.orgID = 5 AND i.orgID = 5 ORDER BY b.expiry",
+    "SELECT * FROM v_current_stock WHERE orgID = 5 ORDER BY totalQty DESC LIMIT 10",
+    "SELECT * FROM dishes d LEFT JOIN ing i ON i.ingID = 3 AND i.orgID = 5 WHERE d.orgID = 5",
+    "SELECT * FROM dishes d WHERE d.orgID = 5 AND EXISTS "
+    "(SELECT 1 FROM dish_ing di WHERE di.dishID = d.dishID)",
+    "WITH r AS (SELECT ingName, SUM(qty) q FROM consumption_daily WHERE orgID = 5 GROUP BY ingName) "
+    "SELECT * FROM r ORDER BY q DESC",
+    "SELECT * FROM (SELECT * FROM ing WHERE orgID = 5) t WHERE t.ingName LIKE 'Tom%'",
+    "SELECT ingName, CAST(SUM(qty) AS DECIMAL(12,2)) FROM consumption_daily WHERE orgID = 5 "
+    "AND day >= CURDATE() - INTERVAL 7 DAY GROUP BY 1 ORDER BY 2 DESC LIMIT 5",
+    "SELECT JSON_UNQUOTE(details->>'$.poNumber') FROM audit_logs WHERE orgID = 5 AND action = 'ORDER'",
+    "SELECT a.* FROM audit_logs a WHERE a.orgID = 5 AND (a.action = 'CONSUME' OR a.action = 'ORDER')",
+    "SELECT * FROM dishes d, users u WHERE d.orgID = 5 AND u.orgID = 5",
+    "SELECT * FROM `dishes` WHERE 5 = `orgID` -- newest first",
+    "UPDATE ing SET ingName = 'Roma Tomato' WHERE orgID = 5 AND ingID = 3",
+    "DELETE FROM dishes WHERE orgID = 5 AND dishID = 3",
+    "INSERT INTO dishes (dishName, orgID) VALUES ('Soup', 5)",
+    "INSERT INTO dishes (dishName, orgID) VALUES ROW('Soup', 5), ROW('Stew', 5)",
+    "SELECT day, SUM(qty) OVER (ORDER BY day ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) "
+    "FROM consumption_daily WHERE orgID = 5",
+    "INSERT INTO stock_batches (orgID, masterIngID, qty, unit, received_at) "
+    "SELECT 5, i.ingID, 2, 'kg', NOW() FROM ing i WHERE i.orgID = 5 AND i.ingName = 'Tomato'",
+    "INSERT INTO dish_ing (dishID, ingID, qty, unit) SELECT d.dishID, i.ingID, 2, 'kg' FROM dishes d "
+    "JOIN ing i ON i.ingName = 'Tomato' AND i.orgID = 5 WHERE d.dishName = 'Soup' AND d.orgID = 5",
+]
+
+REJECT = [
+    "SELECT * FROM dishes",
+    "SELECT * FROM dishes WHERE orgID = 6",
+    "SELECT * FROM dishes WHERE orgID = 5 OR 1=1",
+    "SELECT * FROM dishes WHERE (orgID = 5 OR 1=1)",
+    "SELECT * FROM dishes WHERE orgID = 5 || 1",
+    "SELECT * FROM dishes WHERE NOT (orgID = 5)",
+    "SELECT * FROM dishes WHERE orgID != 5 AND dishName = '5'",
+    "SELECT * FROM dishes WHERE day BETWEEN 1 AND orgID = 5",
+    "SELECT * FROM dishes WHERE orgID = 5 UNION SELECT * FROM users",
+    "SELECT * FROM dishes, users WHERE dishes.orgID = 5",
+    "SELECT i.ingName, b.qty FROM stock_batches b JOIN ing i ON i.ingID = b.masterIngID WHERE i.orgID = 5",
+    "SELECT * FROM ing i LEFT JOIN dishes d ON i.orgID = 5 AND d.orgID = 5",
+    "SELECT * FROM dishes d WHERE d.orgID = 5 AND EXISTS (SELECT 1 FROM dish_ing di WHERE di.qty > 1)",
+    "WITH r AS (SELECT * FROM users) SELECT * FROM r",
+    "SELECT * FROM dishes WHERE orgID = 5; DROP TABLE dishes",
+    "DROP TABLE dishes",
+    "TRUNCATE ing",
+    "SHOW VARIABLES",
+    "SELECT * FROM dishes WHERE orgID = 5 /*! OR 1=1 */",
+    "SELECT SLEEP(10) FROM dishes WHERE orgID = 5",
+    "SELECT * FROM mysql.user",
+    "SELECT * FROM information_schema.tables",
+    "SELECT hashed_pwd FROM users WHERE orgID = 5",
+    "SELECT * FROM dishes WHERE orgID = 5 INTO OUTFILE '/tmp/x'",
+    "SELECT * FROM dishes WHERE orgID = 5 FOR UPDATE",
+    "SELECT @@version FROM dishes WHERE orgID = 5",
+    "SELECT * FROM dishes WHERE orgID = 'unterminated",
+    "UPDATE ing SET orgID = 6 WHERE orgID = 5",
+    "DELETE FROM dishes WHERE dishID = 3",
+    "INSERT INTO dishes (dishName, orgID) VALUES ('Soup', 6)",
+    "INSERT INTO dish_ing (dishID, ingID, qty, unit) VALUES (1, 2, 3, 'kg')",
+    "INSERT INTO audit_logs (orgID, action) VALUES (5, 'X')",
+    "INSERT INTO dishes (dishName, orgID) VALUES ('Soup', 5) ON DUPLICATE KEY UPDATE orgID = 6",
+    "REPLACE INTO dishes (dishID, orgID) VALUES (1, 5)",
+    "SELECT userID, email, uRole, orgID, orgID FROM users WHERE orgID = 5 UNION TABLE users",
+    "SELECT * FROM stock_batches WHERE orgID = 5 UNION TABLE stock_batches",
+    "TABLE users",
+    "SELECT * FROM dishes WHERE orgID = 5 UNION VALUES ROW(1, 2, 3)",
+    "SELECT * FROM (VALUES ROW(1, 5)) t",
+    "INSERT INTO ing (ingName, orgID) VALUES ('x', 5), ROW('y', 6)",
+    "INSERT INTO ing (ingName, orgID) VALUES ROW('y', 6)",
+    "INSERT INTO ing (ingName, orgID) VALUES ('x', 5), (SELECT 'y', 6)",
+    "INSERT INTO ing (ingName, orgID) TABLE ing",
+    "SELECT `SLEEP`(5) FROM dishes WHERE orgID = 5",
+    "INSERT INTO stock_batches (orgID, masterIngID, qty, unit, received_at) VALUES (5, 999, 1, 'kg', NOW())",
+    "INSERT INTO stock_batches (orgID, masterIngID, qty, unit, received_at) "
+    "SELECT 5, i.ingID, 1, 'kg', NOW() FROM ing i WHERE i.ingName = 'Tomato'",
+    "INSERT INTO stock_batches (orgID, masterIngID, qty, unit, received_at) "
+    "SELECT 5, 999, 1, 'kg', NOW() FROM ing i WHERE i.orgID = 5",
+    "INSERT INTO stock_batches SET orgID = 5, masterIngID = 999, qty = 1, unit = 'kg'",
+    "UPDATE stock_batches SET masterIngID = 999 WHERE orgID = 5",
+    "DELETE d FROM dishes d WHERE NOT EXISTS (SELECT 1 FROM orgs o WHERE o.orgID = 5 AND d.orgID = 5)",
+    "SELECT d.* FROM dishes d WHERE EXISTS (SELECT 1 FROM orgs o WHERE o.orgID = 5 AND d.orgID = 5) OR 1=1",
+    "SELECT d.* FROM dishes d WHERE EXISTS (SELECT 1 FROM orgs o WHERE o.orgID = 5 AND d.orgID = 5)",
+    "SELECT * FROM dish_ing di WHERE EXISTS "
+    "(SELECT 1 FROM dishes d WHERE d.orgID = 5 AND di.dishID = d.dishID) OR 1=1",
+    "UPDATE dishes d SET dishName = 'x' WHERE d.dishID IN (SELECT o.orgID FROM orgs o WHERE o.orgID = 5 AND d.orgID = 5)",
+    "SELECT `benchmark`(1000000, MD5('x')) FROM dishes WHERE orgID = 5",
+]
+
+# Ways to turn an accepted query into one that must be refused.
+MUTATIONS = [
+    lambda q: q.replace("= 5", "= 6"),
+    lambda q: q.replace("orgID = 5", "orgID = 5 OR 1 = 1", 1),
+    lambda q: q.replace("orgID = 5", "NOT (orgID = 5)", 1),
+    lambda q: q + "\n; DELETE FROM dishes",
+    lambda q: q.replace("SELECT", "SELECT SLEEP(5),", 1),
+    lambda q: q.replace("SELECT", "SELECT `SLEEP`(5),", 1),
+    lambda q: q + "\nUNION TABLE users",
+    lambda q: q.replace("VALUES ('Soup', 5)", "VALUES ('Soup', 5), ROW('Stew', 6)"),
+    lambda q: q.replace("WHERE", "WHERE 1 = 1 OR", 1),
+]
+
+FUZZ_TOKENS = [
+    "SELECT", "*", "FROM", "dishes", "d", "ing", "i", "dish_ing", "di", "users", "WHERE", "AND", "OR",
+    "orgID", "d.orgID", "=", "5", "6", "(", ")", ",", "JOIN", "LEFT", "ON", "'x'", "UNION", "INSERT",
+    "INTO", "VALUES", "UPDATE", "SET", "DELETE", "WITH", "AS", "BETWEEN", "NOT", "IN", "EXISTS",
+    "GROUP", "BY", "ORDER", "LIMIT", "1", ".", "di.dishID", "d.dishID", "`x`", ";", "--", "/*", "*/",
+    '"', "'", "JSON_TABLE", "USING", "LATERAL", "TABLE", "ROW", "`SLEEP`", "VALUE",
+]
+
+
+def verdict(query):
+    try:
+        analyze_sql(query, ORG_ID)
+        return "accept"
+    except SqlRejected as e:
+        return f"reject ({e})"
+
+
+def check_prompt():
+    try:
+        prompt = build_system_prompt("Bench Org", "org@example.com", "user@example.com", "admin", ORG_ID)
+    except Exception as e:
+        print(f"  build_system_prompt failed: {type(e).__name__}: {e}")
+        return 1
+    if f"orgID = {ORG_ID}" not in prompt:
+        print("  system prompt is missing the org filter rule")
+        return 1
+    return 0
+
+
+def check_corpus():
+    failures = 0
+    for query in ACCEPT:
+        if verdict(query) != "accept":
+            failures += 1
+            print(f"  expected accept: {query}\n    got {verdict(query)}")
+    for query in REJECT:
+        if verdict(query) == "accept":
+            failures += 1
+            print(f"  expected reject: {query}")
+    for query in ACCEPT:
+        for mutate in MUTATIONS:
+            mutated = mutate(query)
+            if mutated != query and verdict(mutated) == "accept":
+                failures += 1
+                print(f"  mutation accepted: {mutated}")
+    return failures
+
+
+def fuzz(cases, seed):
+    rnd = random.Random(seed)
+    failures = 0
+    for _ in range(cases):
+        query = " ".join(rnd.choice(FUZZ_TOKENS) for _ in range(rnd.randint(1, 25)))
+        try:
+            analyze_sql(query, ORG_ID)
+        except SqlRejected:
+            pass
+        except Exception as e:
+            failures += 1
+            if failures <= 10:
+                print(f"  {type(e).__name__}: {e}\n    {query}")
+    return failures
+
+
+def bench(repeat):
+    queries = ACCEPT + REJECT
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            try:
+                analyze_sql(query, ORG_ID)
+            except SqlRejected:
+                pass
+    elapsed = time.perf_counter() - started
+    print(f"  {repeat * len(queries)} validations, {elapsed * 1e6 / (repeat * len(queries)):.1f} µs/query")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Check and time the chat SQL validator")
+    parser.add_argument("--fuzz", type=int, default=100_000, help="Random fuzz cases (default: 100000)")
+    parser.add_argument("--repeat", type=int, default=2_000, help="Benchmark passes over the corpus")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print("Building system prompt...")
+    failures = check_prompt()
+    print("Checking corpus...")
+    failures += check_corpus()
+    print(f"Fuzzing {args.fuzz} random statements...")
+    failures += fuzz(args.fuzz, args.seed)
+    print("Timing...")
+    bench(args.repeat)
+    if failures:
+        print(f"  {failures} failure(s)")
+        sys.exit(1)
+    print("  Done!")
@@ -0,0 +1,107 @@
+"""
+check_recipe_queries.py — Check that recipe loading issues a constant number
+of SQL statements however many dishes an org has.
+
+For each menu size it creates that many synthetic dishes (3-6 ingredients
+each) inside a savepoint, counts the statements the load_recipe_graph()
+call sites send to MySQL, and rolls the savepoint back. A count that grows
+with the menu means an N+1 query crept back in. Nothing is committed.
+
+Usage:
+  1. Ensure the Flask back-end is configured (DB connection, .env).
+  2. Run:  python check_recipe_queries.py --org-id <ORG_ID>
+     (defaults to org 1 and menus of 10 and 400 dishes)
+     Exits non-zero if any call site's statement count differs between sizes.
+"""
+
+import os
+import sys
+import random
+from contextlib import contextmanager
+
+# Allow running from back-end/ or project root
+sys.path.insert(0, os.path.dirname(__file__))
+
+from sqlalchemy import event
+
+from app import app, db, Org
+from app import load_recipe_graph, backfill_consumption_ledger
+from app import import_ingredient_rows, import_dish_rows, numbered_rows
+
+INGREDIENTS = 40
+
+
+@contextmanager
+def count_statements(counter):
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.append(statement)
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def seed_menu(org_id, dishes, seed):
+    rnd = random.Random(seed)
+    names = [f"Query Check Ingredient {i:03d}" for i in range(INGREDIENTS)]
+    import_ingredient_rows(org_id, numbered_rows([{"ingName": name, "category": "Produce"} for name in names]))
+    lines = []
+    for d in range(dishes):
+        for name in rnd.sample(names, k=rnd.randint(3, 6)):
+            lines.append({"dishName": f"Query Check Dish {d:05d}", "ingName": name,
+                          "qty": f"{rnd.uniform(0.1, 1):.2f}", "unit": "kg"})
+    import_dish_rows(org_id, numbered_rows(lines))
+    db.session.flush()
+
+
+def measure(org_id, dishes, seed):
+    """Return {call site: statement count} for a menu of ``dishes`` dishes."""
+    counts = {}
+    savepoint = db.session.begin_nested()
+    try:
+        seed_menu(org_id, dishes, seed)
+        graph = load_recipe_graph(org_id)
+        dish_ids = list(graph)
+        checks = {
+            "load_recipe_graph (org)": lambda: load_recipe_graph(org_id),
+            "load_recipe_graph (dish_ids)": lambda: load_recipe_graph(org_id, dish_ids=dish_ids),
+            "backfill_consumption_ledger": lambda: backfill_consumption_ledger(org_id),
+        }
+        for label, call in checks.items():
+            with count_statements([]) as statements:
+                call()
+            counts[label] = len(statements)
+    finally:
+        savepoint.rollback()
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Check recipe loading for N+1 queries")
+    parser.add_argument("--org-id", type=int, default=1, help="Org to seed the menus in (default: 1)")
+    parser.add_argument("--sizes", default="10,400", help="Comma-separated menu sizes (default: 10,400)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    with app.app_context():
+        if not db.session.get(Org, args.org_id):
+            print(f"ERROR: Org {args.org_id} does not exist.")
+            sys.exit(1)
+        print(f"Counting statements for menus of {', '.join(map(str, sizes))} dishes...")
+        try:
+            results = {size: measure(args.org_id, size, args.seed) for size in sizes}
+        finally:
+            db.session.rollback()
+
+        failures = 0
+        for label in results[sizes[0]]:
+            counts = [results[size][label] for size in sizes]
+            verdict = "ok" if len(set(counts)) == 1 else "FAIL: grows with dish count"
+            failures += verdict != "ok"
+            print(f"  {label:<30} {' / '.join(map(str, counts))} statements  {verdict}")
+        if failures:
+            sys.exit(1)
+        print("  Done!")
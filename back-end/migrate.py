@@ -0,0 +1,227 @@
+"""
+migrate.py — Versioned schema migrations for the StockSense database.
+
+Migrations live in back-end/migrations as NNNN_description.py modules, each
+defining upgrade(op). They are applied in version order and recorded in the
+schema_migrations table. MySQL commits DDL implicitly, so every operation on
+`op` is idempotent (it checks information_schema first): a migration that
+failed half-way, or a database built by db.create_all() that already has the
+column or index, can simply be migrated again.
+
+--check-plans EXPLAINs the hot queries registered in HOT_QUERIES and exits
+non-zero if any of them reads a table with a full scan that no index could
+serve, so a dropped or missing index shows up before it reaches production.
+
+Usage:
+  python migrate.py                 # apply pending migrations
+  python migrate.py --status        # list applied / pending migrations
+  python migrate.py --check-plans   # EXPLAIN the hot queries (see HOT_QUERIES)
+"""
+
+import os
+import re
+import sys
+import hashlib
+import importlib.util
+from datetime import datetime, timedelta
+
+# Allow running from back-end/ or project root
+sys.path.insert(0, os.path.dirname(__file__))
+
+from sqlalchemy import text as sql_text, select, func, and_
+
+from app import app, db, Ingredient, Dish, StockBatch, StockOnHand, AuditLog, ConsumptionDaily
+from app import IS_MASTER, explain_query
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+_MIGRATION_FILE_RE = re.compile(r"^(\d{4})_(\w+)\.py$")
+
+
+class MigrationOps:
+    """Idempotent schema operations handed to each migration's upgrade()."""
+
+    def execute(self, statement, params=None):
+        db.session.execute(sql_text(statement), params or {})
+
+    def _exists(self, table, clause, params):
+        return db.session.execute(sql_text(
+            f"SELECT COUNT(*) FROM information_schema.{table} "
+            f"WHERE TABLE_SCHEMA = DATABASE() AND {clause}"
+        ), params).scalar() > 0
+
+    def has_table(self, table):
+        return self._exists("TABLES", "TABLE_NAME = :t", {"t": table})
+
+    def has_column(self, table, column):
+        return self._exists("COLUMNS", "TABLE_NAME = :t AND COLUMN_NAME = :c", {"t": table, "c": column})
+
+    def has_index(self, table, name):
+        return self._exists("STATISTICS", "TABLE_NAME = :t AND INDEX_NAME = :i", {"t": table, "i": name})
+
+    def add_column(self, table, column, definition):
+        if not self.has_column(table, column):
+            self.execute(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}")
+            print(f"    + {table}.{column}")
+
+    def create_index(self, table, name, columns, unique=False):
+        if not self.has_index(table, name):
+            cols = ", ".join(f"`{c}`" for c in columns)
+            self.execute(f"ALTER TABLE `{table}` ADD {'UNIQUE ' if unique else ''}INDEX `{name}` ({cols})")
+            print(f"    + {table}.{name} ({', '.join(columns)})")
+
+    def drop_index(self, table, name):
+        if self.has_index(table, name):
+            self.execute(f"ALTER TABLE `{table}` DROP INDEX `{name}`")
+            print(f"    - {table}.{name}")
+
+
+def ensure_migrations_table():
+    db.session.execute(sql_text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version INT NOT NULL PRIMARY KEY,"
+        " name VARCHAR(100) NOT NULL,"
+        " checksum CHAR(64) NOT NULL,"
+        " applied_at DATETIME NOT NULL)"
+    ))
+    db.session.commit()
+
+
+def discover_migrations():
+    """Return [(version, name, path, checksum)] sorted by version."""
+    found = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = _MIGRATION_FILE_RE.match(filename)
+        if not match:
+            continue
+        path = os.path.join(MIGRATIONS_DIR, filename)
+        with open(path, "rb") as fh:
+            checksum = hashlib.sha256(fh.read()).hexdigest()
+        found.append((int(match.group(1)), match.group(2), path, checksum))
+    versions = [version for version, *_ in found]
+    if len(versions) != len(set(versions)):
+        raise SystemExit("ERROR: duplicate migration version numbers in migrations/")
+    return found
+
+
+def applied_migrations():
+    rows = db.session.execute(sql_text("SELECT version, checksum FROM schema_migrations")).all()
+    return {version: checksum for version, checksum in rows}
+
+
+def load_migration(path):
+    spec = importlib.util.spec_from_file_location(f"migration_{os.path.basename(path)[:-3]}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def status():
+    applied = applied_migrations()
+    for version, name, _, checksum in discover_migrations():
+        if version not in applied:
+            state = "pending"
+        elif applied[version] != checksum:
+            state = "applied (file changed since)"
+        else:
+            state = "applied"
+        print(f"  {version:04d} {name:<40} {state}")
+
+
+def migrate():
+    applied = applied_migrations()
+    ops = MigrationOps()
+    pending = [m for m in discover_migrations() if m[0] not in applied]
+    if not pending:
+        print("  schema is up to date")
+        return
+    for version, name, path, checksum in pending:
+        print(f"  applying {version:04d} {name}")
+        load_migration(path).upgrade(ops)
+        db.session.execute(
+            sql_text("INSERT INTO schema_migrations (version, name, checksum, applied_at) "
+                     "VALUES (:v, :n, :c, :t)"),
+            {"v": version, "n": name, "c": checksum, "t": datetime.utcnow()},
+        )
+        db.session.commit()
+
+
+# Queries on the request path that must stay index-backed. Each builds the
+# same filter shape app.py uses, for a given org.
+HOT_QUERIES = {
+    "master ingredient by name": lambda org: select(Ingredient.ingID).where(
+        Ingredient.orgID == org, Ingredient.ingName == "Tomato",
+        Ingredient.category == "Produce", IS_MASTER,
+    ),
+    "master ingredient list": lambda org: select(Ingredient.ingID, Ingredient.ingName).where(
+        Ingredient.orgID == org, IS_MASTER,
+    ),
+    "dish by name": lambda org: select(Dish.dishID).where(
+        Dish.orgID == org, Dish.dishName == "Soup",
+    ),
+    "stock batches by expiry": lambda org: select(StockBatch.batchID, Ingredient.ingName).join(
+        Ingredient, and_(Ingredient.ingID == StockBatch.masterIngID, Ingredient.orgID == org),
+    ).where(StockBatch.orgID == org).order_by(StockBatch.expiry.asc()),
+    "stock batches of one type": lambda org: select(StockBatch.batchID, StockBatch.qty).where(
+        StockBatch.orgID == org, StockBatch.masterIngID == 1,
+    ).order_by(StockBatch.expiry.asc()),
+    "stock totals": lambda org: select(Ingredient.ingName, StockBatch.unit, func.sum(StockBatch.qty)).join(
+        Ingredient, and_(Ingredient.ingID == StockBatch.masterIngID, Ingredient.orgID == org),
+    ).where(StockBatch.orgID == org).group_by(Ingredient.ingName, StockBatch.unit),
+    "stock on hand": lambda org: select(Ingredient.ingName, StockOnHand.unit, StockOnHand.qty).join(
+        Ingredient, and_(Ingredient.ingID == StockOnHand.masterIngID, Ingredient.orgID == org),
+    ).where(StockOnHand.orgID == org),
+    "recent audit logs": lambda org: select(AuditLog.logID).where(
+        AuditLog.orgID == org, AuditLog.timestamp >= datetime.utcnow() - timedelta(days=30),
+    ).order_by(AuditLog.timestamp.desc()).limit(50),
+    "audit logs by action": lambda org: select(AuditLog.logID).where(
+        AuditLog.orgID == org, AuditLog.action == "CONSUME",
+        AuditLog.timestamp >= datetime.utcnow() - timedelta(days=30),
+    ),
+    "daily consumption window": lambda org: select(ConsumptionDaily.ingName).where(
+        ConsumptionDaily.orgID == org, ConsumptionDaily.day >= datetime.utcnow().date() - timedelta(days=30),
+    ),
+}
+
+
+def check_plans(org_id):
+    """
+    EXPLAIN every hot query. A full scan the optimizer *chose* on a tiny
+    table is fine; a full scan with no candidate index at all is a failure.
+    """
+    failures = 0
+    for label, build in HOT_QUERIES.items():
+        plan = explain_query(build(org_id))
+        for step in plan:
+            full_scan = (step.get("type") or "").upper() == "ALL"
+            verdict = "ok"
+            if full_scan and not step.get("possible_keys"):
+                verdict = "FAIL: full scan, no usable index"
+                failures += 1
+            elif full_scan:
+                verdict = "full scan chosen (small table?)"
+            print(f"  {label:<28} {step.get('table') or '-':<14} type={step.get('type')} "
+                  f"key={step.get('key')} rows={step.get('rows')}  {verdict}")
+    return failures
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument("--status", action="store_true", help="List applied and pending migrations")
+    parser.add_argument("--check-plans", action="store_true",
+                        help="EXPLAIN the hot queries and fail on unindexed full scans")
+    parser.add_argument("--org-id", type=int, default=1, help="Org used for --check-plans (default: 1)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        ensure_migrations_table()
+        if args.status:
+            status()
+        elif args.check_plans:
+            print("Checking hot query plans...")
+            if check_plans(args.org_id):
+                sys.exit(1)
+        else:
+            print("Migrating...")
+            migrate()
+        print("  Done!")
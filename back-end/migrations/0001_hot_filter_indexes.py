@@ -0,0 +1,24 @@
+"""
+Composite indexes for the hot org-scoped filters.
+
+Adds the generated ing.is_batch column (1 when expiry or batchNum is set)
+so "master types" vs. "stock batches" is an indexable equality instead of
+an IS NULL / OR test, then indexes the access paths app.py uses:
+  ing       (orgID, is_batch, expiry)             batch lists, FIFO order
+  ing       (orgID, ingName, category, is_batch)  master/batch lookup by name
+  dishes    (orgID, dishName)                     dish and __STOCK__ lookup
+  audit_logs (orgID, timestamp), (orgID, action, timestamp) on databases
+  created before those were declared.
+"""
+
+
+def upgrade(op):
+    op.add_column(
+        "ing", "is_batch",
+        "TINYINT(1) GENERATED ALWAYS AS (expiry IS NOT NULL OR batchNum IS NOT NULL) VIRTUAL",
+    )
+    op.create_index("ing", "ix_ing_org_batch_expiry", ["orgID", "is_batch", "expiry"])
+    op.create_index("ing", "ix_ing_org_name_category", ["orgID", "ingName", "category", "is_batch"])
+    op.create_index("dishes", "ix_dishes_org_name", ["orgID", "dishName"])
+    op.create_index("audit_logs", "ix_audit_logs_org_ts", ["orgID", "timestamp"])
+    op.create_index("audit_logs", "ix_audit_logs_org_action_ts", ["orgID", "action", "timestamp"])
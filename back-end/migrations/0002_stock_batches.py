@@ -0,0 +1,94 @@
+"""
+Move stock batches out of the __STOCK__ dish into a stock_batches table.
+
+Batches used to be ing rows with expiry/batchNum set whose quantity lived
+in a dish_ing link to a hidden per-org __STOCK__ dish. This creates
+stock_batches, copies every batch across with its quantity, and then drops
+the old rows:
+  - batchID keeps the old ing.ingID, so consumption_ledger.batchIngID and
+    batch audit entries still point at the right batch;
+  - masterIngID is the org's master type with the same name and category
+    (the lowest ingID if there are duplicates); a master is created first
+    for batches that never had one;
+  - received_at is the batch's CREATE audit timestamp, or now.
+Every step is guarded, so a failed run can be applied again.
+"""
+
+STOCK_DISH_NAME = "__STOCK__"
+
+
+def upgrade(op):
+    if not op.has_table("stock_batches"):
+        op.execute("""
+            CREATE TABLE `stock_batches` (
+              `batchID` int NOT NULL AUTO_INCREMENT,
+              `orgID` int NOT NULL,
+              `masterIngID` int NOT NULL,
+              `qty` decimal(12,3) NOT NULL DEFAULT '0.000',
+              `unit` varchar(20) NOT NULL,
+              `expiry` date DEFAULT NULL,
+              `batchNum` varchar(50) DEFAULT NULL,
+              `received_at` datetime NOT NULL,
+              PRIMARY KEY (`batchID`),
+              KEY `ix_stock_batches_org_expiry` (`orgID`,`expiry`),
+              KEY `ix_stock_batches_org_master_expiry` (`orgID`,`masterIngID`,`expiry`),
+              CONSTRAINT `stock_batches_ibfk_1` FOREIGN KEY (`orgID`) REFERENCES `orgs` (`orgID`),
+              CONSTRAINT `stock_batches_ibfk_2` FOREIGN KEY (`masterIngID`) REFERENCES `ing` (`ingID`)
+            )
+        """)
+        print("    + stock_batches")
+
+    # Masters for batches whose type was deleted (or never existed)
+    op.execute("""
+        INSERT INTO ing (ingName, category, orgID)
+        SELECT DISTINCT b.ingName, b.category, b.orgID
+        FROM ing b
+        WHERE b.is_batch = 1 AND b.orgID IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM ing m
+              WHERE m.orgID = b.orgID AND m.ingName = b.ingName
+                AND m.category <=> b.category AND m.is_batch = 0
+          )
+    """)
+
+    op.execute("""
+        INSERT INTO stock_batches
+            (batchID, orgID, masterIngID, qty, unit, expiry, batchNum, received_at)
+        SELECT b.ingID, b.orgID,
+               (SELECT MIN(m.ingID) FROM ing m
+                WHERE m.orgID = b.orgID AND m.ingName = b.ingName
+                  AND m.category <=> b.category AND m.is_batch = 0),
+               COALESCE(di.qty, 0), COALESCE(di.unit, ''), b.expiry, b.batchNum,
+               COALESCE(
+                   (SELECT MIN(a.timestamp) FROM audit_logs a
+                    WHERE a.orgID = b.orgID AND a.action = 'CREATE'
+                      AND a.resource_type = 'batch' AND a.resource_id = b.ingID),
+                   NOW())
+        FROM ing b
+        LEFT JOIN (
+            SELECT orgID, MIN(dishID) AS dishID FROM dishes
+            WHERE dishName = :stock GROUP BY orgID
+        ) sd ON sd.orgID = b.orgID
+        LEFT JOIN dish_ing di ON di.dishID = sd.dishID AND di.ingID = b.ingID
+        WHERE b.is_batch = 1 AND b.orgID IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM stock_batches s WHERE s.batchID = b.ingID)
+    """, {"stock": STOCK_DISH_NAME})
+
+    # Drop the old representation: __STOCK__ links and dishes, any other
+    # links to moved batch rows, then the batch rows themselves.
+    op.execute("""
+        DELETE di FROM dish_ing di
+        JOIN dishes d ON d.dishID = di.dishID
+        WHERE d.dishName = :stock
+    """, {"stock": STOCK_DISH_NAME})
+    op.execute("DELETE FROM dishes WHERE dishName = :stock", {"stock": STOCK_DISH_NAME})
+    op.execute("""
+        DELETE di FROM dish_ing di
+        JOIN stock_batches s ON s.batchID = di.ingID
+        JOIN ing b ON b.ingID = di.ingID AND b.is_batch = 1
+    """)
+    op.execute("""
+        DELETE b FROM ing b
+        JOIN stock_batches s ON s.batchID = b.ingID
+        WHERE b.is_batch = 1
+    """)
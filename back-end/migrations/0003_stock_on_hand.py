@@ -0,0 +1,34 @@
+"""
+Running stock totals per (org, master ingredient, unit).
+
+stock_on_hand is kept in step with stock_batches by every endpoint that
+writes batches (see adjust_stock_on_hand in app.py), so "how much Tomato
+do we have" is a primary-key lookup instead of a SUM over batches. This
+creates the table and fills it from the current batches; rerunning it
+simply rebuilds the totals.
+"""
+
+
+def upgrade(op):
+    if not op.has_table("stock_on_hand"):
+        op.execute("""
+            CREATE TABLE `stock_on_hand` (
+              `orgID` int NOT NULL,
+              `masterIngID` int NOT NULL,
+              `unit` varchar(20) NOT NULL,
+              `qty` decimal(14,3) NOT NULL DEFAULT '0.000',
+              `batchCount` int NOT NULL DEFAULT '0',
+              PRIMARY KEY (`orgID`,`masterIngID`,`unit`),
+              CONSTRAINT `stock_on_hand_ibfk_1` FOREIGN KEY (`orgID`) REFERENCES `orgs` (`orgID`),
+              CONSTRAINT `stock_on_hand_ibfk_2` FOREIGN KEY (`masterIngID`) REFERENCES `ing` (`ingID`)
+            )
+        """)
+        print("    + stock_on_hand")
+
+    op.execute("DELETE FROM stock_on_hand")
+    op.execute("""
+        INSERT INTO stock_on_hand (orgID, masterIngID, unit, qty, batchCount)
+        SELECT orgID, masterIngID, unit, SUM(qty), COUNT(*)
+        FROM stock_batches
+        GROUP BY orgID, masterIngID, unit
+    """)
@@ -0,0 +1,11 @@
+"""
+Heartbeat for background import jobs.
+
+Workers refresh import_jobs.heartbeat_at while a job is queued or running,
+so a job whose worker died (restart, crash, OOM kill) can be told apart
+from a slow one and settled by recover_import_jobs in app.py.
+"""
+
+
+def upgrade(op):
+    op.add_column("import_jobs", "heartbeat_at", "DATETIME DEFAULT NULL")
@@ -0,0 +1,12 @@
+"""
+Token for an org's pending background geocode.
+
+apply_org_location writes a fresh orgs.geocode_token whenever it queues a
+lookup (and clears it when the location is set any other way); the lookup
+only stores its coordinates if the token is still its own, so a slow
+lookup for an older address can't overwrite a newer one.
+"""
+
+
+def upgrade(op):
+    op.add_column("orgs", "geocode_token", "VARCHAR(32) DEFAULT NULL")
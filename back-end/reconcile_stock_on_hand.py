@@ -0,0 +1,72 @@
+"""
+reconcile_stock_on_hand.py — Check the running stock totals against the
+stock batches they summarise.
+
+Every endpoint that writes stock_batches adjusts stock_on_hand in the same
+transaction, but a manual SQL fix or a bug could still let the two drift
+apart. This script recomputes each org's totals from stock_batches, prints
+every (ingredient, unit) whose stored total or batch count differs, and
+with --fix rewrites the org's totals from the batches.
+
+Exits non-zero if drift was found and not fixed, so it can run from cron.
+
+Usage:
+  python reconcile_stock_on_hand.py --org-id <ORG_ID>
+  python reconcile_stock_on_hand.py            # every organisation
+  python reconcile_stock_on_hand.py --fix      # report, then rebuild
+"""
+
+import os
+import sys
+
+# Allow running from back-end/ or project root
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app import app, db, Org, Ingredient, stock_on_hand_drift, rebuild_stock_on_hand
+
+
+def run(org_ids, fix):
+    drifted = 0
+    for org_id in org_ids:
+        drift = stock_on_hand_drift(org_id)
+        if not drift:
+            print(f"  org {org_id}: in sync")
+            continue
+        drifted += 1
+        names = dict(
+            db.session.query(Ingredient.ingID, Ingredient.ingName)
+            .filter(Ingredient.ingID.in_([row["masterIngID"] for row in drift]))
+            .all()
+        )
+        print(f"  org {org_id}: {len(drift)} total(s) drifted")
+        for row in drift:
+            name = names.get(row["masterIngID"], f"ing {row['masterIngID']}")
+            print(f"    {name} [{row['unit']}]: stored {row['actualQty']:g} in {row['actualBatches']} batch(es), "
+                  f"batches say {row['expectedQty']:g} in {row['expectedBatches']}")
+        if fix:
+            rebuild_stock_on_hand(org_id)
+            db.session.commit()
+            print("    rebuilt from stock_batches")
+    db.session.rollback()
+    return drifted
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Reconcile stock_on_hand with stock_batches")
+    parser.add_argument("--org-id", type=int, default=None,
+                        help="Organization ID to check (default: all)")
+    parser.add_argument("--fix", action="store_true", help="Rebuild drifted totals from the batches")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.org_id is not None:
+            org_ids = [args.org_id]
+        else:
+            org_ids = [org.orgID for org in Org.query.order_by(Org.orgID.asc()).all()]
+        print(f"Reconciling stock totals for {len(org_ids)} organisation(s)...")
+        drifted = run(org_ids, args.fix)
+        if drifted and not args.fix:
+            print(f"  {drifted} organisation(s) drifted; rerun with --fix to rebuild")
+            sys.exit(1)
+        print("  Done!")
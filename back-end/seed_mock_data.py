@@ -33,8 +33,10 @@ from decimal import Decimal
 # Allow running from back-end/ or project root
 sys.path.insert(0, os.path.dirname(__file__))
 
-from app import app, db, Org, User, Dish, Ingredient, DishIngredient, AuditLog
-from app import STOCK_DISH_NAME, get_or_create_stock_dish, record_audit
+from app import app, db, Org, User, Dish, Ingredient, DishIngredient, StockBatch, StockOnHand, AuditLog
+from app import ConsumptionLedger, ConsumptionDaily
+from app import record_audit, rebuild_stock_on_hand
+from app import backfill_consumption_ledger
 
 # ---------------------------------------------------------------------------
 # Master data
@@ -134,10 +136,14 @@ DISHES = [
 
 def clear_org_data(org_id):
     """Remove existing seeded data for the org so the script is idempotent."""
-    # Delete audit logs
+    # Delete audit logs and the consumption ledger derived from them
     AuditLog.query.filter_by(orgID=org_id).delete()
+    ConsumptionLedger.query.filter_by(orgID=org_id).delete()
+    ConsumptionDaily.query.filter_by(orgID=org_id).delete()
 
-    # Delete dish_ing links, dishes, ingredients
+    # Delete stock batches, dish_ing links, dishes, ingredients
+    StockOnHand.query.filter_by(orgID=org_id).delete()
+    StockBatch.query.filter_by(orgID=org_id).delete()
     dishes = Dish.query.filter_by(orgID=org_id).all()
     for d in dishes:
         DishIngredient.query.filter_by(dishID=d.dishID).delete()
@@ -191,42 +197,30 @@ def seed(org_id: int):
     print(f"  Created {len(dish_map)} dishes with recipes")
 
     # ---- 3. Create stock batches ----
-    stock_dish = get_or_create_stock_dish(org_id)
     today = datetime.utcnow().date()
     batch_count = 0
 
     # For each ingredient, create 2-4 batches with staggered expiry
-    batch_ings = {}  # name -> list of batch Ingredient records
     for name, category, shelf_range, default_unit in INGREDIENTS:
         num_batches = random.randint(2, 4)
-        batch_ings[name] = []
         for b in range(num_batches):
             days_offset = random.randint(-3, shelf_range[1])
             expiry = today + timedelta(days=days_offset)
             batch_num = f"B{random.randint(1000, 9999)}"
-            batch = Ingredient(
-                ingName=name,
-                category=category,
-                expiry=expiry,
-                batchNum=batch_num,
-                orgID=org_id,
-            )
-            db.session.add(batch)
-            db.session.flush()
-
-            # Stock quantity
             base_qty = random.uniform(3, 25)
-            link = DishIngredient(
-                dishID=stock_dish.dishID,
-                ingID=batch.ingID,
+            db.session.add(StockBatch(
+                orgID=org_id,
+                masterIngID=ing_map[name].ingID,
                 qty=Decimal(str(round(base_qty, 1))),
                 unit=default_unit,
-            )
-            db.session.add(link)
-            batch_ings[name].append(batch)
+                expiry=expiry,
+                batchNum=batch_num,
+                received_at=datetime.utcnow() - timedelta(days=random.randint(1, 10)),
+            ))
             batch_count += 1
 
     db.session.flush()
+    rebuild_stock_on_hand(org_id)
     print(f"  Created {batch_count} stock batches")
 
     # ---- 4. Simulate 30 days of consumption (audit log entries) ----
@@ -267,6 +261,10 @@ def seed(org_id: int):
     db.session.flush()
     print(f"  Created {consumption_count} simulated consumption records (30 days)")
 
+    # ---- 5. Materialise the consumption ledger used by forecasting ----
+    _, ledger_rows = backfill_consumption_ledger(org_id)
+    print(f"  Built {ledger_rows} consumption ledger rows")
+
     db.session.commit()
     print("  Done! Mock data seeded successfully.\n")
     print("  Data assumptions:")
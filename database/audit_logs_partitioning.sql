@@ -0,0 +1,39 @@
+-- Convert `audit_logs` to monthly RANGE partitions on `timestamp`.
+--
+-- MySQL requires the partitioning column in every unique key and does not
+-- allow foreign keys on partitioned InnoDB tables, so this drops the two
+-- FKs and widens the primary key to (logID, timestamp). logID stays
+-- AUTO_INCREMENT and unique in practice.
+--
+-- After this runs, `python back-end/archive_audit_logs.py` drops archived
+-- months with DROP PARTITION, and `--add-partitions N` keeps future months
+-- split out of `pmax`. Queries that bound `timestamp` (see audit_window()
+-- in back-end/app.py) only touch the partitions they need.
+--
+-- Adjust the first monthly partition to the month of your oldest row.
+
+ALTER TABLE `audit_logs`
+  DROP FOREIGN KEY `audit_logs_ibfk_1`,
+  DROP FOREIGN KEY `audit_logs_ibfk_2`;
+
+ALTER TABLE `audit_logs`
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (`logID`, `timestamp`);
+
+ALTER TABLE `audit_logs`
+  PARTITION BY RANGE COLUMNS (`timestamp`) (
+    PARTITION p202512 VALUES LESS THAN ('2026-01-01'),
+    PARTITION p202601 VALUES LESS THAN ('2026-02-01'),
+    PARTITION p202602 VALUES LESS THAN ('2026-03-01'),
+    PARTITION p202603 VALUES LESS THAN ('2026-04-01'),
+    PARTITION p202604 VALUES LESS THAN ('2026-05-01'),
+    PARTITION p202605 VALUES LESS THAN ('2026-06-01'),
+    PARTITION p202606 VALUES LESS THAN ('2026-07-01'),
+    PARTITION p202607 VALUES LESS THAN ('2026-08-01'),
+    PARTITION p202608 VALUES LESS THAN ('2026-09-01'),
+    PARTITION p202609 VALUES LESS THAN ('2026-10-01'),
+    PARTITION p202610 VALUES LESS THAN ('2026-11-01'),
+    PARTITION p202611 VALUES LESS THAN ('2026-12-01'),
+    PARTITION p202612 VALUES LESS THAN ('2027-01-01'),
+    PARTITION pmax VALUES LESS THAN (MAXVALUE)
+  );
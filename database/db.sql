@@ -15,6 +15,79 @@
 /*!40101 SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */;
 /*!40111 SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0 */;
 
+--
+-- Table structure for table `audit_logs`
+--
+
+DROP TABLE IF EXISTS `audit_logs`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `audit_logs` (
+  `logID` int NOT NULL AUTO_INCREMENT,
+  `timestamp` datetime NOT NULL,
+  `userID` int DEFAULT NULL,
+  `orgID` int DEFAULT NULL,
+  `action` varchar(50) NOT NULL,
+  `resource_type` varchar(50) NOT NULL,
+  `resource_id` int DEFAULT NULL,
+  `details` text,
+  `ip_address` varchar(45) DEFAULT NULL,
+  PRIMARY KEY (`logID`),
+  KEY `userID` (`userID`),
+  KEY `ix_audit_logs_org_ts` (`orgID`,`timestamp`),
+  KEY `ix_audit_logs_org_action_ts` (`orgID`,`action`,`timestamp`),
+  CONSTRAINT `audit_logs_ibfk_1` FOREIGN KEY (`userID`) REFERENCES `users` (`userID`),
+  CONSTRAINT `audit_logs_ibfk_2` FOREIGN KEY (`orgID`) REFERENCES `orgs` (`orgID`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `consumption_daily`
+--
+
+DROP TABLE IF EXISTS `consumption_daily`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `consumption_daily` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `orgID` int NOT NULL,
+  `day` date NOT NULL,
+  `ingName` varchar(100) NOT NULL,
+  `category` varchar(50) NOT NULL DEFAULT '',
+  `unit` varchar(20) NOT NULL DEFAULT '',
+  `qty` decimal(14,3) NOT NULL DEFAULT '0.000',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_consumption_daily_key` (`orgID`,`day`,`ingName`,`category`,`unit`),
+  CONSTRAINT `consumption_daily_ibfk_1` FOREIGN KEY (`orgID`) REFERENCES `orgs` (`orgID`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `consumption_ledger`
+--
+
+DROP TABLE IF EXISTS `consumption_ledger`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `consumption_ledger` (
+  `entryID` int NOT NULL AUTO_INCREMENT,
+  `orgID` int NOT NULL,
+  `logID` int DEFAULT NULL,
+  `dishID` int DEFAULT NULL,
+  `batchIngID` int DEFAULT NULL,
+  `ingName` varchar(100) NOT NULL,
+  `category` varchar(50) NOT NULL DEFAULT '',
+  `unit` varchar(20) NOT NULL DEFAULT '',
+  `qty` decimal(12,3) NOT NULL,
+  `day` date NOT NULL,
+  `timestamp` datetime NOT NULL,
+  PRIMARY KEY (`entryID`),
+  KEY `ix_consumption_ledger_org_day` (`orgID`,`day`),
+  KEY `ix_consumption_ledger_log` (`logID`),
+  CONSTRAINT `consumption_ledger_ibfk_1` FOREIGN KEY (`orgID`) REFERENCES `orgs` (`orgID`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `dish_ing`
 --
@@ -56,6 +129,7 @@ CREATE TABLE `dishes` (
   `orgID` int DEFAULT NULL,
   PRIMARY KEY (`dishID`),
   KEY `orgID` (`orgID`),
+  KEY `ix_dishes_org_name` (`orgID`,`dishName`),
   CONSTRAINT `dishes_ibfk_1` FOREIGN KEY (`orgID`) REFERENCES `orgs` (`orgID`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -69,6 +143,55 @@ LOCK TABLES `dishes` WRITE;
 /*!40000 ALTER TABLE `dishes` ENABLE KEYS */;
 UNLOCK TABLES;
 
+--
+-- Table structure for table `geocode_cache`
+--
+
+DROP TABLE IF EXISTS `geocode_cache`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `geocode_cache` (
+  `addressKey` varchar(64) NOT NULL,
+  `address` varchar(255) NOT NULL,
+  `latCoord` decimal(10,8) DEFAULT NULL,
+  `longCoord` decimal(11,8) DEFAULT NULL,
+  `provider` varchar(20) NOT NULL,
+  `updated_at` datetime NOT NULL,
+  PRIMARY KEY (`addressKey`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `import_jobs`
+--
+
+DROP TABLE IF EXISTS `import_jobs`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `import_jobs` (
+  `jobID` varchar(32) NOT NULL,
+  `orgID` int NOT NULL,
+  `userID` int DEFAULT NULL,
+  `kind` varchar(20) NOT NULL,
+  `status` varchar(20) NOT NULL DEFAULT 'queued',
+  `rows` int NOT NULL DEFAULT '0',
+  `created` int NOT NULL DEFAULT '0',
+  `skipped` int NOT NULL DEFAULT '0',
+  `error_count` int NOT NULL DEFAULT '0',
+  `errors` text,
+  `message` varchar(255) DEFAULT NULL,
+  `created_at` datetime NOT NULL,
+  `started_at` datetime DEFAULT NULL,
+  `finished_at` datetime DEFAULT NULL,
+  `heartbeat_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`jobID`),
+  KEY `ix_import_jobs_org_created` (`orgID`,`created_at`),
+  KEY `userID` (`userID`),
+  CONSTRAINT `import_jobs_ibfk_1` FOREIGN KEY (`orgID`) REFERENCES `orgs` (`orgID`),
+  CONSTRAINT `import_jobs_ibfk_2` FOREIGN KEY (`userID`) REFERENCES `users` (`userID`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `ing`
 --
@@ -83,8 +206,11 @@ CREATE TABLE `ing` (
   `expiry` date DEFAULT NULL,
   `batchNum` varchar(50) DEFAULT NULL,
   `orgID` int DEFAULT NULL,
+  `is_batch` tinyint(1) GENERATED ALWAYS AS (((`expiry` is not null) or (`batchNum` is not null))) VIRTUAL,
   PRIMARY KEY (`ingID`),
   KEY `orgID` (`orgID`),
+  KEY `ix_ing_org_batch_expiry` (`orgID`,`is_batch`,`expiry`),
+  KEY `ix_ing_org_name_category` (`orgID`,`ingName`,`category`,`is_batch`),
   CONSTRAINT `ing_ibfk_1` FOREIGN KEY (`orgID`) REFERENCES `orgs` (`orgID`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -111,6 +237,7 @@ CREATE TABLE `orgs` (
   `latCoord` decimal(10,8) DEFAULT NULL,
   `longCoord` decimal(11,8) DEFAULT NULL,
   `org_email` varchar(100) DEFAULT NULL,
+  `geocode_token` varchar(32) DEFAULT NULL,
   PRIMARY KEY (`orgID`)
 ) ENGINE=InnoDB AUTO_INCREMENT=8 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -121,10 +248,97 @@ CREATE TABLE `orgs` (
 
 LOCK TABLES `orgs` WRITE;
 /*!40000 ALTER TABLE `orgs` DISABLE KEYS */;
-INSERT INTO `orgs` VALUES (7,'Test',NULL,NULL,'dg53175@uga.edu');
+INSERT INTO `orgs` VALUES (7,'Test',NULL,NULL,'dg53175@uga.edu',NULL);
 /*!40000 ALTER TABLE `orgs` ENABLE KEYS */;
 UNLOCK TABLES;
 
+--
+-- Table structure for table `schema_migrations`
+--
+
+DROP TABLE IF EXISTS `schema_migrations`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `schema_migrations` (
+  `version` int NOT NULL,
+  `name` varchar(100) NOT NULL,
+  `checksum` char(64) NOT NULL,
+  `applied_at` datetime NOT NULL,
+  PRIMARY KEY (`version`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `schema_migrations`
+--
+
+LOCK TABLES `schema_migrations` WRITE;
+/*!40000 ALTER TABLE `schema_migrations` DISABLE KEYS */;
+INSERT INTO `schema_migrations` VALUES (1,'hot_filter_indexes','af2eebb27ba097d580144770def99925c6671236a06e6909d71d0b4759234627','2026-10-17 00:00:00'),(2,'stock_batches','38cbfa1d6f6c9bd641c4faf473b5bf9dd89f3e0d7c61ae45a89b76173c9a5329','2026-10-17 00:00:00'),(3,'stock_on_hand','16a1887c60adb1defd7b1da62516252ca13b3a5bddb3072d8346a25e3a43eda4','2026-10-17 00:00:00'),(4,'import_job_heartbeat','fe6ad65228fc651f0f4328dd892a15ef2e8afe5adc80eb324cefd46007479aab','2026-10-17 00:00:00'),(5,'org_geocode_token','db1f5d4430946a13befe9ab9595ba0de058e070bf1d0b007d3de732e92c6ce73','2026-10-17 00:00:00');
+/*!40000 ALTER TABLE `schema_migrations` ENABLE KEYS */;
+UNLOCK TABLES;
+
+--
+-- Table structure for table `stock_batches`
+--
+
+DROP TABLE IF EXISTS `stock_batches`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `stock_batches` (
+  `batchID` int NOT NULL AUTO_INCREMENT,
+  `orgID` int NOT NULL,
+  `masterIngID` int NOT NULL,
+  `qty` decimal(12,3) NOT NULL DEFAULT '0.000',
+  `unit` varchar(20) NOT NULL,
+  `expiry` date DEFAULT NULL,
+  `batchNum` varchar(50) DEFAULT NULL,
+  `received_at` datetime NOT NULL,
+  PRIMARY KEY (`batchID`),
+  KEY `ix_stock_batches_org_expiry` (`orgID`,`expiry`),
+  KEY `ix_stock_batches_org_master_expiry` (`orgID`,`masterIngID`,`expiry`),
+  CONSTRAINT `stock_batches_ibfk_1` FOREIGN KEY (`orgID`) REFERENCES `orgs` (`orgID`),
+  CONSTRAINT `stock_batches_ibfk_2` FOREIGN KEY (`masterIngID`) REFERENCES `ing` (`ingID`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `stock_batches`
+--
+
+LOCK TABLES `stock_batches` WRITE;
+/*!40000 ALTER TABLE `stock_batches` DISABLE KEYS */;
+/*!40000 ALTER TABLE `stock_batches` ENABLE KEYS */;
+UNLOCK TABLES;
+
+--
+-- Table structure for table `stock_on_hand`
+--
+
+DROP TABLE IF EXISTS `stock_on_hand`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `stock_on_hand` (
+  `orgID` int NOT NULL,
+  `masterIngID` int NOT NULL,
+  `unit` varchar(20) NOT NULL,
+  `qty` decimal(14,3) NOT NULL DEFAULT '0.000',
+  `batchCount` int NOT NULL DEFAULT '0',
+  PRIMARY KEY (`orgID`,`masterIngID`,`unit`),
+  CONSTRAINT `stock_on_hand_ibfk_1` FOREIGN KEY (`orgID`) REFERENCES `orgs` (`orgID`),
+  CONSTRAINT `stock_on_hand_ibfk_2` FOREIGN KEY (`masterIngID`) REFERENCES `ing` (`ingID`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `stock_on_hand`
+--
+
+LOCK TABLES `stock_on_hand` WRITE;
+/*!40000 ALTER TABLE `stock_on_hand` DISABLE KEYS */;
+/*!40000 ALTER TABLE `stock_on_hand` ENABLE KEYS */;
+UNLOCK TABLES;
+
 --
 -- Table structure for table `users`
 --
@@ -0,0 +1,35 @@
+-- Read-only reporting views used by the /chat assistant's SQL tool.
+-- Mirrors REPORTING_VIEWS in back-end/app.py (ensure_reporting_views()
+-- creates them when the app is started directly). MySQL has no
+-- materialized views; these stay cheap because they read the indexed
+-- consumption_daily rollup, the (orgID, action, timestamp) audit index,
+-- and the (orgID, expiry) index on stock_batches.
+
+CREATE OR REPLACE VIEW v_current_stock AS
+SELECT b.orgID, i.ingName, i.category, b.unit,
+       SUM(b.qty) AS totalQty,
+       COUNT(*) AS batchCount,
+       MIN(b.expiry) AS nextExpiry
+FROM stock_batches b
+JOIN ing i ON i.ingID = b.masterIngID AND i.orgID = b.orgID
+WHERE b.qty > 0
+GROUP BY b.orgID, i.ingName, i.category, b.unit;
+
+CREATE OR REPLACE VIEW v_consumption_recent AS
+SELECT orgID, ingName, category, unit,
+       SUM(CASE WHEN day >= CURDATE() - INTERVAL 7 DAY THEN qty ELSE 0 END) AS last7DaysQty,
+       SUM(qty) AS last30DaysQty,
+       ROUND(SUM(qty) / 30, 3) AS avgDailyQty30
+FROM consumption_daily
+WHERE day >= CURDATE() - INTERVAL 30 DAY
+GROUP BY orgID, ingName, category, unit;
+
+CREATE OR REPLACE VIEW v_open_orders AS
+SELECT logID, orgID, userID, timestamp AS placedAt,
+       JSON_UNQUOTE(JSON_EXTRACT(details, '$.poNumber')) AS poNumber,
+       CAST(JSON_EXTRACT(details, '$.totalCost') AS DECIMAL(12,2)) AS totalCost,
+       JSON_LENGTH(details, '$.orderItems') AS itemCount,
+       CAST(JSON_UNQUOTE(JSON_EXTRACT(details, '$.estimatedDelivery')) AS DATE) AS estimatedDelivery
+FROM audit_logs
+WHERE action = 'ORDER'
+  AND CAST(JSON_UNQUOTE(JSON_EXTRACT(details, '$.estimatedDelivery')) AS DATE) >= CURDATE();
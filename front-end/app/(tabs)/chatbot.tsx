@@ -128,6 +128,7 @@ export default function Chatbot() {
     const [input, setInput] = useState('');
     const [isLoading, setIsLoading] = useState(false);
     const [lastMessageId, setLastMessageId] = useState<string | null>(null);
+    const [conversationId, setConversationId] = useState<string | null>(null);
     const flatListRef = useRef<any>(null);
     const router = useRouter();
 
@@ -147,11 +148,19 @@ export default function Chatbot() {
         setIsLoading(true);
 
         try {
-            const response = await api.post('/chat', {
-                message: userMessage.text,
-            });
+            let response;
+            try {
+                response = await api.post('/chat', conversationId
+                    ? { message: userMessage.text, conversationId }
+                    : { message: userMessage.text });
+            } catch (error: any) {
+                // Server no longer has this conversation; start a new one
+                if (error?.response?.data?.code !== 'conversation_expired') throw error;
+                response = await api.post('/chat', { message: userMessage.text });
+            }
 
             const data = response.data;
+            if (data.conversationId) setConversationId(data.conversationId);
 
             const botMessage: Message = {
                 id: (Date.now() + 1).toString(),
@@ -102,6 +102,7 @@ interface ChatTab {
     id: number;
     label: string;
     messages: Message[];
+    conversationId?: string;
 }
 
 function createTab(id: number): ChatTab {
@@ -280,20 +281,33 @@ export default function ChatWidget({ isOpen, onClose }: ChatWidgetProps) {
         setTimeout(() => scrollViewRef.current?.scrollToEnd({ animated: true }), 100);
 
         try {
-            // Build conversation history for context (excluding the greeting)
+            // Build conversation history for context (excluding the greeting).
+            // The server keeps history per conversationId, so it is only sent
+            // to start a conversation or when the server has expired it.
             const history = messages
                 .filter(m => m.id !== 'greeting')
                 .map(m => ({
                     role: m.isUser ? 'user' : 'model',
                     text: m.text,
                 }));
-
-            const response = await api.post('/chat', {
-                message: userMessage.text,
-                history,
-            });
+            const conversationId = activeTab?.conversationId;
+
+            let response;
+            try {
+                response = await api.post('/chat', conversationId
+                    ? { message: userMessage.text, conversationId }
+                    : { message: userMessage.text, history });
+            } catch (error: any) {
+                if (error?.response?.data?.code !== 'conversation_expired') throw error;
+                response = await api.post('/chat', { message: userMessage.text, conversationId, history });
+            }
 
             const data = response.data;
+            if (data.conversationId && data.conversationId !== conversationId) {
+                setTabs(prev => prev.map(tab =>
+                    tab.id === activeTabId ? { ...tab, conversationId: data.conversationId } : tab
+                ));
+            }
 
             const aiMessage: Message = {
                 id: (Date.now() + 1).toString(),